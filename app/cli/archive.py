@@ -0,0 +1,41 @@
+"""Перенос давно закрытых заявок в архивные таблицы (то же, что бот делает ночью).
+
+    python -m app.cli.archive                   # перенести всё, что закрыто больше ARCHIVE_AFTER_DAYS дней назад
+    python -m app.cli.archive --days 365        # другой порог
+    python -m app.cli.archive --stats           # сколько заявок в работе, в архиве и ждут переноса
+"""
+import argparse
+import sys
+from typing import List, Optional
+
+from app.config.config import settings
+from app.db.repository import session_scope
+from app.services.archive import archive_closed, archive_stats
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Перенести закрытые заявки в архив")
+    parser.add_argument("--days", type=int, default=settings.archive_after_days, help="закрыты больше стольких дней назад")
+    parser.add_argument("--batch-size", type=int, default=settings.archive_batch_size, help="заявок в одной транзакции")
+    parser.add_argument("--pause", type=float, default=settings.archive_batch_pause, help="пауза между пачками (сек)")
+    parser.add_argument("--max-batches", type=int, help="остановиться после стольких пачек")
+    parser.add_argument("--stats", action="store_true", help="только показать число заявок")
+    args = parser.parse_args(argv)
+
+    if not args.stats:
+        result = archive_closed(args.days, args.batch_size, args.pause, max_batches=args.max_batches)
+        print(f"Archived {result.applications} applications in {result.batches} batches, {result.seconds:.1f}s")
+        for name, count in result.rows.items():
+            print(f"  {name:<24} {count}")
+    with session_scope() as s:
+        stats = archive_stats(s, args.days)
+    print(f"Applications: {stats['hot']} hot, {stats['archived']} archived, {stats['due']} due for archiving")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
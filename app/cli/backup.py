@@ -0,0 +1,63 @@
+"""Онлайн-копия SQLite (та же, что бот снимает ночью).
+
+    python -m app.cli.backup                        # снять копию сейчас
+    python -m app.cli.backup --list                 # сохранённые копии
+    python -m app.cli.backup --verify backups/database-20250101-030000.db.gz
+"""
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+from app.config.config import settings
+from app.services.backup import BackupService, sqlite_path, verify_backup
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Резервная копия SQLite без остановки бота")
+    parser.add_argument("--list", action="store_true", help="показать сохранённые копии")
+    parser.add_argument("--verify", metavar="PATH", help="проверить восстановление из архива")
+    parser.add_argument("--dir", default=settings.backup_dir, help="каталог копий")
+    parser.add_argument("--keep", type=int, default=settings.backup_keep, help="сколько копий хранить")
+    parser.add_argument("--pages-per-step", type=int, default=settings.backup_pages_per_step)
+    parser.add_argument("--step-sleep", type=float, default=settings.backup_step_sleep)
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        result = verify_backup(args.verify)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0 if result["ok"] else 1
+
+    db_path = sqlite_path(settings.database_url)
+    if not db_path:
+        print("Online backup is available for file-based SQLite only", file=sys.stderr)
+        return 2
+    service = BackupService(
+        db_path,
+        directory=args.dir,
+        keep=args.keep,
+        pages_per_step=args.pages_per_step,
+        step_sleep=args.step_sleep,
+    )
+    if args.list:
+        for path in service.list_backups():
+            print(path)
+        return 0
+
+    result = service.backup_now()
+    print(f"Backup written to {result['path']} ({result['size'] / (1024 * 1024):.1f} MB)")
+    print(f"  total:        {result['seconds']:.2f}s (compress {result['compress_seconds']:.2f}s, verify {result['verify_seconds']:.2f}s)")
+    print(f"  pages:        {result['pages']} in {result['steps']} steps, {result['restarts']} restarts")
+    print(f"  write stall:  {result['stall_ms']:.1f} ms total, {result['max_stall_ms']:.1f} ms max per step")
+    print(f"  rows:         {result['counts']}")
+    if result["pruned"]:
+        print(f"  pruned:       {len(result['pruned'])} old backups")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
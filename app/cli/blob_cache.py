@@ -0,0 +1,53 @@
+"""Локальное хранилище документов (data/blobs).
+
+    python -m app.cli.blob_cache                     # сколько занято и сколько можно освободить
+    python -m app.cli.blob_cache --evict             # ужать до BLOB_CACHE_BUDGET_MB
+    python -m app.cli.blob_cache --fetch 42          # вернуть файлы заявки 42 (скачать вытесненные)
+"""
+import argparse
+import asyncio
+import json
+import sys
+from typing import List, Optional
+
+from app.config.config import settings
+from app.services import yandex_disk as ya
+from app.services.blob_cache import BlobCache, application_files
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+async def run(args: argparse.Namespace) -> int:
+    cache = BlobCache(args.budget_mb * 1024 * 1024)
+    await cache.load()
+    try:
+        if args.fetch is not None:
+            for file_name, path in await application_files(cache, args.fetch):
+                print(f"{file_name}\t{path}")
+        elif args.evict:
+            result = await cache.evict()
+            print(f"Evicted {result['removed']} files, freed {result['freed'] / (1024 * 1024):.1f} MB, "
+                  f"{result['skipped']} files are not on Yandex.Disk yet")
+        else:
+            evictable = await cache.evictable()
+            print(f"Files:     {len(cache)}, {cache.bytes / (1024 * 1024):.1f} MB of {args.budget_mb} MB budget")
+            print(f"Uploaded:  {evictable['files']} files, {evictable['bytes'] / (1024 * 1024):.1f} MB can be evicted")
+        print(json.dumps(cache.stats()))
+    finally:
+        await ya.close_client()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Локальные копии документов")
+    parser.add_argument("--budget-mb", type=int, default=settings.blob_cache_budget_mb, help="бюджет, МБ")
+    parser.add_argument("--evict", action="store_true", help="удалить выгруженные файлы сверх бюджета")
+    parser.add_argument("--fetch", type=int, metavar="APP_ID", help="вернуть локально файлы заявки")
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""Выгрузка реестра заявок в CSV.gz или XLSX.
+
+    python -m app.cli.export_applications                          # все заявки в CSV.gz
+    python -m app.cli.export_applications --format xlsx --status CLOSED
+    python -m app.cli.export_applications --since 2025-01-01 -o registry.csv.gz
+"""
+import argparse
+import resource
+import sys
+from datetime import datetime
+from typing import List, Optional
+
+from app.db.models import ApplicationStatus
+from app.services.export import FORMATS, export_applications, export_filename
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Выгрузить реестр заявок")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="csv (gzip) или xlsx")
+    parser.add_argument("-o", "--output", help="файл выгрузки (по умолчанию applications-<дата>.<формат>)")
+    parser.add_argument(
+        "--status", action="append", choices=[s.value for s in ApplicationStatus],
+        help="статус заявки (можно несколько раз); по умолчанию все",
+    )
+    parser.add_argument("--since", type=datetime.fromisoformat, help="создана не раньше (YYYY-MM-DD)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="создана раньше (YYYY-MM-DD, не включительно)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="строк из курсора за раз")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    path = args.output or export_filename(args.format)
+    result = export_applications(
+        path,
+        args.format,
+        batch_size=args.batch_size,
+        statuses=[ApplicationStatus(s) for s in args.status] if args.status else None,
+        created_from=args.since,
+        created_to=args.until,
+    )
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Exported {result.rows} applications to {result.path}")
+    print(f"  size:     {result.size / (1024 * 1024):.1f} MB")
+    print(f"  time:     {result.seconds:.1f}s, {result.rows / max(result.seconds, 1e-9):.0f} rows/s")
+    print(f"  peak RSS: {peak_rss_mb:.0f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""Миграции схемы БД.
+
+    python -m app.cli.migrate                 # применить все новые миграции
+    python -m app.cli.migrate --status        # список миграций и их состояние
+    python -m app.cli.migrate --to 1          # применить миграции до версии 1
+    python -m app.cli.migrate --check-plans   # EXPLAIN QUERY PLAN горячих запросов (SQLite)
+"""
+import argparse
+import sys
+from typing import List, Optional
+
+from app.db.base import engine
+from app.db.migrations import migrate, migration_status, check_query_plans
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("--status", action="store_true", help="показать применённые и ожидающие миграции")
+    parser.add_argument("--to", type=int, help="применить миграции до указанной версии")
+    parser.add_argument("--check-plans", action="store_true", help="проверить, что горячие запросы используют индексы")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        for m in migration_status(engine):
+            state = f"applied {m['applied_at']:%Y-%m-%d %H:%M}" if m["applied_at"] else "pending"
+            print(f"{m['version']:>4}  {m['name']:<40} {state}")
+        return 0
+
+    if args.check_plans:
+        failed = 0
+        for result in check_query_plans(engine):
+            mark = "ok  " if result["ok"] else "FAIL"
+            print(f"{mark} {result['query']:<20} expects {result['index']}")
+            for line in result["plan"]:
+                print(f"       {line}")
+            failed += not result["ok"]
+        return 1 if failed else 0
+
+    applied = migrate(engine, args.to)
+    print(f"Applied migrations: {applied}" if applied else "Nothing to apply")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
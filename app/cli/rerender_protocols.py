@@ -0,0 +1,186 @@
+"""Массовая пересборка протоколов, например после обновления шаблона.
+
+    python -m app.cli.rerender_protocols                      # все незакрытые заявки
+    python -m app.cli.rerender_protocols --status TO_LAWYER --since 2025-01-01
+    python -m app.cli.rerender_protocols --dry-run --workers 8   # только замер рендера
+
+Готовые протоколы ставятся в очередь выгрузки (upload_jobs), их заберут
+воркеры запущенного бота.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Tuple
+
+from app.db.models import ApplicationStatus, ProtocolBuild
+from app.db.repository import init_db, session_scope
+from app.services.protocol_builder import (
+    iter_protocol_data, protocol_fingerprint, protocol_path, record_build, protocol_upload_statuses,
+)
+from app.services.protocol_filler import load_template, DEFAULT_TEMPLATE_PATH
+from app.services.protocol_renderer import ProtocolRenderer, RenderError
+from app.services.upload_queue import UploadQueue
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Пересобрать протоколы заявок")
+    parser.add_argument(
+        "--status", action="append", choices=[s.value for s in ApplicationStatus],
+        help="статус заявки (можно несколько раз); по умолчанию все, кроме CLOSED",
+    )
+    parser.add_argument("--all", action="store_true", help="включая закрытые заявки")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="создана не раньше (YYYY-MM-DD)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="создана раньше (YYYY-MM-DD, не включительно)")
+    parser.add_argument("--id", dest="ids", type=int, action="append", help="конкретная заявка (можно несколько раз)")
+    parser.add_argument("--workers", type=int, default=0, help="процессов рендера (0 — по числу ядер)")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE_PATH, help="путь к шаблону протокола")
+    parser.add_argument("--force", action="store_true", help="пересобрать даже неизменившиеся протоколы")
+    parser.add_argument("--dry-run", action="store_true", help="только отрендерить во временную папку и замерить время")
+    parser.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    return parser.parse_args(argv)
+
+
+def select_statuses(args: argparse.Namespace) -> Optional[List[ApplicationStatus]]:
+    if args.status:
+        return [ApplicationStatus(s) for s in args.status]
+    if args.all:
+        return None
+    return [s for s in ApplicationStatus if s != ApplicationStatus.closed]
+
+
+def load_jobs(args: argparse.Namespace, template_version: str) -> Tuple[List[Tuple[int, Optional[str], Dict[str, Any], str]], int]:
+    """Читает выбранные заявки и отбрасывает те, чей протокол уже актуален"""
+    jobs = []
+    skipped = 0
+    with session_scope() as s:
+        builds = {
+            app_id: (fingerprint, output_path)
+            for app_id, fingerprint, output_path in s.query(
+                ProtocolBuild.application_id, ProtocolBuild.fingerprint, ProtocolBuild.output_path
+            )
+        }
+        uploads = protocol_upload_statuses(s)
+        for app_id, yandex_folder, data in iter_protocol_data(
+            s, select_statuses(args), args.since, args.until, args.ids
+        ):
+            fingerprint = protocol_fingerprint(data, template_version)
+            built, output_path = builds.get(app_id, (None, None))
+            # Актуален, только если файл на месте и его выгрузка не провалилась
+            up_to_date = (
+                built == fingerprint
+                and os.path.exists(output_path)
+                and (not yandex_folder or uploads.get(app_id) not in (None, "failed"))
+            )
+            if not args.force and not args.dry_run and up_to_date:
+                skipped += 1
+                continue
+            jobs.append((app_id, yandex_folder, data, fingerprint))
+    return jobs, skipped
+
+
+async def rerender(args: argparse.Namespace) -> Dict[str, Any]:
+    template_version = load_template(args.template).version
+    load_started = time.perf_counter()
+    jobs, skipped = load_jobs(args, template_version)
+    load_time = time.perf_counter() - load_started
+    logger.info(f"Selected {len(jobs)} applications for re-render ({skipped} up to date) in {load_time:.2f}s")
+
+    renderer = ProtocolRenderer(workers=args.workers or None, template_path=args.template)
+    renderer.max_queue = renderer.workers * 2
+    # Не больше, чем renderer готов принять, чтобы не получать RenderQueueFull
+    in_flight = asyncio.Semaphore(renderer.workers + renderer.max_queue)
+    upload_queue = UploadQueue()
+    failures: List[Dict[str, Any]] = []
+    queued_uploads = 0
+    tmp_dir = tempfile.TemporaryDirectory(prefix="protocols-") if args.dry_run else None
+
+    async def render_one(app_id: int, yandex_folder: Optional[str], data: Dict[str, Any], fingerprint: str) -> None:
+        nonlocal queued_uploads
+        if tmp_dir is not None:
+            output_path = os.path.join(tmp_dir.name, f"{app_id}.docx")
+        else:
+            output_path = protocol_path(app_id)
+        try:
+            await renderer.render(data, output_path)
+        except RenderError as e:
+            failures.append({"application_id": app_id, "error": str(e)})
+            logger.error(f"Re-render failed for app {app_id}: {e}")
+            return
+        finally:
+            in_flight.release()
+        if tmp_dir is not None:
+            return
+        with session_scope() as s:
+            record_build(s, upload_queue, app_id, fingerprint, template_version, output_path, yandex_folder)
+        if yandex_folder:
+            queued_uploads += 1
+
+    await renderer.start()
+    started = time.perf_counter()
+    try:
+        tasks = []
+        for job in jobs:
+            await in_flight.acquire()
+            tasks.append(asyncio.create_task(render_one(*job)))
+        await asyncio.gather(*tasks)
+    finally:
+        elapsed = time.perf_counter() - started
+        await renderer.stop()
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    stats = renderer.stats()
+    return {
+        "dry_run": args.dry_run,
+        "template_version": template_version,
+        "selected": len(jobs),
+        "skipped_up_to_date": skipped,
+        "rendered": stats["rendered"],
+        "failed": len(failures),
+        "uploads_queued": queued_uploads,
+        "workers": renderer.workers,
+        "load_seconds": round(load_time, 3),
+        "render_seconds": round(elapsed, 3),
+        "per_second": round(stats["rendered"] / elapsed, 1) if elapsed > 0 else 0.0,
+        "avg_render_ms": stats["avg_render_ms"],
+        "failures": failures,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    mode = "dry run" if report["dry_run"] else "re-render"
+    print(f"Protocol {mode}, template {report['template_version'][:12]}")
+    print(f"  selected:       {report['selected']} (up to date, skipped: {report['skipped_up_to_date']})")
+    print(f"  rendered:       {report['rendered']} on {report['workers']} workers")
+    print(f"  failed:         {report['failed']}")
+    if not report["dry_run"]:
+        print(f"  uploads queued: {report['uploads_queued']}")
+    print(f"  load:           {report['load_seconds']:.2f}s")
+    print(f"  render:         {report['render_seconds']:.2f}s, {report['per_second']} docs/s, "
+          f"{report['avg_render_ms']} ms per document")
+    for failure in report["failures"]:
+        print(f"  ! app {failure['application_id']}: {failure['error']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    init_db()
+    report = asyncio.run(rerender(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,7 +7,87 @@ load_dotenv()
 class Settings(BaseModel):
     bot_token: str = os.getenv("BOT_TOKEN", "")
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///./database.db")
+
+    # Пул соединений для Postgres и других серверных СУБД
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    db_pool_timeout: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    db_pool_recycle: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+    # Профиль SQLite: WAL, ожидание блокировок и кэш страниц
+    sqlite_journal_mode: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    sqlite_synchronous: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    sqlite_busy_timeout_ms: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    sqlite_cache_size_kb: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+    sqlite_mmap_size: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    sqlite_pool_size: int = int(os.getenv("SQLITE_POOL_SIZE", "8"))
     yandex_disk_token: str = os.getenv("YANDEX_DISK_TOKEN", "")
     env: str = os.getenv("ENV", "dev")
 
-settings = Settings()
\ No newline at end of file
+    # Яндекс.Диск: таймауты (сек) и размер пула соединений
+    yandex_timeout: float = float(os.getenv("YANDEX_TIMEOUT", "30"))
+    yandex_upload_timeout: float = float(os.getenv("YANDEX_UPLOAD_TIMEOUT", "300"))
+    yandex_max_connections: int = int(os.getenv("YANDEX_MAX_CONNECTIONS", "20"))
+    yandex_max_keepalive: int = int(os.getenv("YANDEX_MAX_KEEPALIVE", "10"))
+
+    # Фоновая очередь выгрузки на Я.Диск (UPLOAD_WORKERS=0 — задания только ставятся, выполняет другой экземпляр)
+    upload_workers: int = int(os.getenv("UPLOAD_WORKERS", "3"))
+    upload_max_attempts: int = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "8"))
+    upload_retry_base: float = float(os.getenv("UPLOAD_RETRY_BASE", "5"))
+    upload_retry_cap: float = float(os.getenv("UPLOAD_RETRY_CAP", "600"))
+    upload_poll_interval: float = float(os.getenv("UPLOAD_POLL_INTERVAL", "10"))
+
+    # Потоковое сохранение файлов: размер куска и загрузка на Я.Диск «на лету»
+    stream_chunk_size: int = int(os.getenv("STREAM_CHUNK_SIZE", str(256 * 1024)))
+    yandex_stream_uploads: bool = os.getenv("YANDEX_STREAM_UPLOADS", "1").lower() in ("1", "true", "yes")
+
+    # Рендер протоколов в пуле процессов (0 — по числу ядер)
+    render_workers: int = int(os.getenv("RENDER_WORKERS", "0"))
+    render_max_queue: int = int(os.getenv("RENDER_MAX_QUEUE", "32"))
+    # Бэкенд заполнения шаблона: docx (python-docx) или xml (потоковая замена)
+    protocol_backend: str = os.getenv("PROTOCOL_BACKEND", "docx")
+
+    # Кэш пользователей для middleware доступа: время жизни записи (сек) и размер
+    user_cache_ttl: float = float(os.getenv("USER_CACHE_TTL", "300"))
+    user_cache_size: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+    # Ответы анкеты копятся в FSM и пишутся в БД пачкой каждые N ответов
+    answers_checkpoint_every: int = int(os.getenv("ANSWERS_CHECKPOINT_EVERY", "6"))
+
+    # Размер страницы в списках заявок
+    list_page_size: int = int(os.getenv("LIST_PAGE_SIZE", "10"))
+
+    # Ночные копии SQLite: время запуска, каталог, сколько копий хранить
+    backup_enabled: bool = os.getenv("BACKUP_ENABLED", "1").lower() in ("1", "true", "yes")
+    backup_dir: str = os.getenv("BACKUP_DIR", "./backups")
+    backup_at: str = os.getenv("BACKUP_AT", "03:00")
+    backup_keep: int = int(os.getenv("BACKUP_KEEP", "7"))
+    # Страниц за шаг онлайн-копии и пауза между шагами (сек)
+    backup_pages_per_step: int = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+    backup_step_sleep: float = float(os.getenv("BACKUP_STEP_SLEEP", "0.005"))
+
+    # Локальные копии документов: бюджет (МБ); выгруженные на Я.Диск файлы сверх него удаляются
+    blob_cache_budget_mb: int = int(os.getenv("BLOB_CACHE_BUDGET_MB", "2048"))
+
+    # Получение обновлений: polling или webhook; сколько обновлений обрабатывать одновременно
+    bot_mode: str = os.getenv("BOT_MODE", "polling")
+    updates_concurrency: int = int(os.getenv("UPDATES_CONCURRENCY", "32"))
+    # Webhook: публичный адрес (пусто — не вызывать setWebhook), путь, секрет и где слушать
+    webhook_url: str = os.getenv("WEBHOOK_URL", "")
+    webhook_path: str = os.getenv("WEBHOOK_PATH", "/webhook")
+    webhook_secret: str = os.getenv("WEBHOOK_SECRET", "")
+    webhook_host: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    webhook_port: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+    webhook_max_connections: int = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    webhook_shutdown_timeout: float = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "30"))
+    # Состояния FSM: пусто — память процесса, redis://… — общее хранилище для нескольких экземпляров
+    fsm_storage_url: str = os.getenv("FSM_STORAGE_URL", "")
+
+    # Архив: закрытые больше N дней назад заявки переносятся в archive_* пачками
+    archive_enabled: bool = os.getenv("ARCHIVE_ENABLED", "1").lower() in ("1", "true", "yes")
+    archive_after_days: int = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+    archive_batch_size: int = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+    archive_batch_pause: float = float(os.getenv("ARCHIVE_BATCH_PAUSE", "0.05"))
+    archive_at: str = os.getenv("ARCHIVE_AT", "04:00")
+
+settings = Settings()
@@ -1,25 +1,138 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
-from typing import Generator
+from sqlalchemy.pool import StaticPool
+from typing import Generator, Dict, Any, Optional
 from app.config.config import settings
 
-# Create the SQLAlchemy engine
-engine = create_engine(
-    settings.database_url,
-    connect_args={"check_same_thread": False} if settings.database_url.startswith("sqlite") else {},
-    pool_pre_ping=True
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def sqlite_pragmas() -> Dict[str, Any]:
+    """PRAGMA, которые выполняются на каждом новом соединении SQLite.
+
+    WAL позволяет читать во время записи, synchronous=NORMAL в режиме WAL
+    не теряет целостность, а busy_timeout заставляет писателя подождать
+    освобождения блокировки вместо немедленного «database is locked».
+    """
+    return {
+        "journal_mode": settings.sqlite_journal_mode,
+        "synchronous": settings.sqlite_synchronous,
+        "busy_timeout": settings.sqlite_busy_timeout_ms,
+        # Отрицательное значение cache_size — размер в КиБ, а не в страницах
+        "cache_size": -settings.sqlite_cache_size_kb,
+        "mmap_size": settings.sqlite_mmap_size,
+        "temp_store": "MEMORY",
+    }
+
+
+def unicode_lower(value: Optional[str]) -> Optional[str]:
+    return value.lower() if isinstance(value, str) else value
+
+
+def _install_pragmas(sync_engine: Engine, pragmas: Dict[str, Any]) -> None:
+    @event.listens_for(sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+        # Встроенный lower() в SQLite понимает только ASCII: «Тверская» остаётся как есть
+        dbapi_connection.create_function("unicode_lower", 1, unicode_lower, deterministic=True)
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """Параметры пула для движка: свои для SQLite и для серверных СУБД"""
+    if is_sqlite(url):
+        database = make_url(url).database
+        if not database or database == ":memory:":
+            # In-memory база живёт, пока живо единственное соединение
+            return {"poolclass": StaticPool}
+        # Файл SQLite: соединения дешёвые и всегда «живые», pre_ping не нужен
+        return {
+            "pool_size": settings.sqlite_pool_size,
+            "max_overflow": 0,
+            "pool_timeout": settings.db_pool_timeout,
+        }
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": True,
+    }
+
+
+def create_db_engine(url: str, pragmas: Optional[Dict[str, Any]] = None) -> Engine:
+    """Синхронный движок с профилем под тип базы (pragmas=None — из настроек)"""
+    if is_sqlite(url):
+        db_engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": settings.sqlite_busy_timeout_ms / 1000},
+            **engine_options(url)
+        )
+        _install_pragmas(db_engine, sqlite_pragmas() if pragmas is None else pragmas)
+        return db_engine
+    return create_engine(url, **engine_options(url))
+
+
+def create_async_db_engine(url: str, pragmas: Optional[Dict[str, Any]] = None) -> AsyncEngine:
+    """Асинхронный движок с тем же профилем, что и create_db_engine"""
+    async_url = async_database_url(url)
+    if is_sqlite(url):
+        db_engine = create_async_engine(
+            async_url,
+            connect_args={"timeout": settings.sqlite_busy_timeout_ms / 1000},
+            **engine_options(url)
+        )
+        _install_pragmas(db_engine.sync_engine, sqlite_pragmas() if pragmas is None else pragmas)
+        return db_engine
+    return create_async_engine(async_url, **engine_options(url))
+
+
+def async_database_url(url: str) -> str:
+    """URL для асинхронного движка: sqlite → aiosqlite, postgresql → asyncpg"""
+    parsed = make_url(url)
+    if "+" in parsed.drivername:
+        backend, driver = parsed.drivername.split("+", 1)
+        if driver in ("aiosqlite", "asyncpg"):
+            return url
+    else:
+        backend = parsed.drivername
+    if backend == "sqlite":
+        return parsed.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    if backend in ("postgresql", "postgres"):
+        return parsed.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+    raise ValueError(f"No async driver configured for database URL {parsed.drivername}")
+
+
+# Синхронный движок: init_db, миграции и CLI-утилиты
+engine = create_db_engine(settings.database_url)
+
+# Обычная фабрика сессий: каждая session_scope() получает собственную сессию
+SessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=engine,
+    future=True  # Enable 2.0 style API
 )
 
-# Create a scoped session factory
-SessionLocal = scoped_session(
-    sessionmaker(
-        autocommit=False,
-        autoflush=False,
-        bind=engine,
-        future=True  # Enable 2.0 style API
-    )
+# Асинхронный движок для хендлеров и фоновых задач бота
+async_engine = create_async_db_engine(settings.database_url)
+
+# expire_on_commit=False: объекты остаются читаемыми после выхода из сессии
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
 )
 
 # Base class for all models
@@ -38,7 +151,7 @@ def get_db() -> Generator[Session, None, None]:
 
 def init_db():
     """Initialize the database by creating all tables."""
-    from app.db.models import User, Application, Document, Task, QuestionnaireAnswer  # noqa: F401
+    from app.db.models import User, Application, Document, Task, QuestionnaireAnswer, UploadJob, ProtocolBuild  # noqa: F401
     
     # Import all models here to ensure they are registered with the Base
     Base.metadata.create_all(bind=engine)
\ No newline at end of file
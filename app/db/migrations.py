@@ -0,0 +1,490 @@
+"""Версионные миграции схемы.
+
+Применённые миграции записываются в таблицу schema_version. Каждая миграция
+выполняется в своей транзакции. Baseline — замороженная схема, которую
+создавал init_db до появления миграций; всё, что добавлено позже, создают
+следующие миграции, поэтому пустая и старая база проходят одни и те же шаги.
+Миграции не берут таблицы из моделей: всё, что они создают и читают, описано
+здесь же в том виде, каким было на момент миграции.
+Миграции всё равно пишутся идемпотентными (IF NOT EXISTS): базы, созданные до
+миграций, могли частично содержать их изменения.
+"""
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple, Dict, Any
+
+from sqlalchemy import (
+    text, select, inspect, Table, Column, Integer, String, DateTime, MetaData, Boolean, Enum, ForeignKey, Text, Index,
+    JSON,
+)
+from sqlalchemy.engine import Engine, Connection
+
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Служебная таблица живёт вне Base.metadata, чтобы create_all её не трогал
+_version_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+class Migration:
+    def __init__(self, version: int, name: str, upgrade: Callable[[Connection], None]):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str):
+    """Регистрирует функцию upgrade(conn) как миграцию с номером version"""
+    def decorator(upgrade: Callable[[Connection], None]) -> Callable[[Connection], None]:
+        if MIGRATIONS and MIGRATIONS[-1].version >= version:
+            raise ValueError(f"Migration {version} is out of order")
+        MIGRATIONS.append(Migration(version, name, upgrade))
+        return upgrade
+    return decorator
+
+
+def _create_indexes(conn: Connection, statements: List[str]) -> None:
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+# --- миграции ---
+
+# Схема, которую создавал init_db до появления миграций. Не менять: новые
+# таблицы, колонки и индексы добавляются отдельными миграциями.
+_baseline_metadata = MetaData()
+
+Table(
+    "users", _baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("telegram_id", String, unique=True, nullable=False),
+    Column("full_name", String, nullable=False),
+    Column("department_no", String, nullable=True),
+    Column("role", Enum("agent", "rop", "lawyer", "admin", name="userrole"), nullable=False),
+    Column("created_at", DateTime),
+    Column("is_active", Boolean),
+    Column("is_approved", Boolean),
+)
+Table(
+    "applications", _baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("agent_id", Integer, ForeignKey("users.id"), nullable=True),
+    Column("rop_id", Integer, ForeignKey("users.id"), nullable=True),
+    Column("lawyer_id", Integer, ForeignKey("users.id"), nullable=True),
+    Column("deal_type", String, nullable=False),
+    Column("contract_no", String, nullable=True),
+    Column("protocol_date", String, nullable=True),
+    Column("address", String, nullable=True),
+    Column("object_type", String, nullable=True),
+    Column("head_name", String, nullable=True),
+    Column("agent_name", String, nullable=True),
+    Column("yandex_folder", String, nullable=True),
+    Column("yandex_public_url", String, nullable=True),
+    Column("status", Enum(
+        "created", "returned_rop", "to_lawyer", "lawyer_task", "closed", name="applicationstatus",
+    )),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+    Index("idx_application_status", "status"),
+)
+Table(
+    "questionnaire_answers", _baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("application_id", Integer, ForeignKey("applications.id"), nullable=False),
+    Column("question_key", String, nullable=False),
+    Column("answer_value", String, nullable=False),
+    Column("created_at", DateTime),
+)
+Table(
+    "documents", _baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("application_id", Integer, ForeignKey("applications.id"), nullable=False),
+    Column("doc_type", String, nullable=False),
+    Column("file_name", String, nullable=False),
+    Column("local_path", String, nullable=False),
+    Column("yandex_path", String, nullable=True),
+    Column("sha256", String, nullable=True),
+    Column("meta", Text, nullable=True),
+    Column("uploaded_at", DateTime),
+    Index("idx_document_application", "application_id"),
+    Index("idx_document_sha256", "sha256"),
+)
+Table(
+    "tasks", _baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("application_id", Integer, ForeignKey("applications.id"), nullable=False),
+    Column("author_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("assignee_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("text", Text, nullable=False),
+    Column("status", String(20)),
+    Column("created_at", DateTime),
+    Column("closed_at", DateTime, nullable=True),
+    Index("idx_task_application", "application_id"),
+    Index("idx_task_assignee", "assignee_id"),
+)
+Table(
+    "upload_jobs", _baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("kind", String(20), nullable=False),
+    Column("application_id", Integer, ForeignKey("applications.id"), nullable=True),
+    Column("document_id", Integer, ForeignKey("documents.id"), nullable=True),
+    Column("payload", Text, nullable=False),
+    Column("status", String(20), nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("next_run_at", DateTime, nullable=False),
+    Column("last_error", Text, nullable=True),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+    Index("idx_upload_job_due", "status", "next_run_at"),
+)
+Table(
+    "protocol_builds", _baseline_metadata,
+    Column("application_id", Integer, ForeignKey("applications.id"), primary_key=True),
+    Column("fingerprint", String(64), nullable=False),
+    Column("template_version", String(64), nullable=False),
+    Column("output_path", String, nullable=False),
+    Column("built_at", DateTime),
+)
+
+
+@migration(1, "baseline")
+def _baseline(conn: Connection) -> None:
+    """Недостающие таблицы и индексы замороженной схемы (как раньше делал init_db)"""
+    _baseline_metadata.create_all(bind=conn)
+    for table in _baseline_metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+@migration(2, "composite indexes for hot queries")
+def _hot_query_indexes(conn: Connection) -> None:
+    _create_indexes(conn, [
+        # my_applications: заявки агента, новые сначала
+        "CREATE INDEX IF NOT EXISTS idx_application_agent_created ON applications (agent_id, created_at)",
+        # /rop и /lawyer: заявки в статусе по дате
+        "CREATE INDEX IF NOT EXISTS idx_application_status_created ON applications (status, created_at)",
+        # поиск РОПа/юриста отдела при регистрации и создании заявки
+        "CREATE INDEX IF NOT EXISTS idx_user_role_department "
+        "ON users (role, department_no, is_active, is_approved)",
+        # ответы анкеты заявки (протокол)
+        "CREATE INDEX IF NOT EXISTS idx_answer_application ON questionnaire_answers (application_id)",
+        # открытая задача заявки, последняя по дате
+        "CREATE INDEX IF NOT EXISTS idx_task_application_status_created ON tasks (application_id, status, created_at)",
+    ])
+    # Эти индексы — префиксы новых составных и только замедляют запись
+    conn.execute(text("DROP INDEX IF EXISTS idx_application_status"))
+    conn.execute(text("DROP INDEX IF EXISTS idx_task_application"))
+
+
+# Таблица миграции 3 в том виде, в каком миграция её создавала. Не менять.
+_answers_metadata = MetaData()
+_application_answers = Table(
+    "application_answers", _answers_metadata,
+    Column("application_id", Integer, ForeignKey(_baseline_metadata.tables["applications"].c.id), primary_key=True),
+    Column("questions_version", Integer, nullable=False),
+    Column("answers", JSON, nullable=False),
+    Column("updated_at", DateTime),
+)
+
+
+@migration(3, "compact application answers")
+def _compact_answers(conn: Connection) -> None:
+    """Переносит ответы из questionnaire_answers в один JSON-документ на заявку.
+
+    Старые строки не удаляются: таблица остаётся для отката, но больше не пишется.
+    """
+    answers = _baseline_metadata.tables["questionnaire_answers"]
+
+    _application_answers.create(bind=conn, checkfirst=True)
+    migrated = set(conn.execute(select(_application_answers.c.application_id)).scalars())
+    rows = conn.execute(
+        select(answers.c.application_id, answers.c.question_key, answers.c.answer_value)
+        .order_by(answers.c.application_id, answers.c.id)
+    )
+    documents: Dict[int, Dict[str, str]] = {}
+    for app_id, key, value in rows:
+        if app_id not in migrated:
+            # При повторных ответах побеждает последний, как при сборке протокола
+            documents.setdefault(app_id, {})[key] = value
+    if documents:
+        conn.execute(_application_answers.insert(), [
+            {"application_id": app_id, "questions_version": 1, "answers": answers, "updated_at": datetime.utcnow()}
+            for app_id, answers in documents.items()
+        ])
+    logger.info(f"Compacted answers of {len(documents)} applications")
+
+
+# Поля заявки, по которым работает /find
+SEARCH_COLUMNS = ["address", "contract_no", "agent_name", "head_name", "deal_type"]
+
+
+def fts5_available(conn: Connection) -> bool:
+    return bool(conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+
+
+def _search_index(conn: Connection, table_name: str) -> None:
+    """Полнотекстовый индекс по SEARCH_COLUMNS таблицы заявок.
+
+    SQLite: FTS5-индекс {table_name}_fts с внешним содержимым и триггерами;
+    Postgres: сгенерированная колонка search_tsv + GIN.
+    """
+    cols = ", ".join(SEARCH_COLUMNS)
+    if conn.dialect.name == "postgresql":
+        document = " || ' ' || ".join(f"coalesce({c}, '')" for c in SEARCH_COLUMNS)
+        conn.execute(text(
+            f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS search_tsv tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('simple', {document})) STORED"
+        ))
+        index = f"idx_{table_name.rstrip('s')}_search"  # idx_application_search, idx_archive_application_search
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index} ON {table_name} USING gin (search_tsv)"))
+        return
+    if conn.dialect.name != "sqlite":
+        logger.warning(f"Full-text search is not supported on {conn.dialect.name}, /find will use LIKE")
+        return
+    if not fts5_available(conn):
+        logger.warning("SQLite is built without FTS5, /find will use LIKE")
+        return
+
+    fts = f"{table_name}_fts"
+    new_values = ", ".join(f"new.{c}" for c in SEARCH_COLUMNS)
+    old_values = ", ".join(f"old.{c}" for c in SEARCH_COLUMNS)
+    # prefix='2 3' — отдельные префиксные индексы для частичных адресов и номеров договоров
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{cols}, content='{table_name}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table_name} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table_name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); END"
+    ))
+    # Смена статуса и прочих полей индекс не трогает
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table_name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END"
+    ))
+    conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+@migration(4, "full-text search over applications")
+def _application_search(conn: Connection) -> None:
+    _search_index(conn, "applications")
+
+
+# Таблицы архива в том виде, в каком их создавала миграция 5: те же колонки,
+# что в рабочих таблицах, но без внешних ключей. Не менять.
+_archive_metadata = MetaData()
+
+Table(
+    "archive_applications", _archive_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("agent_id", Integer, nullable=True),
+    Column("rop_id", Integer, nullable=True),
+    Column("lawyer_id", Integer, nullable=True),
+    Column("deal_type", String, nullable=False),
+    Column("contract_no", String, nullable=True),
+    Column("protocol_date", String, nullable=True),
+    Column("address", String, nullable=True),
+    Column("object_type", String, nullable=True),
+    Column("head_name", String, nullable=True),
+    Column("agent_name", String, nullable=True),
+    Column("yandex_folder", String, nullable=True),
+    Column("yandex_public_url", String, nullable=True),
+    Column("status", Enum(
+        "created", "returned_rop", "to_lawyer", "lawyer_task", "closed", name="applicationstatus",
+    )),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+    Column("archived_at", DateTime),
+    Index("idx_archive_application_agent", "agent_id"),
+    Index("idx_archive_application_created", "created_at"),
+)
+Table(
+    "archive_questionnaire_answers", _archive_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("application_id", Integer, nullable=False),
+    Column("question_key", String, nullable=False),
+    Column("answer_value", String, nullable=False),
+    Column("created_at", DateTime),
+    Index("idx_archive_answer_application", "application_id"),
+)
+Table(
+    "archive_documents", _archive_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("application_id", Integer, nullable=False),
+    Column("doc_type", String, nullable=False),
+    Column("file_name", String, nullable=False),
+    Column("local_path", String, nullable=False),
+    Column("yandex_path", String, nullable=True),
+    Column("sha256", String, nullable=True),
+    Column("meta", Text, nullable=True),
+    Column("uploaded_at", DateTime),
+    Index("idx_archive_document_application", "application_id"),
+)
+Table(
+    "archive_tasks", _archive_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("application_id", Integer, nullable=False),
+    Column("author_id", Integer, nullable=False),
+    Column("assignee_id", Integer, nullable=False),
+    Column("text", Text, nullable=False),
+    Column("status", String(20)),
+    Column("created_at", DateTime),
+    Column("closed_at", DateTime, nullable=True),
+    Index("idx_archive_task_application", "application_id"),
+)
+Table(
+    "archive_application_answers", _archive_metadata,
+    Column("application_id", Integer, primary_key=True, autoincrement=False),
+    Column("questions_version", Integer, nullable=False),
+    Column("answers", JSON, nullable=False),
+    Column("updated_at", DateTime),
+)
+
+
+@migration(5, "archive of closed applications")
+def _archive_tables(conn: Connection) -> None:
+    """Таблицы archive_* для закрытых заявок и их полнотекстовый индекс"""
+    _archive_metadata.create_all(bind=conn)
+    for table in _archive_metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+    _search_index(conn, "archive_applications")
+
+
+def _add_column(conn: Connection, table_name: str, column: str, ddl: str) -> None:
+    """ALTER TABLE ADD COLUMN, если такой колонки ещё нет"""
+    if column not in {c["name"] for c in inspect(conn).get_columns(table_name)}:
+        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column} {ddl}"))
+
+
+@migration(6, "telegram file ids of documents")
+def _document_file_ids(conn: Connection) -> None:
+    """documents.file_unique_id: повторно присланный файл находится без скачивания"""
+    _add_column(conn, "documents", "file_unique_id", "VARCHAR")
+    _add_column(conn, "archive_documents", "file_unique_id", "VARCHAR")
+    _create_indexes(conn, [
+        "CREATE INDEX IF NOT EXISTS idx_document_file_unique_id ON documents (file_unique_id)",
+    ])
+
+
+# --- запуск ---
+
+def latest_version() -> int:
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def current_version(conn: Connection) -> int:
+    _version_metadata.create_all(bind=conn)
+    version = conn.execute(select(schema_version.c.version).order_by(schema_version.c.version.desc()).limit(1)).scalar()
+    return version or 0
+
+
+def migrate(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """Применяет ещё не применённые миграции до target (по умолчанию до последней)"""
+    target = latest_version() if target is None else target
+    with engine.begin() as conn:
+        version = current_version(conn)
+    applied = []
+    for m in MIGRATIONS:
+        if m.version <= version or m.version > target:
+            continue
+        logger.info(f"Applying migration {m.version}: {m.name}")
+        with engine.begin() as conn:
+            m.upgrade(conn)
+            conn.execute(schema_version.insert().values(version=m.version, name=m.name, applied_at=datetime.utcnow()))
+        applied.append(m.version)
+    if applied:
+        logger.info(f"Database migrated to version {applied[-1]}")
+    else:
+        logger.info(f"Database schema is up to date (version {version})")
+    return applied
+
+
+def migration_status(engine: Engine) -> List[Dict[str, Any]]:
+    with engine.begin() as conn:
+        current_version(conn)
+        rows = {r.version: r for r in conn.execute(select(schema_version))}
+    return [
+        {
+            "version": m.version,
+            "name": m.name,
+            "applied_at": rows[m.version].applied_at if m.version in rows else None,
+        }
+        for m in MIGRATIONS
+    ]
+
+
+# --- проверка планов запросов ---
+
+def hot_queries() -> List[Tuple[str, Any, str]]:
+    """(название, запрос, индекс, который он должен использовать)"""
+    from app.db.models import Application, ApplicationStatus, User, UserRole, Task
+
+    return [
+        (
+            "my_applications",
+            select(Application).where(Application.agent_id == 1).order_by(Application.created_at.desc(), Application.id.desc()),
+            "idx_application_agent_created",
+        ),
+        (
+            "rop_list",
+            select(Application).where(Application.status == ApplicationStatus.created).order_by(Application.created_at, Application.id),
+            "idx_application_status_created",
+        ),
+        (
+            "department_rop",
+            select(User).where(
+                User.role == UserRole.rop,
+                User.department_no == "1",
+                User.is_active == True,  # noqa: E712
+                User.is_approved == True  # noqa: E712
+            ),
+            "idx_user_role_department",
+        ),
+        (
+            "open_task",
+            select(Task).where(Task.application_id == 1, Task.status == "open").order_by(Task.created_at.desc()),
+            "idx_task_application_status_created",
+        ),
+    ]
+
+
+def explain_query_plan(conn: Connection, statement) -> List[str]:
+    """Строки EXPLAIN QUERY PLAN (SQLite) для SQLAlchemy-запроса"""
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))]
+
+
+def check_query_plans(engine: Engine) -> List[Dict[str, Any]]:
+    """Проверяет, что горячие запросы используют свои индексы, без полного сканирования"""
+    if engine.dialect.name != "sqlite":
+        raise RuntimeError("Query plan checks are implemented for SQLite only")
+    results = []
+    with engine.connect() as conn:
+        for name, statement, index in hot_queries():
+            plan = explain_query_plan(conn, statement)
+            uses_index = any(index in line for line in plan)
+            temp_sort = any("USE TEMP B-TREE" in line for line in plan)
+            results.append({
+                "query": name,
+                "index": index,
+                "ok": uses_index and not temp_sort,
+                "plan": plan,
+            })
+    return results
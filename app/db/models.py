@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Text, Index, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Text, Index, Boolean, JSON
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.db.base import Base
@@ -58,6 +58,7 @@ class Application(Base):
     tasks = relationship("Task", back_populates="application", order_by="Task.created_at.desc()")
 
 class QuestionnaireAnswer(Base):
+    """Старый формат: строка на каждый ответ. Новые ответы пишутся в ApplicationAnswers"""
     __tablename__ = "questionnaire_answers"
     id = Column(Integer, primary_key=True)
     application_id = Column(Integer, ForeignKey("applications.id"), nullable=False)
@@ -74,6 +75,8 @@ class Document(Base):
     local_path = Column(String, nullable=False)
     yandex_path = Column(String, nullable=True)
     sha256 = Column(String, nullable=True)
+    # file_unique_id из Telegram: повторно присланный файл узнаётся до скачивания
+    file_unique_id = Column(String, nullable=True)
     meta = Column(Text, nullable=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
 
@@ -94,7 +97,120 @@ class Task(Base):
     author = relationship("User", foreign_keys=[author_id])
     assignee = relationship("User", foreign_keys=[assignee_id])
 
-Index('idx_application_status', Application.status)
+class UploadJob(Base):
+    """Отложенная операция с Яндекс.Диском (очередь «парк-и-повтори»)"""
+    __tablename__ = "upload_jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(20), nullable=False)  # create_folder/upload/copy/publish
+    application_id = Column(Integer, ForeignKey("applications.id"), nullable=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=True)
+    payload = Column(Text, nullable=False, default="{}")
+    status = Column(String(20), nullable=False, default="pending")  # pending/running/done/failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_run_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ProtocolBuild(Base):
+    """Отпечаток входных данных последнего сформированного протокола заявки"""
+    __tablename__ = "protocol_builds"
+
+    application_id = Column(Integer, ForeignKey("applications.id"), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    template_version = Column(String(64), nullable=False)
+    output_path = Column(String, nullable=False)
+    built_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ApplicationAnswers(Base):
+    """Ответы анкеты заявки одним документом {question_key: answer}"""
+    __tablename__ = "application_answers"
+
+    application_id = Column(Integer, ForeignKey("applications.id"), primary_key=True)
+    questions_version = Column(Integer, nullable=False)
+    answers = Column(JSON, nullable=False, default=dict)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# --- архив закрытых заявок (app/services/archive.py) ---
+# Те же колонки, что в рабочих таблицах, но без внешних ключей: строки
+# переносятся целиком и сохраняют свои id.
+
+class ArchivedApplication(Base):
+    """Закрытая заявка, перенесённая из applications"""
+    __tablename__ = "archive_applications"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    agent_id = Column(Integer, nullable=True)
+    rop_id = Column(Integer, nullable=True)
+    lawyer_id = Column(Integer, nullable=True)
+
+    deal_type = Column(String, nullable=False)
+    contract_no = Column(String, nullable=True)
+    protocol_date = Column(String, nullable=True)
+    address = Column(String, nullable=True)
+    object_type = Column(String, nullable=True)
+    head_name = Column(String, nullable=True)
+    agent_name = Column(String, nullable=True)
+
+    yandex_folder = Column(String, nullable=True)
+    yandex_public_url = Column(String, nullable=True)
+
+    status = Column(Enum(ApplicationStatus), default=ApplicationStatus.closed)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class ArchivedQuestionnaireAnswer(Base):
+    __tablename__ = "archive_questionnaire_answers"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    application_id = Column(Integer, nullable=False)
+    question_key = Column(String, nullable=False)
+    answer_value = Column(String, nullable=False)
+    created_at = Column(DateTime)
+
+class ArchivedDocument(Base):
+    __tablename__ = "archive_documents"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    application_id = Column(Integer, nullable=False)
+    doc_type = Column(String, nullable=False)
+    file_name = Column(String, nullable=False)
+    local_path = Column(String, nullable=False)
+    yandex_path = Column(String, nullable=True)
+    sha256 = Column(String, nullable=True)
+    file_unique_id = Column(String, nullable=True)
+    meta = Column(Text, nullable=True)
+    uploaded_at = Column(DateTime)
+
+class ArchivedTask(Base):
+    __tablename__ = "archive_tasks"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    application_id = Column(Integer, nullable=False)
+    author_id = Column(Integer, nullable=False)
+    assignee_id = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    status = Column(String(20))
+    created_at = Column(DateTime)
+    closed_at = Column(DateTime, nullable=True)
+
+class ArchivedApplicationAnswers(Base):
+    __tablename__ = "archive_application_answers"
+    application_id = Column(Integer, primary_key=True, autoincrement=False)
+    questions_version = Column(Integer, nullable=False)
+    answers = Column(JSON, nullable=False, default=dict)
+    updated_at = Column(DateTime)
+
+Index('idx_application_agent_created', Application.agent_id, Application.created_at)
+Index('idx_application_status_created', Application.status, Application.created_at)
+Index('idx_user_role_department', User.role, User.department_no, User.is_active, User.is_approved)
+Index('idx_answer_application', QuestionnaireAnswer.application_id)
 Index('idx_document_application', Document.application_id)
-Index('idx_task_application', Task.application_id)
-Index('idx_task_assignee', Task.assignee_id)
\ No newline at end of file
+Index('idx_document_sha256', Document.sha256)
+Index('idx_document_file_unique_id', Document.file_unique_id)
+Index('idx_task_application_status_created', Task.application_id, Task.status, Task.created_at)
+Index('idx_task_assignee', Task.assignee_id)
+Index('idx_upload_job_due', UploadJob.status, UploadJob.next_run_at)
+Index('idx_archive_application_agent', ArchivedApplication.agent_id)
+Index('idx_archive_application_created', ArchivedApplication.created_at)
+Index('idx_archive_answer_application', ArchivedQuestionnaireAnswer.application_id)
+Index('idx_archive_document_application', ArchivedDocument.application_id)
+Index('idx_archive_task_application', ArchivedTask.application_id)
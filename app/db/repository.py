@@ -1,18 +1,20 @@
-from contextlib import contextmanager
-from typing import Generator, Optional, Dict, Any
+from contextlib import contextmanager, asynccontextmanager
+from typing import Generator, AsyncGenerator, Optional, Dict, Any
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text, inspect, event
 from datetime import datetime
 
-from app.db.base import SessionLocal, Base, engine
-from app.db.models import User, Application, Document, Task, QuestionnaireAnswer
+from app.db.base import SessionLocal, AsyncSessionLocal, Base, engine, async_engine
+from app.db.models import User, Application, Document, Task, QuestionnaireAnswer, ApplicationAnswers, UploadJob, ProtocolBuild
+from app.db.migrations import migrate, current_version, latest_version
 from app.config.logging_config import get_logger
 
 # Initialize logger
 logger = get_logger(__name__)
 
-# Database schema version (increment this for schema changes)
-SCHEMA_VERSION = 0
+# Database schema version: the last migration in app/db/migrations.py
+SCHEMA_VERSION = latest_version()
 
 # Configure SQLAlchemy engine logging
 echo_logger = get_logger('sqlalchemy.engine')
@@ -35,22 +37,36 @@ def session_scope() -> Generator[Session, None, None]:
         session.close()
         logger.debug("Database session closed")
 
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncGenerator[AsyncSession, None]:
+    """Async-вариант session_scope: не блокирует event loop бота на запросах к БД."""
+    session = AsyncSessionLocal()
+    try:
+        logger.debug("Async database session started")
+        yield session
+        await session.commit()
+        logger.debug("Async database session committed successfully")
+    except Exception as e:
+        logger.error(f"Async session rollback due to error: {str(e)}", exc_info=True)
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+        logger.debug("Async database session closed")
+
+
+async def dispose_async_engine() -> None:
+    """Закрывает пул асинхронных соединений при остановке бота"""
+    await async_engine.dispose()
+
 def get_db_version() -> int:
     """Get the current database schema version."""
     try:
-        with session_scope() as session:
-            # Check if version table exists
-            inspector = inspect(engine)
-            if 'alembic_version' not in inspector.get_table_names():
-                logger.info("Database version table not found, assuming version 0")
-                return 0
-                
-            result = session.execute(text("SELECT version_num FROM alembic_version LIMIT 1")).fetchone()
-            if result:
-                version = int(result[0])
-                logger.debug(f"Current database version: {version}")
-                return version
-            return 0
+        with engine.begin() as conn:
+            version = current_version(conn)
+            logger.debug(f"Current database version: {version}")
+            return version
     except Exception as e:
         logger.error(f"Error getting database version: {str(e)}")
         return 0
@@ -97,10 +113,11 @@ def init_db() -> None:
         
         if not existing_tables:
             logger.info("No existing tables found. Creating all tables...")
-            Base.metadata.create_all(bind=engine)
-            logger.info("All tables created successfully")
         else:
             logger.info(f"Found {len(existing_tables)} existing tables")
+        # Таблицы, индексы и прочие изменения схемы — через версионные миграции
+        migrate(engine)
+        logger.info("All tables are in place")
             
         # Verify schema
         status = verify_schema()
@@ -111,7 +128,6 @@ def init_db() -> None:
             
         if not status['tables_exist'] or not status['schema_valid']:
             logger.warning("Database schema is invalid or outdated")
-            # Here you could add schema migration logic if needed
             
         logger.info("Database initialization completed successfully")
         
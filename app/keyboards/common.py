@@ -28,12 +28,12 @@ def menu_kb():
     kb.adjust(2)
     return kb.as_markup(resize_keyboard=True)
 
+DEAL_TYPES = ["Покупка", "Продажа", "Альтернатива", "Юр. услуги"]
+
 def deal_type_kb():
     kb = ReplyKeyboardBuilder()
-    kb.button(text="Покупка")
-    kb.button(text="Продажа")
-    kb.button(text="Альтернатива")
-    kb.button(text="Юр. услуги")
+    for deal_type in DEAL_TYPES:
+        kb.button(text=deal_type)
     kb.adjust(2)
     return kb.as_markup(resize_keyboard=True)
 
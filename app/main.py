@@ -2,21 +2,149 @@ import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.client.bot import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
 
 from app.config.config import settings
 from app.config.logging_config import get_logger
 from app.db.models import UserRole
-from app.db.repository import init_db
+from app.db.repository import init_db, dispose_async_engine
 from app.routers.common import router as common_router
 from app.routers.agent import router as agent_router
 from app.routers.rop import router as rop_router
 from app.routers.lawyer import router as lawyer_router
 from app.services.notifier import Notifier
+from app.services import yandex_disk as ya
+from app.services.upload_queue import UploadQueue
+from app.services.protocol_filler import load_template
+from app.services.protocol_renderer import ProtocolRenderer
+from app.services.user_cache import UserCache
+from app.services.department_routing import DepartmentRouting
+from app.services.backup import BackupService, sqlite_path
+from app.services.archive import ArchiveService
+from app.services.blob_cache import BlobCache
+from app.services.webhook import WebhookServer
 from app.utils.role_guard import AccessGuard, RoleMiddleware
 
 # Initialize logger
 logger = get_logger(__name__)
 
+def create_fsm_storage(url: str) -> BaseStorage:
+    """Хранилище состояний FSM: память процесса или Redis, если задан url"""
+    if not url:
+        return MemoryStorage()
+    try:
+        # Redis — необязательная зависимость (extra «redis»)
+        from aiogram.fsm.storage.redis import RedisStorage
+    except ImportError as e:
+        raise RuntimeError("FSM_STORAGE_URL is set but the redis package is not installed") from e
+    return RedisStorage.from_url(url)
+
+
+def setup_dispatcher(bot: Bot) -> Dispatcher:
+    """Диспетчер со всеми сервисами, роутерами и middleware (роутеры можно подключить один раз)"""
+    dp = Dispatcher(storage=create_fsm_storage(settings.fsm_storage_url))
+    dp.shutdown.register(dp.storage.close)
+    logger.info(f"FSM storage: {type(dp.storage).__name__}")
+
+    # Initialize notifier
+    logger.info("Initializing notifier...")
+    notifier = Notifier(bot)
+    dp['notifier'] = notifier
+
+    # Рендер протоколов в отдельных процессах
+    renderer = ProtocolRenderer(
+        workers=settings.render_workers or None,
+        max_queue=settings.render_max_queue,
+    )
+    dp['renderer'] = renderer
+
+    # Очередь выгрузки на Яндекс.Диск; она же повторяет отложенный рендер протоколов
+    upload_queue = UploadQueue(
+        workers=settings.upload_workers,
+        max_attempts=settings.upload_max_attempts,
+        retry_base=settings.upload_retry_base,
+        retry_cap=settings.upload_retry_cap,
+        poll_interval=settings.upload_poll_interval,
+        renderer=renderer,
+    )
+    dp['upload_queue'] = upload_queue
+    # Очередь запускается после рендера и останавливается раньше него
+    dp.startup.register(renderer.start)
+    dp.startup.register(upload_queue.start)
+    dp.shutdown.register(upload_queue.stop)
+    dp.shutdown.register(renderer.stop)
+
+    # Кэш пользователей для проверки доступа без запроса к БД
+    user_cache = UserCache(ttl=settings.user_cache_ttl, max_size=settings.user_cache_size)
+    dp['user_cache'] = user_cache
+
+    # Таблица «отдел → РОПы и юристы» для назначения заявок без запросов
+    routing = DepartmentRouting()
+    dp['routing'] = routing
+    dp.startup.register(routing.load)
+
+    # Локальные файлы документов в пределах бюджета, остальное — на Я.Диске
+    blob_cache = BlobCache(settings.blob_cache_budget_mb * 1024 * 1024)
+    dp['blob_cache'] = blob_cache
+    dp.startup.register(blob_cache.start)
+    dp.shutdown.register(blob_cache.stop)
+
+    # Ночная онлайн-копия базы (только SQLite)
+    db_path = sqlite_path(settings.database_url)
+    if settings.backup_enabled and db_path:
+        backup = BackupService(
+            db_path,
+            directory=settings.backup_dir,
+            at=settings.backup_at,
+            keep=settings.backup_keep,
+            pages_per_step=settings.backup_pages_per_step,
+            step_sleep=settings.backup_step_sleep,
+        )
+        dp['backup'] = backup
+        dp.startup.register(backup.start)
+        dp.shutdown.register(backup.stop)
+
+    # Ночной перенос давно закрытых заявок в архив
+    if settings.archive_enabled:
+        archive = ArchiveService(
+            after_days=settings.archive_after_days,
+            batch_size=settings.archive_batch_size,
+            at=settings.archive_at,
+            pause=settings.archive_batch_pause,
+        )
+        dp['archive'] = archive
+        dp.startup.register(archive.start)
+        dp.shutdown.register(archive.stop)
+
+    # Общий пул соединений Яндекс.Диска закрываем при остановке
+    dp.shutdown.register(ya.close_client)
+    # Пул асинхронных соединений с БД закрываем последним
+    dp.shutdown.register(dispose_async_engine)
+
+    # Include routers
+    logger.info("Setting up routers...")
+    dp.include_router(common_router)
+    # Базовый middleware для защиты всех хендлеров
+    dp.message.middleware(AccessGuard(user_cache))
+    dp.callback_query.middleware(AccessGuard(user_cache))
+
+    # Роутер для команд РОПа
+    rop_router.message.middleware(RoleMiddleware([UserRole.rop], user_cache))
+    rop_router.callback_query.middleware(RoleMiddleware([UserRole.rop], user_cache))
+
+    # Роутер для команд юриста
+    lawyer_router.message.middleware(RoleMiddleware([UserRole.lawyer], user_cache))
+    lawyer_router.callback_query.middleware(RoleMiddleware([UserRole.lawyer], user_cache))
+
+
+    dp.include_router(agent_router)
+    dp.include_router(rop_router)
+    dp.include_router(lawyer_router)
+
+    return dp
+
+
 async def main():
     logger.info("Starting DealFlowBot in {} mode", settings.env)
     
@@ -25,38 +153,35 @@ async def main():
         logger.info("Initializing database...")
         init_db()
         
+        # Разбираем шаблон протокола один раз при старте
+        load_template()
+
         # Create bot and dispatcher
         logger.info("Creating bot and dispatcher...")
         bot = Bot(settings.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-        dp = Dispatcher()
-        
-        # Initialize notifier
-        logger.info("Initializing notifier...")
-        notifier = Notifier(bot)
-        dp['notifier'] = notifier
-        
-        # Include routers
-        logger.info("Setting up routers...")
-        dp.include_router(common_router)
-        # Базовый middleware для защиты всех хендлеров
-        dp.message.middleware(AccessGuard())
-        dp.callback_query.middleware(AccessGuard())
-
-        # Роутер для команд РОПа
-        rop_router.message.middleware(RoleMiddleware([UserRole.rop]))
-        rop_router.callback_query.middleware(RoleMiddleware([UserRole.rop]))
+        dp = setup_dispatcher(bot)
 
-        # Роутер для команд юриста
-        lawyer_router.message.middleware(RoleMiddleware([UserRole.lawyer]))
-        lawyer_router.callback_query.middleware(RoleMiddleware([UserRole.lawyer]))
-
-
-        dp.include_router(agent_router)
-        dp.include_router(rop_router)
-        dp.include_router(lawyer_router)
-        
-        logger.info("Starting bot polling...")
-        await dp.start_polling(bot)
+        if settings.bot_mode == "webhook":
+            if isinstance(dp.storage, MemoryStorage):
+                logger.warning("FSM state is kept in process memory: run a single webhook instance "
+                               "or set FSM_STORAGE_URL")
+            server = WebhookServer(
+                dp,
+                bot,
+                secret_token=settings.webhook_secret,
+                path=settings.webhook_path,
+                host=settings.webhook_host,
+                port=settings.webhook_port,
+                url=settings.webhook_url or None,
+                max_concurrent=settings.updates_concurrency,
+                max_connections=settings.webhook_max_connections,
+                shutdown_timeout=settings.webhook_shutdown_timeout,
+            )
+            logger.info("Starting webhook server...")
+            await server.run()
+        else:
+            logger.info("Starting bot polling...")
+            await dp.start_polling(bot, tasks_concurrency_limit=settings.updates_concurrency)
         
     except Exception as e:
         logger.exception("An error occurred while starting the bot")
@@ -1,16 +1,27 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, FSInputFile, ReplyKeyboardRemove, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from app.db.models import Application, ApplicationStatus, QuestionnaireAnswer, Document, User, Task, UserRole
-from app.db.repository import session_scope
+from app.db.models import Application, ApplicationStatus, Document, User, Task, UserRole
+from app.db.repository import async_session_scope
 from app.keyboards.common import doc_type_kb, deal_type_kb, object_type_kb, review_kb
-from app.services import yandex_disk as ya, notifier
+from app.services import notifier
 from app.services.notifier import Notifier
-from app.services.protocol_filler import fill_protocol
+from app.services.upload_queue import UploadQueue
+from app.services.storage import save_telegram_file, schedule_remote_upload
+from app.services.blob_cache import BlobCache
+from app.services.protocol_renderer import ProtocolRenderer
+from app.services.protocol_builder import build_protocol_or_defer
+from app.services.user_cache import UserIdentity
+from app.services.department_routing import DepartmentRouting
+from app.services.application_list import Page, agent_applications_page, OLDER, NEWER
+from app.services.questionnaire import QUESTIONS, buffer_answers, flush_answers, clear_state
+from app.config.config import settings
 from pathlib import Path
-import hashlib
+from typing import Optional, Tuple
+import html
 import json
 from datetime import datetime
 import logging
@@ -22,26 +33,6 @@ logger = get_logger(__name__)
 
 router = Router(name="agent")
 
-QUESTIONS = [
-    ("q01", "Адрес объекта соответствует расположению по карте, соседним домам и квартирам?", ["да", "нет"]),
-    ("q02", "Новорожденные дети без регистрации?", ["проживают", "не проживают"]),
-    ("q03", "На Объекте незарегистрированная перепланировка?", ["имеется", "отсутствует"]),
-    ("q04", "Данные о незарегистрированной  перепланировке в документах БТИ?", ["есть", "нет"]),
-    ("q05", "Претензии третьих лиц в отношении прав на Объект?", ["имеются", "отсутствуют"]),
-    ("q06", "У собств./польз. есть признаки неадекватного поведения/ псих.заболевания", ["да", "нет"]),
-    ("q07", "Задолженность за электроэнергию/коммунальные платежи/капремонт", ["отсутствует", "имеется", "нет данных"]),
-    ("q08", "Дом, планируется", ["под снос", "реконструкцию", "не планируется", "не установлено"]),
-    ("q09", "Объект перед сделкой занимают", ["собственники", "арендаторы", "физически свободен"]),
-    ("q10", "Объект продается", ["по доверенности", "лично собственником"]),
-    ("q11", "К моменту сделки на объекте зарегистрировано ___ человек, из них несовершеннолетних ___ (ручной ввод)", []),
-    ("q12", "Срок владения Объектом (ручной ввод)", []),
-    ("q13", "Является единственным жильем на момент продажи", ["да", "нет"]),
-    ("q14", "Заявление о личном участии в сделке", ["было", "не было"]),
-    ("q15", "Средства материнского капитала на приобретение Объекта", ["использовались", " не использовались"]),
-    ("q16", "Относится ли Объект к объектам культурного наследия", ["да", "нет"])
-
-]
-
 class CreateDeal(StatesGroup):
     deal_type = State()
     contract_no = State()
@@ -66,6 +57,8 @@ async def new_application(message: Message, state: FSMContext):
     """Start creating a new application"""
     logger.info(f"Starting new application for user {message.from_user.id}")
     try:
+        # Недописанная анкета прошлой заявки не должна потеряться
+        await flush_answers(state)
         await state.set_state(CreateDeal.deal_type)
         await message.answer("Тип сделки (Покупка/Продажа/Альтернатива/Юр.услуги):", reply_markup=deal_type_kb())
     except Exception as e:
@@ -155,57 +148,48 @@ async def head_name_handler(message: Message, state: FSMContext):
        # await message.answer("Ошибка при обработке ФИО руководителя. Пожалуйста, попробуйте снова.")
 
 @router.message(CreateDeal.review)
-async def review_info_handler(message: Message, state: FSMContext):
+async def review_info_handler(message: Message, state: FSMContext, upload_queue: UploadQueue, routing: DepartmentRouting, user: UserIdentity):
     """Handle review and agent name input"""
     logger.debug(f"Review and agent name input: {message.text}")
     try:
         if message.text.strip() != "✅":
             await message.answer("Отмена создания заявки", reply_markup=ReplyKeyboardRemove())
-            await state.clear()
+            await clear_state(state)
             return
         await message.answer(f"Переходим к протоколу...", reply_markup=ReplyKeyboardRemove())
         data = await state.get_data()
         sanitazed_contarct_no = data.get("contract_no").replace("/", ".")
         folder_name = f"{data.get('protocol_date')}-{data.get('deal_type')}-{sanitazed_contarct_no}"
-        yadisk_path = ya.create_folder(folder_name)
         # Создаём заявку сразу, чтобы сохранять ответы и файлы в БД по app_id
-        with session_scope() as s:
-            agent = s.query(User).filter(User.telegram_id == message.from_user.id).first()
-            # TODO временный костыль на несколько юзеров
-
-            rop = s.query(User).filter(
-                User.role == UserRole.rop,
-                User.department_no == agent.department_no,
-                User.is_active == True,
-                User.is_approved == True
-            ).first() or None
-
-
-            lawyer = s.query(User).filter(
-                User.role == UserRole.lawyer,
-                User.department_no == agent.department_no,
-                User.is_active == True,
-                User.is_approved == True
-            ).first() or None
-
-
-            app = Application(
-                deal_type=data["deal_type"],
-                contract_no=data.get("contract_no"),
-                protocol_date=data.get("protocol_date"),
-                address=data.get("address"),
-                object_type=data.get("object_type"),
-                head_name=rop.full_name,
-                agent_name=agent.full_name,
-                status=ApplicationStatus.created,
-                yandex_folder=yadisk_path,
-                agent_id=agent.id if agent else None,
-                rop_id=rop.id if rop else 1,
-                lawyer_id=lawyer.id if lawyer else 1
-            )
-            s.add(app)
-            s.flush()  # получаем app.id
-            app_id = app.id
+        # РОП и юрист берутся из таблицы маршрутизации, без запросов к БД
+        rop, lawyer = routing.assign(user.department_no)
+        if not rop or not lawyer:
+            logger.warning(f"Application of agent {user.id} has no reviewer: rop={rop and rop.id}, lawyer={lawyer and lawyer.id}")
+        try:
+            async with async_session_scope() as s:
+                app = Application(
+                    deal_type=data["deal_type"],
+                    contract_no=data.get("contract_no"),
+                    protocol_date=data.get("protocol_date"),
+                    address=data.get("address"),
+                    object_type=data.get("object_type"),
+                    head_name=rop.full_name if rop else None,
+                    agent_name=user.full_name,
+                    status=ApplicationStatus.created,
+                    yandex_folder=folder_name,
+                    agent_id=user.id,
+                    rop_id=rop.id if rop else None,
+                    lawyer_id=lawyer.id if lawyer else None
+                )
+                s.add(app)
+                await s.flush()  # получаем app.id
+                app_id = app.id
+                # Папку на Я.Диске создаём в фоне, чтобы сбой Диска не ломал анкету
+                upload_queue.enqueue_create_folder(s, app_id, folder_name)
+        except Exception:
+            # Заявка не создана — возвращаем загрузку проверяющим
+            routing.release(rop and rop.id, lawyer and lawyer.id)
+            raise
         await state.update_data(application_id=app_id)
         await state.update_data(question_index=0)
         await ask_next_question(message, state)
@@ -244,7 +228,6 @@ async def save_answer_and_next(message: Message, state: FSMContext):
     try:
         data = await state.get_data()
         idx = data.get("question_index", 0)
-        app_id = data["application_id"]
         key, _, _ = QUESTIONS[idx]
         answer = message.text.strip()
         
@@ -254,19 +237,8 @@ async def save_answer_and_next(message: Message, state: FSMContext):
             numbers = answer.replace(',', ' ').split()
             if len(numbers) >= 2 and all(num.isdigit() for num in numbers[:2]):
                 total, minors = numbers[:2]
-                with session_scope() as s:
-                    # Save total registered people
-                    s.add(QuestionnaireAnswer(
-                        application_id=app_id, 
-                        question_key="q11_1",
-                        answer_value=total
-                    ))
-                    # Save number of minors
-                    s.add(QuestionnaireAnswer(
-                        application_id=app_id, 
-                        question_key="q11_2",
-                        answer_value=minors
-                    ))
+                # Total registered people and number of minors
+                answers = [("q11_1", total), ("q11_2", minors)]
             else:
                 await message.answer(
                     "Пожалуйста, введите два числа через пробел или запятую: "
@@ -274,27 +246,24 @@ async def save_answer_and_next(message: Message, state: FSMContext):
                 )
                 return
         else:
-            # Normal question processing
-            with session_scope() as s:
-                s.add(QuestionnaireAnswer(
-                    application_id=app_id, 
-                    question_key=key, 
-                    answer_value=answer
-                ))
-        
-        await state.update_data(question_index=idx+1)
+            answers = [(key, answer)]
+
+        # Ответы копятся в FSM; в БД — одной пачкой в конце анкеты и на контрольных точках
+        pending = await buffer_answers(state, answers, question_index=idx+1)
+        if idx + 1 >= len(QUESTIONS) or pending >= settings.answers_checkpoint_every:
+            await flush_answers(state)
         await ask_next_question(message, state)
     except Exception as e:
         logger.error(f"Error in save_answer_and_next: {e}")
         await message.answer("Ошибка при обработке ответов. Пожалуйста, попробуйте снова.")
 
 @router.callback_query(F.data.startswith("doc_"))
-async def choose_doc_type(cb: CallbackQuery, state: FSMContext):
+async def choose_doc_type(cb: CallbackQuery, state: FSMContext, upload_queue: UploadQueue, renderer: ProtocolRenderer):
     """Handle document type selection"""
     logger.debug(f"Document type selected: {cb.data}")
     try:
         if cb.data == "doc_done":
-            await finish_upload(cb, state)
+            await finish_upload(cb, state, upload_queue, renderer)
             return
         doc_type = cb.data.replace("doc_", "")
         await state.update_data(current_doc_type=doc_type)
@@ -306,26 +275,28 @@ async def choose_doc_type(cb: CallbackQuery, state: FSMContext):
         await cb.answer("Ошибка при обработке типа документа. Пожалуйста, попробуйте снова.")
 
 @router.message(CreateDeal.awaiting_file, F.document)
-async def on_document(message: Message, state: FSMContext):
+async def on_document(message: Message, state: FSMContext, upload_queue: UploadQueue, blob_cache: BlobCache):
     """Handle document upload"""
     logger.debug(f"Document uploaded: {message.document}")
     try:
-        await _save_incoming_file(message, state, is_photo=False)
+        await _save_incoming_file(message, state, upload_queue, blob_cache, is_photo=False)
     except Exception as e:
         logger.error(f"Error in on_document: {e}")
         await message.answer("Ошибка при обработке документа. Пожалуйста, попробуйте снова.")
 
 @router.message(CreateDeal.awaiting_file, F.photo)
-async def on_photo(message: Message, state: FSMContext):
+async def on_photo(message: Message, state: FSMContext, upload_queue: UploadQueue, blob_cache: BlobCache):
     """Handle photo upload"""
     logger.debug(f"Photo uploaded: {message.photo}")
     try:
-        await _save_incoming_file(message, state, is_photo=True)
+        await _save_incoming_file(message, state, upload_queue, blob_cache, is_photo=True)
     except Exception as e:
         logger.error(f"Error in on_photo: {e}")
         await message.answer("Ошибка при обработке фото. Пожалуйста, попробуйте снова.")
 
-async def _save_incoming_file(message: Message, state: FSMContext, is_photo: bool):
+async def _save_incoming_file(
+    message: Message, state: FSMContext, upload_queue: UploadQueue, blob_cache: BlobCache, is_photo: bool
+):
     """Save the incoming file"""
     logger.debug(f"Saving incoming file")
     try:
@@ -333,36 +304,39 @@ async def _save_incoming_file(message: Message, state: FSMContext, is_photo: boo
         app_id = data["application_id"]
         doc_type = data.get("current_doc_type", "other")
 
-        # Готовим путь
-        base = Path("./data") / str(app_id)
-        base.mkdir(parents=True, exist_ok=True)
-
         if is_photo:
             tg_file = message.photo[-1]
             filename = f"{doc_type}.jpg"
-            dest = base / filename
-            await message.bot.download(tg_file, destination=dest)
         else:
             tg_file = message.document
             filename = tg_file.file_name or f"{doc_type}.bin"
-            dest = base / filename
-            await message.bot.download(tg_file, destination=dest)
 
-        # Хэш
-        sha256 = hashlib.sha256(dest.read_bytes()).hexdigest()
+        async with async_session_scope() as s:
+            app = await s.get(Application, app_id)
+            remote_dir = app.yandex_folder if app else None
+
+        # Скачиваем, хэшируем и отправляем на Я.Диск за один проход; уже
+        # известный файл (по file_unique_id) не скачивается и не отправляется
+        saved = await save_telegram_file(
+            message.bot, tg_file.file_id, filename, remote_dir=remote_dir, cache=blob_cache,
+            file_unique_id=tg_file.file_unique_id,
+        )
 
-        # В БД
-        with session_scope() as s:
-            s.add(Document(
+        # В БД; если потоковая загрузка не удалась — догрузит очередь
+        async with async_session_scope() as s:
+            doc = Document(
                 application_id=app_id,
                 doc_type=doc_type,
                 file_name=str(filename),
-                local_path=str(dest),
-                sha256=sha256,
-            ))
-            app = s.query(Application).get(app_id)
-            if app and app.yandex_folder:
-                ya.upload_file(app.yandex_folder, str(dest), str(filename))
+                local_path=str(saved.path),
+                yandex_path=saved.remote_path,
+                sha256=saved.sha256,
+                file_unique_id=tg_file.file_unique_id,
+            )
+            s.add(doc)
+            await s.flush()
+            if remote_dir and not saved.remote_path:
+                await schedule_remote_upload(s, upload_queue, app_id, saved, remote_dir, str(filename), doc.id)
 
         await message.answer(
             f"Файл сохранён: <code>{filename}</code> Тип: {doc_type.upper()} Ещё выбрать тип:",
@@ -373,139 +347,155 @@ async def _save_incoming_file(message: Message, state: FSMContext, is_photo: boo
         logger.error(f"Error in _save_incoming_file: {e}")
         await message.answer("Ошибка при сохранении файла. Пожалуйста, попробуйте снова.")
 
-async def finish_upload(cb: CallbackQuery, state: FSMContext):
+async def finish_upload(cb: CallbackQuery, state: FSMContext, upload_queue: UploadQueue, renderer: ProtocolRenderer):
     """Handle completion of document upload"""
     logger.info(f"Finishing upload for user {cb.from_user.id}")
+    public_link = None
+    protocol_deferred = False
     try:
         data = await state.get_data()
-        app_id = data.get("application_id")
-        public_link = None
-        if app_id:
-            with session_scope() as s:
-                app = s.query(Application).get(app_id)
-                if app:
-                    app.status = ApplicationStatus.created
-                    # Try to get public link if yandex_folder exists
-                    if getattr(app, "yandex_folder", None):
-                        public_link = ya.get_public_link(app.yandex_folder)
-                        # Save the public link in the Application if the field exists
-                        if hasattr(app, "yandex_public_url"):
-                            app.yandex_public_url = public_link
-
-        template_path = "./templates/protocol_template.docx"
-        output_path = f"./data/{app_id}/protocol.docx"
-
-        # Собираем данные
-        with session_scope() as s:
-            app = s.query(Application).get(app_id)
-            answers = s.query(QuestionnaireAnswer).filter_by(application_id=app_id).all()
-            data_dict = {
-                "deal_type": app.deal_type or "",
-                "contract_no": app.contract_no or "",
-                "protocol_date": app.protocol_date or "",
-                "address": app.address or "",
-                "object_type": app.object_type or "",
-                "head_name": app.head_name or "",
-                "agent_name": app.agent_name or ""
-            }
-            for ans in answers:
-                data_dict[ans.question_key] = ans.answer_value
-
-            fill_protocol(template_path, output_path, data_dict)
-
-        # Загрузка на Яндекс.Диск
-            if getattr(app, "yandex_folder", None):
-                ya.upload_file(app.yandex_folder, output_path, "protocol.docx")
-                # Получаем РОПа
-            rop = s.get(User, app.rop_id) if app.rop_id else None
-            if rop:
-                text = (
-                    f"📝 Новая заявка #{app.id} от агента: {app.agent_name}\n"
-                    f"Для просмотра и проверки используйте команду /rop"
-                )
-                await cb.message.bot.send_message(rop.telegram_id, text)
+        # При доработке возвращённой заявки id лежит под ключом app_id
+        app_id = data.get("application_id") or data.get("app_id")
+
+        async with async_session_scope() as s:
+            app = await s.get(Application, app_id)
+            app.status = ApplicationStatus.created
+            # Публичная ссылка уже могла быть получена при прошлой отправке
+            public_link = app.yandex_public_url
+            yandex_folder = app.yandex_folder
+            agent_name = app.agent_name
+            rop = await s.get(User, app.rop_id) if app.rop_id else None
+            rop_telegram_id = rop.telegram_id if rop else None
+
+        # Протокол пересобирается и выгружается, только если что-то изменилось;
+        # если рендер сейчас занят или упал, его повторит очередь
+        protocol_deferred = await build_protocol_or_defer(app_id, renderer, upload_queue) is None
+
+        # Публикация папки — в фоновой очереди
+        if yandex_folder and not public_link:
+            async with async_session_scope() as s:
+                upload_queue.enqueue_publish(s, app_id, yandex_folder)
+
+        if rop_telegram_id:
+            text = (
+                f"📝 Новая заявка #{app_id} от агента: {agent_name}\n"
+                f"Для просмотра и проверки используйте команду /rop"
+            )
+            await cb.message.bot.send_message(rop_telegram_id, text)
     except Exception as e:
         logger.error(f"Error in finish_upload: {e}")
+        await cb.message.answer("Ошибка при завершении загрузки. Пожалуйста, нажмите «Готово» ещё раз.")
+        await cb.answer()
+        return
 
-
-    await state.clear()
+    await clear_state(state)
     msg = "Загрузка завершена ✅. Заявка передана для проверки РОПом."
     if public_link:
         msg += f"\n\nСоздана папка в Яндекс.Диске: {public_link}"
+    else:
+        msg += "\n\nФайлы выгружаются на Яндекс.Диск, ссылка появится в карточке заявки."
+    if protocol_deferred:
+        msg += "\n\n⏳ Протокол сейчас сформировать не удалось — он будет пересобран автоматически."
     await cb.message.answer(msg)
     await cb.answer()
 
+STATUS_TEXT = {
+    ApplicationStatus.created: "📝 На проверке у РОПа",
+    ApplicationStatus.to_lawyer: "🔍 На проверке у юриста",
+    ApplicationStatus.returned_rop: "🔄 Требуются доработки",
+    ApplicationStatus.lawyer_task: "📋 Требуются дополнительные документы",
+    ApplicationStatus.closed: "✅ Закрыта",
+}
+
+
+def render_applications_page(page: Page) -> Tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура одной страницы «Мои заявки»"""
+    text = "<b>Мои заявки</b>\n"
+    kb = InlineKeyboardBuilder()
+    for app in page.items:
+        text += f"\n#{app.id} - {html.escape(app.deal_type or '')}\n{STATUS_TEXT.get(app.status, app.status.value)}"
+        if app.address:
+            text += f"\n🏠 {html.escape(app.address)}"
+        if app.status == ApplicationStatus.returned_rop and app.rop_id:
+            text += "\n❗ Возвращена с комментарием"
+        elif app.status == ApplicationStatus.lawyer_task and app.task_text:
+            task_text = app.task_text if len(app.task_text) <= 200 else app.task_text[:200] + "…"
+            text += f"\n📌 Задача: {html.escape(task_text)}"
+        text += "\n"
+
+        if app.status == ApplicationStatus.returned_rop:
+            kb.button(text=f"#{app.id} - Доработать", callback_data=f"agent_edit_{app.id}")
+        elif app.status == ApplicationStatus.lawyer_task:
+            kb.button(text=f"#{app.id} - Загрузить документы", callback_data=f"agent_upload_{app.id}")
+        if app.status != ApplicationStatus.closed:
+            kb.button(text=f"#{app.id} - Пересобрать протокол", callback_data=f"agent_rebuild_{app.id}")
+    kb.adjust(1)
+
+    nav = []
+    if page.has_newer:
+        nav.append(InlineKeyboardButton(text="◀️ Новее", callback_data=f"my_apps:{NEWER}:{page.items[0].id}"))
+    if page.has_older:
+        nav.append(InlineKeyboardButton(text="Старше ▶️", callback_data=f"my_apps:{OLDER}:{page.items[-1].id}"))
+    if nav:
+        kb.row(*nav)
+    return text, kb.as_markup()
+
+
 @router.message(F.text == "/my_applications")
 @router.message(F.text == "📂 Мои заявки")
-async def my_applications(message: Message):
-    """Show all applications for the current agent"""
-    with session_scope() as s:
-        # Get current user
-        user = s.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
-        if not user:
-            return await message.answer("Ошибка: пользователь не найден")
-        
-        # Get all user's applications
-        apps = s.query(Application).filter(Application.agent_id == user.id).order_by(Application.created_at.desc()).all()
-        
-        if not apps:
-            return await message.answer("У вас пока нет заявок. Создайте новую с помощью команды /new")
-        
-        # Group applications by status
-        apps_by_status = {}
-        for app in apps:
-            status_name = app.status.value
-            if status_name not in apps_by_status:
-                apps_by_status[status_name] = []
-            apps_by_status[status_name].append(app)
-        
-        # Show applications by status
-        for status, status_apps in apps_by_status.items():
-            status_text = {
-                "CREATED": "📝 На проверке у РОПа",
-                "TO_LAWYER": "🔍 На проверке у юриста",
-                "RETURNED_ROP": "🔄 Требуются доработки",
-                "LAWYER_TASK": "📋 Требуются дополнительные документы",
-                "CLOSED": "✅ Закрытые заявки"
-            }.get(status, f"{status}")
-            
-            text = f"*{status_text}* ({len(status_apps)}):\n"
-            for app in status_apps:
-                text += f"\n#{app.id} - {app.deal_type}"
-                if app.address:
-                    text += f"\n🏠 {app.address}"
-                if app.status == ApplicationStatus.returned_rop and app.rop_id:
-                    rop = s.get(User, app.rop_id)
-                    text += "\n❗ Возвращена с комментарием"
-                elif app.status == ApplicationStatus.lawyer_task:
-                    task = s.query(Task).filter(
-                        Task.application_id == app.id,
-                        Task.status == "open"
-                    ).order_by(Task.created_at.desc()).first()
-                    if task:
-                        text += f"\n📌 Задача: {task.text}"
-                text += "\n"
-            
-            # Create keyboard with actions for each application
-            kb = InlineKeyboardBuilder()
-            for app in status_apps:
-                if app.status == ApplicationStatus.returned_rop:
-                    kb.button(text=f"#{app.id} - Доработать", callback_data=f"agent_edit_{app.id}")
-                elif app.status == ApplicationStatus.lawyer_task:
-                    kb.button(text=f"#{app.id} - Загрузить документы", callback_data=f"agent_upload_{app.id}")
-                #else:
-                #    kb.button(text=f"#{app.id} - Подробнее", callback_data=f"agent_view_{app.id}")
-            
-            kb.adjust(1)
-            await message.answer(text, reply_markup=kb.as_markup())
+async def my_applications(message: Message, user: Optional[UserIdentity] = None):
+    """Show the first page of the current agent's applications"""
+    if not user:
+        return await message.answer("Ошибка: пользователь не найден")
+    async with async_session_scope() as s:
+        page = await agent_applications_page(s, user.id, limit=settings.list_page_size)
+    if not page.items:
+        return await message.answer("У вас пока нет заявок. Создайте новую с помощью команды /new")
+    text, kb = render_applications_page(page)
+    await message.answer(text, reply_markup=kb)
+
+@router.callback_query(F.data.startswith("my_apps:"))
+async def my_applications_page(cb: CallbackQuery, user: Optional[UserIdentity] = None):
+    """Листание «Мои заявки»: та же страница редактируется на месте"""
+    if not user:
+        return await cb.answer("Ошибка: пользователь не найден", show_alert=True)
+    _, direction, cursor = cb.data.split(":")
+    async with async_session_scope() as s:
+        page = await agent_applications_page(s, user.id, int(cursor), direction, settings.list_page_size)
+    if not page.items:
+        return await cb.answer("Больше заявок нет")
+    text, kb = render_applications_page(page)
+    await cb.message.edit_text(text, reply_markup=kb)
+    await cb.answer()
+
+@router.callback_query(F.data.startswith("agent_rebuild_"))
+async def agent_rebuild_protocol(cb: CallbackQuery, upload_queue: UploadQueue, renderer: ProtocolRenderer, user: Optional[UserIdentity] = None):
+    """Rebuild the protocol if application data or the template changed"""
+    app_id = int(cb.data.split("_")[-1])
+    async with async_session_scope() as s:
+        app = await s.get(Application, app_id)
+        if not app or not user or app.agent_id != user.id:
+            return await cb.answer("Заявка не найдена", show_alert=True)
+    try:
+        rebuilt = await build_protocol_or_defer(app_id, renderer, upload_queue)
+    except Exception as e:
+        logger.error(f"Error rebuilding protocol for app {app_id}: {e}")
+        return await cb.answer("Ошибка при сборке протокола. Попробуйте позже.", show_alert=True)
+    if rebuilt is None:
+        await cb.message.answer(f"⏳ Протокол по заявке #{app_id} сейчас собрать не удалось — он будет пересобран автоматически.")
+    elif rebuilt:
+        await cb.message.answer(f"🔄 Протокол по заявке #{app_id} пересобран и отправлен на Яндекс.Диск.")
+    else:
+        await cb.message.answer(f"Протокол по заявке #{app_id} актуален — изменений нет.")
+    await cb.answer()
 
 @router.callback_query(F.data.startswith("agent_edit_"))
 async def agent_edit_application(cb: CallbackQuery, state: FSMContext):
     """Start editing a returned application"""
     app_id = int(cb.data.split("_")[-1])
     
-    with session_scope() as s:
-        app = s.query(Application).get(app_id)
+    async with async_session_scope() as s:
+        app = await s.get(Application, app_id)
         if not app or app.status != ApplicationStatus.returned_rop:
             return await cb.answer("Заявка не найдена или не требует доработки", show_alert=True)
         
@@ -554,10 +544,10 @@ async def agent_edit_application(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
 
 @router.callback_query(EditApplication.select_field)
-async def select_field_to_edit(cb: CallbackQuery, state: FSMContext):
+async def select_field_to_edit(cb: CallbackQuery, state: FSMContext, upload_queue: UploadQueue, renderer: ProtocolRenderer):
     """Handle field selection for editing"""
     if cb.data == "finish_editing":
-        await finish_upload(cb, state)
+        await finish_upload(cb, state, upload_queue, renderer)
         return
     
     field_map = {
@@ -617,23 +607,23 @@ async def save_field_edit(message: Message, state: FSMContext):
     await state.set_state(EditApplication.confirm_save)
 
 @router.callback_query(EditApplication.confirm_save)
-async def handle_edit_confirmation(cb: CallbackQuery, state: FSMContext):
+async def handle_edit_confirmation(cb: CallbackQuery, state: FSMContext, upload_queue: UploadQueue, renderer: ProtocolRenderer, routing: DepartmentRouting):
     """Handle save/continue/cancel actions after editing"""
     if cb.data == "save_changes":
-        await save_application_changes(cb, state)
+        await save_application_changes(cb, state, upload_queue, renderer, routing)
     elif cb.data == "continue_editing":
         await continue_editing(cb, state)
     elif cb.data == "cancel_editing":
         await cancel_editing(cb, state)
 
-async def save_application_changes(cb: CallbackQuery, state: FSMContext):
+async def save_application_changes(cb: CallbackQuery, state: FSMContext, upload_queue: UploadQueue, renderer: ProtocolRenderer, routing: DepartmentRouting):
     """Save all changes to the database"""
     data = await state.get_data()
     app_id = data['app_id']
     current_data = data['current_data']
     
-    with session_scope() as s:
-        app = s.query(Application).get(app_id)
+    async with async_session_scope() as s:
+        app = await s.get(Application, app_id)
         if app:
             # Update all fields
             app.deal_type = current_data['deal_type']
@@ -648,10 +638,20 @@ async def save_application_changes(cb: CallbackQuery, state: FSMContext):
             app.status = ApplicationStatus.created
             
             # Clear ROP who returned the application
+            routing.release(app.rop_id)
             app.rop_id = None
+
+    # Поля протокола могли измениться — пересобираем, если нужно
+    msg = "✅ Изменения сохранены. Заявка отправлена на повторную проверку РОПу."
+    try:
+        if await build_protocol_or_defer(app_id, renderer, upload_queue) is None:
+            msg += "\n\n⏳ Протокол сейчас сформировать не удалось — он будет пересобран автоматически."
+    except Exception as e:
+        logger.error(f"Error rebuilding protocol for app {app_id}: {e}")
+        msg += "\n\n⚠️ Протокол не пересобран — используйте «Пересобрать протокол» в «Мои заявки»."
     
-    await cb.message.answer("✅ Изменения сохранены. Заявка отправлена на повторную проверку РОПу.")
-    await state.clear()
+    await cb.message.answer(msg)
+    await clear_state(state)
     await cb.answer()
 
 async def continue_editing(cb: CallbackQuery, state: FSMContext):
@@ -668,7 +668,7 @@ async def continue_editing(cb: CallbackQuery, state: FSMContext):
 
 async def cancel_editing(cb: CallbackQuery, state: FSMContext):
     """Cancel editing and clear state"""
-    await state.clear()
+    await clear_state(state)
     await cb.message.answer("❌ Редактирование отменено.")
     await cb.answer()
 
@@ -677,8 +677,8 @@ async def agent_upload_docs(cb: CallbackQuery, state: FSMContext):
     """Handle agent uploading additional documents for a task"""
     app_id = int(cb.data.split("_")[-1])
     
-    with session_scope() as s:
-        app = s.query(Application).get(app_id)
+    async with async_session_scope() as s:
+        app = await s.get(Application, app_id)
         if not app or app.status != ApplicationStatus.lawyer_task:
             return await cb.answer("Заявка не найдена или не требует загрузки документов", show_alert=True)
         
@@ -701,13 +701,13 @@ async def upload_done(cb: CallbackQuery, state: FSMContext, notifier: Notifier):
     app_id = data.get("upload_app_id")
     
     if not app_id:
-        await state.clear()
+        await clear_state(state)
         return await cb.answer("Ошибка: не найдена заявка", show_alert=True)
     
-    with session_scope() as s:
-        app = s.query(Application).get(app_id)
+    async with async_session_scope() as s:
+        app = await s.get(Application, app_id)
         if not app:
-            await state.clear()
+            await clear_state(state)
             return await cb.answer("Ошибка: заявка не найдена", show_alert=True)
         
         # Change status back to lawyer review
@@ -715,7 +715,7 @@ async def upload_done(cb: CallbackQuery, state: FSMContext, notifier: Notifier):
         
         # Notify the lawyer
         if app.lawyer_id:
-            lawyer = s.get(User, app.lawyer_id)
+            lawyer = await s.get(User, app.lawyer_id)
             if lawyer:
                 await notifier.notify_user(
                     lawyer.telegram_id,
@@ -725,76 +725,68 @@ async def upload_done(cb: CallbackQuery, state: FSMContext, notifier: Notifier):
                 )
     
     await cb.message.answer("✅ Документы загружены и отправлены на проверку юристу")
-    await state.clear()
+    await clear_state(state)
     await cb.answer()
 
 # Add this handler for document uploads
 @router.message(F.document | F.photo, CreateDeal.upload_additional_docs)
-async def handle_additional_document(message: Message, state: FSMContext):
+async def handle_additional_document(message: Message, state: FSMContext, upload_queue: UploadQueue, blob_cache: BlobCache):
     """Handle additional document uploads for tasks"""
     data = await state.get_data()
     app_id = data.get("upload_app_id")
     
     if not app_id:
-        await state.clear()
+        await clear_state(state)
         return await message.answer("Ошибка: не найдена заявка")
     
     try:
-        # Prepare local directory
-        base = Path("./data") / str(app_id) / "additional"
-        base.mkdir(parents=True, exist_ok=True)
-        
         # Handle document or photo
         if message.document:
             tg_file = message.document
             file_ext = Path(tg_file.file_name).suffix if tg_file.file_name else ".bin"
-            filename = f"doc_{int(datetime.datetime.utcnow().timestamp())}{file_ext}"
-            dest = base / filename
-            await message.bot.download(tg_file, destination=dest)
+            filename = f"doc_{int(datetime.utcnow().timestamp())}{file_ext}"
         elif message.photo:
             tg_file = message.photo[-1]
-            filename = f"photo_{int(datetime.datetime.utcnow().timestamp())}.jpg"
-            dest = base / filename
-            await message.bot.download(tg_file, destination=dest)
+            filename = f"photo_{int(datetime.utcnow().timestamp())}.jpg"
         else:
             return await message.answer("Неподдерживаемый тип файла")
-        
-        # Calculate file hash
-        file_bytes = dest.read_bytes()
-        sha256 = hashlib.sha256(file_bytes).hexdigest()
-        
-        # Save to database and upload to Yandex.Disk
-        with session_scope() as s:
-            app = s.query(Application).get(app_id)
+
+        async with async_session_scope() as s:
+            app = await s.get(Application, app_id)
             if not app:
                 return await message.answer("Ошибка: заявка не найдена")
-            
+            remote_dir = f"{app.yandex_folder}/additional" if app.yandex_folder else None
+
+        # Stream to disk, hash and upload to Yandex.Disk in a single pass;
+        # a file already known by file_unique_id is not transferred again
+        saved = await save_telegram_file(
+            message.bot, tg_file.file_id, filename, remote_dir=remote_dir, cache=blob_cache,
+            file_unique_id=tg_file.file_unique_id,
+        )
+        
+        # Save to database; the queue uploads the file if streaming failed
+        async with async_session_scope() as s:
             # Create document record
             doc = Document(
                 application_id=app_id,
                 doc_type="additional",
                 file_name=filename,
-                local_path=str(dest),
-                yandex_path=f"{app.yandex_folder}/additional/{filename}" if app.yandex_folder else None,
-                sha256=sha256,
+                local_path=str(saved.path),
+                yandex_path=saved.remote_path,
+                sha256=saved.sha256,
+                file_unique_id=tg_file.file_unique_id,
                 meta=json.dumps({
                     "original_name": getattr(message.document, 'file_name', None) or "photo",
                     "mime_type": getattr(message.document, 'mime_type', 'image/jpeg' if message.photo else 'application/octet-stream'),
-                    "file_size": len(file_bytes),
-                    "uploaded_at": datetime.datetime.utcnow().isoformat()
+                    "file_size": saved.size or tg_file.file_size,
+                    "uploaded_at": datetime.utcnow().isoformat()
                 })
             )
             s.add(doc)
-            s.flush()  # Get the document ID
+            await s.flush()  # Get the document ID
             
-            # Upload to Yandex.Disk if folder is set
-            if app.yandex_folder:
-                try:
-                    remote_path = f"{app.yandex_folder}/additional/{filename}"
-                    ya.upload_file(app.yandex_folder, str(dest), f"{filename}")
-                    doc.yandex_path = remote_path
-                except Exception as e:
-                    logger.error(f"Failed to upload to Yandex.Disk: {str(e)}")
+            if remote_dir and not saved.remote_path:
+                await schedule_remote_upload(s, upload_queue, app_id, saved, remote_dir, filename, doc.id)
         
         await message.answer(f"✅ Файл успешно загружен: {filename}")
         
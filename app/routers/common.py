@@ -1,13 +1,27 @@
+from typing import Optional
+import asyncio
+import html
+import os
+import tempfile
+
 from aiogram import Router, F
-from aiogram.types import Message, ReplyKeyboardRemove
+from aiogram.types import Message, ReplyKeyboardRemove, FSInputFile
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
 
-from app.db.models import User, UserRole
-from app.db.repository import session_scope
+from sqlalchemy import select
+
+from app.db.models import User, UserRole, ApplicationStatus
+from app.db.repository import async_session_scope
 from app.keyboards.common import menu_kb
+from app.services.user_cache import UserCache, UserIdentity
+from app.services.department_routing import DepartmentRouting
+from app.services.questionnaire import clear_state
+from app.services.search import search_applications
+from app.services.export import FORMATS, export_applications, export_filename
+from app.config.config import settings
 from app.config.logging_config import get_logger
 from app.routers.rop import notify_rop_about_registration
 
@@ -23,16 +37,14 @@ class Reg(StatesGroup):
     ask_edit_value = State()
 
 @router.message(F.text == "/start")
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, user: Optional[UserIdentity] = None):
     logger.info(f"Received /start from user {message.from_user.id}")
     try:
-        # Проверка, зарегистрирован ли пользователь
-        with session_scope() as s:
-            u = s.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
-            if u:
-                logger.info(f"User {message.from_user.id} is already registered")
-                return await message.answer("Вы уже зарегистрированы. "
-                                            "Для редактирования информации используйте /me", reply_markup=menu_kb() )
+        # Проверка, зарегистрирован ли пользователь (AccessGuard уже достал его из кэша)
+        if user:
+            logger.info(f"User {message.from_user.id} is already registered")
+            return await message.answer("Вы уже зарегистрированы. "
+                                        "Для редактирования информации используйте /me", reply_markup=menu_kb() )
 
         await state.set_state(Reg.ask_fullname)
         await message.answer("Привет! Введите ваше ФИО для регистрации:")
@@ -59,13 +71,13 @@ async def reg_fullname(message: Message, state: FSMContext):
         await message.answer("Произошла ошибка. Пожалуйста, введите ФИО снова:")
 
 @router.message(Reg.ask_department)
-async def reg_department(message: Message, state: FSMContext):
+async def reg_department(message: Message, state: FSMContext, user_cache: UserCache, routing: DepartmentRouting):
     logger.info(f"Processing department for user {message.from_user.id}")
     try:
         dep = None if message.text.strip() == "-" else message.text.strip()
         data = await state.get_data()
 
-        with session_scope() as s:
+        async with async_session_scope() as s:
             # Создаём пользователя со статусом "на проверке"
             user = User(
                 telegram_id=str(message.from_user.id),
@@ -76,15 +88,11 @@ async def reg_department(message: Message, state: FSMContext):
                 is_approved=False
             )
             s.add(user)
-            s.flush()  # получаем user.id
+            await s.flush()  # получаем user.id
 
-            # Ищем РОПа для отдела
-            rop = s.query(User).filter(
-                User.role == UserRole.rop,
-                User.department_no == dep,
-                User.is_active == True,
-                User.is_approved == True
-            ).first()
+            # РОП отдела — из таблицы маршрутизации
+            rops = routing.reviewers(UserRole.rop, dep)
+            rop = rops[0] if rops else None
 
         # Уведомление РОПа (если есть)
             if rop:
@@ -92,34 +100,35 @@ async def reg_department(message: Message, state: FSMContext):
             else:
                 logger.warning(f"Не найден активный РОП для отдела {dep}")
 
-            await state.clear()
+            await clear_state(state)
             await message.answer(
             "Заявка на регистрацию отправлена РОПу указанного отдела. "
             "Ожидайте подтверждения.",
             reply_markup=ReplyKeyboardRemove()
         )
             logger.info(f"User {message.from_user.id} registered, notification sent to ROP")
+        # В кэше пользователь ещё числится незарегистрированным
+        user_cache.invalidate(message.from_user.id)
     except Exception as e:
         logger.error(f"Error in reg_department for user {message.from_user.id}: {str(e)}")
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 @router.message(F.text == "/me")
-async def cmd_me(message: Message, state: FSMContext):
+async def cmd_me(message: Message, state: FSMContext, user: Optional[UserIdentity] = None):
     logger.info(f"Received /me from user {message.from_user.id}")
     try:
-        with session_scope() as s:
-            u = s.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
-            if not u:
-                logger.info(f"User {message.from_user.id} is not registered")
-                return await message.answer("Вы не зарегистрированы. Наберите /start")
-            await message.answer(
-                f"\nФИО: {u.full_name}\n"
-                f"Отдел: {u.department_no}\n"
-                f"Роль: {u.role.value}\n\n"
-                "Хотите изменить данные? /edit",
-                reply_markup=menu_kb()
-            )
-            logger.debug(f"User {message.from_user.id} profile retrieved")
+        u = user
+        if not u:
+            logger.info(f"User {message.from_user.id} is not registered")
+            return await message.answer("Вы не зарегистрированы. Наберите /start")
+        await message.answer(
+            f"\nФИО: {u.full_name}\n"
+            f"Отдел: {u.department_no}\n"
+            f"Роль: {u.role.value}\n\n"
+            "Хотите изменить данные? /edit",
+            reply_markup=menu_kb()
+        )
+        logger.debug(f"User {message.from_user.id} profile retrieved")
     except Exception as e:
         logger.error(f"Error in cmd_me for user {message.from_user.id}: {str(e)}")
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
@@ -128,14 +137,12 @@ async def cmd_me(message: Message, state: FSMContext):
 # --- Edit Handlers ---
 
 @router.message(F.text == "/edit")
-async def cmd_edit(message: Message, state: FSMContext):
+async def cmd_edit(message: Message, state: FSMContext, user: Optional[UserIdentity] = None):
     logger.info(f"Received /edit from user {message.from_user.id}")
     try:
         # Проверяем, зарегистрирован ли пользователь
-        with session_scope() as s:
-            u = s.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
-            if not u:
-                return await message.answer("Вы не зарегистрированы. Наберите /start")
+        if not user:
+            return await message.answer("Вы не зарегистрированы. Наберите /start")
         await state.set_state(Reg.ask_edit_field)
         kb = InlineKeyboardBuilder()
         kb.row(
@@ -171,7 +178,7 @@ async def process_edit_field_callback(call, state: FSMContext):
 
 
 @router.message(Reg.ask_edit_value)
-async def process_edit_value(message: Message, state: FSMContext):
+async def process_edit_value(message: Message, state: FSMContext, user_cache: UserCache, routing: DepartmentRouting):
     logger.info(f"User {message.from_user.id} is editing value")
     try:
         data = await state.get_data()
@@ -180,24 +187,95 @@ async def process_edit_value(message: Message, state: FSMContext):
         if not field or not value:
             await message.answer("Некорректный ввод. Попробуйте снова.")
             return
-        with session_scope() as s:
-            u = s.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
+        async with async_session_scope() as s:
+            u = (await s.execute(select(User).where(User.telegram_id == str(message.from_user.id)))).scalars().first()
             if not u:
                 await message.answer("Пользователь не найден. Наберите /start")
-                await state.clear()
+                await clear_state(state)
                 return
             if field == "full_name":
                 u.full_name = value
             elif field == "department_no":
                 u.department_no = value
-            s.commit()
-            await state.clear()
+            await s.commit()
+            user_cache.invalidate(message.from_user.id)
+            # РОП или юрист мог сменить отдел
+            routing.update_user(UserIdentity.from_user(u))
+            await clear_state(state)
             await message.answer("Данные успешно обновлены!", reply_markup=menu_kb())
             logger.info(f"User {message.from_user.id} updated {field}")
     except Exception as e:
         logger.error(f"Error in process_edit_value for user {message.from_user.id}: {str(e)}")
         await message.answer("Произошла ошибка при обновлении. Попробуйте снова.")
 
+STATUS_SHORT = {
+    ApplicationStatus.created: "у РОПа",
+    ApplicationStatus.returned_rop: "на доработке",
+    ApplicationStatus.to_lawyer: "у юриста",
+    ApplicationStatus.lawyer_task: "задача от юриста",
+    ApplicationStatus.closed: "закрыта",
+}
+
+@router.message(F.text.startswith("/find"))
+async def cmd_find(message: Message, user: Optional[UserIdentity] = None):
+    """Поиск заявок: /find <адрес, номер договора, ФИО...>"""
+    if not user:
+        return await message.answer("⛔ Вы не зарегистрированы.")
+    query = message.text[len("/find"):].strip()
+    if not query:
+        return await message.answer("Использование: /find <адрес, номер договора или ФИО>\nНапример: /find Ленина 12")
+    try:
+        async with async_session_scope() as s:
+            hits = await search_applications(s, query, user, limit=settings.list_page_size)
+    except Exception as e:
+        logger.error(f"Error in cmd_find for user {message.from_user.id}: {str(e)}")
+        return await message.answer("Произошла ошибка при поиске. Попробуйте позже.")
+    if not hits:
+        return await message.answer("Ничего не найдено.")
+    lines = [f"🔎 Найдено по запросу «{html.escape(query)}»:"]
+    for hit in hits:
+        lines.append(
+            f"\n<b>#{hit.id}</b> {html.escape(hit.deal_type or '')} · {STATUS_SHORT.get(hit.status, hit.status.value)}"
+            f"{' · 🗄 в архиве' if hit.archived else ''}"
+            f"\n📄 {html.escape(hit.contract_no or 'без номера')} · 👤 {html.escape(hit.agent_name or 'Не указан')}"
+            f"\n🏠 {html.escape(hit.address or 'адрес не указан')}"
+        )
+    await message.answer("\n".join(lines))
+
+# Bot API принимает от бота файлы до 50 МБ (локальный сервер Bot API — больше)
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+@router.message(F.text.startswith("/export"))
+async def cmd_export(message: Message, user: Optional[UserIdentity] = None):
+    """Реестр заявок файлом: /export [csv|xlsx]. Каждый видит только доступные ему заявки"""
+    if not user:
+        return await message.answer("⛔ Вы не зарегистрированы.")
+    fmt = message.text[len("/export"):].strip().lower() or "csv"
+    if fmt not in FORMATS:
+        return await message.answer("Использование: /export [csv|xlsx]")
+    await message.answer("⏳ Готовлю выгрузку реестра...")
+    filename = export_filename(fmt)
+    path = os.path.join(tempfile.gettempdir(), f"{message.from_user.id}-{filename}")
+    try:
+        # Запрос и запись файла — в потоке, чтобы не блокировать event loop
+        result = await asyncio.to_thread(export_applications, path, fmt, user=user)
+        if result.size > TELEGRAM_UPLOAD_LIMIT and not message.bot.session.api.is_local:
+            return await message.answer(
+                f"Файл выгрузки слишком большой для Telegram ({result.size // (1024 * 1024)} МБ). "
+                "Сузьте выборку или воспользуйтесь python -m app.cli.export_applications."
+            )
+        await message.answer_document(
+            FSInputFile(path, filename=filename),
+            caption=f"Реестр заявок: {result.rows} строк",
+        )
+        logger.info(f"User {message.from_user.id} exported {result.rows} applications as {fmt}")
+    except Exception as e:
+        logger.error(f"Error in cmd_export for user {message.from_user.id}: {str(e)}")
+        await message.answer("Произошла ошибка при выгрузке. Попробуйте позже.")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
 def yes_no_kb():
     kb = InlineKeyboardBuilder()
     kb.row(
@@ -6,8 +6,11 @@ from sqlalchemy.orm import joinedload
 import datetime
 
 from app.db.models import Application, ApplicationStatus, User, Task
-from app.db.repository import session_scope
+from app.db.repository import async_session_scope
 from app.services.notifier import Notifier
+from app.services.user_cache import UserIdentity
+from app.services.department_routing import DepartmentRouting
+from app.utils.review_queue import QueueView, show_queue
 from app.config.logging_config import get_logger
 
 # Initialize logger
@@ -18,54 +21,37 @@ router = Router(name="lawyer")
 class LawyerStates(StatesGroup):
     task_text = State()
 
-def _lawyer_actions_kb(app_id: int, yandex_public_url: str):
-    """Create inline keyboard for lawyer actions"""
-    logger.debug(f"Creating actions keyboard for app {app_id}")
-    from aiogram.utils.keyboard import InlineKeyboardBuilder
-    kb = InlineKeyboardBuilder()
-    if yandex_public_url:
-        kb.button(text="📁 Яндекс.Диск", url=yandex_public_url)
-    kb.button(text="📝 Поставить задачу", callback_data=f"lawyer_task_{app_id}")
-    kb.button(text="✅ Закрыть сделку", callback_data=f"lawyer_close_{app_id}")
-    kb.adjust(1)
-    return kb.as_markup()
+LAWYER_QUEUE = "lawyer_q"
+LAWYER_ACTIONS = [("📝 #{id} Задача", "lawyer_task_"), ("✅ #{id} Закрыть", "lawyer_close_")]
 
 @router.message(F.text == "/lawyer")
-async def list_for_lawyer(message: Message):
+async def list_for_lawyer(message: Message, user: UserIdentity):
     """Show applications needing lawyer review"""
     logger.info(f"Lawyer {message.from_user.id} requested review list")
     try:
-        with session_scope() as s:
-            apps = s.query(Application).filter(
-                Application.status == ApplicationStatus.to_lawyer
-            ).options(joinedload(Application.agent)).all()
-            
-            if not apps:
-                logger.info("No applications for review")
-                return await message.answer("Нет заявок на проверке.")
-            
-            for app in apps:
-                try:
-                    text = (f"📋 *Заявка #{app.id}*\n"
-                            f"Тип: {app.deal_type}\n"
-                            f"Адрес: {app.address}\n"
-                            f"Агент: {app.agent.full_name if app.agent else 'Не указан'}")
-                    yandex_link = getattr(app, 'yandex_public_url', None)
-                    await message.answer(text, reply_markup=_lawyer_actions_kb(app.id, yandex_link))
-                except Exception as e:
-                    logger.error(f"Error showing app {app.id}: {e}")
+        await show_queue(message, user, ApplicationStatus.to_lawyer, "Заявки на проверку юриста", LAWYER_QUEUE, LAWYER_ACTIONS)
     except Exception as e:
         logger.error(f"Error in list_for_lawyer: {e}", exc_info=True)
         await message.answer("Ошибка при загрузке заявок.")
 
+@router.callback_query(F.data.startswith(f"{LAWYER_QUEUE}:"))
+async def lawyer_queue_page(cb: CallbackQuery, user: UserIdentity):
+    """Page navigation and filters edit the same message"""
+    try:
+        await show_queue(cb, user, ApplicationStatus.to_lawyer, "Заявки на проверку юриста", LAWYER_QUEUE, LAWYER_ACTIONS,
+                         QueueView.unpack(cb.data))
+    except Exception as e:
+        logger.error(f"Error in lawyer_queue_page: {e}", exc_info=True)
+        await cb.answer("Ошибка при загрузке заявок.", show_alert=True)
+
 @router.callback_query(F.data.startswith("lawyer_task_"))
 async def lawyer_task(cb: CallbackQuery, state: FSMContext):
     """Start creating a task"""
     app_id = int(cb.data.split("_")[-1])
     logger.info(f"Lawyer {cb.from_user.id} creating task for app {app_id}")
     try:
-        with session_scope() as s:
-            if not s.query(Application).get(app_id):
+        async with async_session_scope() as s:
+            if not await s.get(Application, app_id):
                 logger.warning(f"App {app_id} not found")
                 return await cb.answer("Заявка не найдена", show_alert=True)
             
@@ -78,7 +64,7 @@ async def lawyer_task(cb: CallbackQuery, state: FSMContext):
         await cb.answer("Ошибка. Попробуйте снова.", show_alert=True)
 
 @router.message(LawyerStates.task_text)
-async def lawyer_task_text(message: Message, state: FSMContext, notifier: Notifier):
+async def lawyer_task_text(message: Message, state: FSMContext, notifier: Notifier, routing: DepartmentRouting, user: UserIdentity):
     """Save task and notify agent"""
     logger.info(f"Processing task from lawyer {message.from_user.id}")
     try:
@@ -86,25 +72,21 @@ async def lawyer_task_text(message: Message, state: FSMContext, notifier: Notifi
         app_id = data.get("task_app_id")
         task_text = message.text
         
-        with session_scope() as s:
+        async with async_session_scope() as s:
             # Находим заявку
-            app = s.query(Application).get(app_id)
+            app = await s.get(Application, app_id)
             if not app:
                 logger.error(f"App {app_id} not found")
                 await message.answer("Ошибка: заявка не найдена")
                 await state.clear()
                 return
                 
-            # Находим текущего пользователя (юриста)
-            lawyer = s.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
-            if not lawyer:
-                logger.error(f"Lawyer {message.from_user.id} not found")
-                await message.answer("Ошибка: пользователь не найден")
-                await state.clear()
-                return
+            # Текущий пользователь (юрист) — из RoleMiddleware
+            lawyer = user
                 
             # Обновляем статус заявки
             app.status = ApplicationStatus.lawyer_task
+            routing.reassign(app.lawyer_id, lawyer.id)
             app.lawyer_id = lawyer.id
             
             # Создаем задачу
@@ -120,7 +102,7 @@ async def lawyer_task_text(message: Message, state: FSMContext, notifier: Notifi
             # Отправляем уведомление агенту
             if app.agent_id:
                 # Get the agent to access their telegram_id
-                agent = s.query(User).filter(User.id == app.agent_id).first()
+                agent = await s.get(User, app.agent_id)
                 if agent and agent.telegram_id:
                     await notifier.notify_agent_task_assigned(
                         agent_id=agent.telegram_id,  # Use telegram_id instead of internal ID
@@ -136,20 +118,23 @@ async def lawyer_task_text(message: Message, state: FSMContext, notifier: Notifi
         await message.answer("Ошибка при создании задачи.")
 
 @router.callback_query(F.data.startswith("lawyer_close_"))
-async def lawyer_close(cb: CallbackQuery, notifier: Notifier):
+async def lawyer_close(cb: CallbackQuery, notifier: Notifier, routing: DepartmentRouting):
     """Close the deal"""
     app_id = int(cb.data.split("_")[-1])
     logger.info(f"Closing deal for app {app_id}")
     try:
-        with session_scope() as s:
-            app = s.query(Application).get(app_id)
+        async with async_session_scope() as s:
+            app = await s.get(Application, app_id)
             if app:
+                if app.status != ApplicationStatus.closed:
+                    # Закрытая заявка больше не нагружает проверяющих
+                    routing.release(app.rop_id, app.lawyer_id)
                 app.status = ApplicationStatus.closed
                 
                 # Отправляем уведомление агенту
                 if app.agent_id:
                     # Get the agent to access their telegram_id
-                    agent = s.query(User).filter(User.id == app.agent_id).first()
+                    agent = await s.get(User, app.agent_id)
                     if agent and agent.telegram_id:
                         await notifier.notify_application_closed(agent.telegram_id, app_id)
                         logger.info(f"Notified agent {agent.telegram_id}")
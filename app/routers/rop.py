@@ -5,9 +5,12 @@ from aiogram.filters import StateFilter
 from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.orm import joinedload
 from app.db.models import Application, ApplicationStatus, User
-from app.db.repository import session_scope
+from app.db.repository import async_session_scope
 from app.keyboards.common import menu_kb
 from app.services.notifier import Notifier
+from app.services.user_cache import UserCache, UserIdentity
+from app.services.department_routing import DepartmentRouting
+from app.utils.review_queue import QueueView, show_queue
 from app.config.logging_config import get_logger
 
 router = Router(name="rop")
@@ -16,69 +19,35 @@ logger = get_logger(__name__)
 class ROPStates(StatesGroup):
     waiting_for_return_comment = State()
 
-def _rop_actions_kb(app_id: int, yandex_public_url: str):
-    from aiogram.utils.keyboard import InlineKeyboardBuilder
-    kb = InlineKeyboardBuilder()
-    
-    # Add Yandex.Disk button with direct URL if available
-
-    if yandex_public_url:
-            kb.button(text="📁 Яндекс.Диск", url=yandex_public_url)
-    
-    # Add other action buttons
-    kb.button(text="✅ Одобрить → Юристу", callback_data=f"rop_approve_{app_id}")
-    kb.button(text="↩️ Вернуть с комментарием", callback_data=f"rop_return_{app_id}")
-    
-    kb.adjust(1)
-    return kb.as_markup()
+ROP_QUEUE = "rop_q"
+ROP_ACTIONS = [("✅ #{id} → Юристу", "rop_approve_"), ("↩️ #{id} Вернуть", "rop_return_")]
 
 @router.message(F.text == "/rop")
-async def list_for_rop(message: Message):
-    # MVP: показываем все CREATED
-    with session_scope() as s:
-        # Load all applications with their agent relationship
-        apps = s.query(Application).options(joinedload(Application.agent))\
-                                 .filter(Application.status == ApplicationStatus.created)\
-                                 .all()
-        
-        if not apps:
-            return await message.answer("Нет заявок на проверку.")
-        # Prepare all message data while the session is still open
-        messages = []
-        for app in apps:
-            # Берем данные сразу, пока сессия открыта
-            app_data = {
-                "id": app.id,
-                "deal_type": app.deal_type,
-                "address": app.address,
-                "agent_name": app.agent_name,
-                "kb": _rop_actions_kb(app.id, app.yandex_public_url)
-            }
-            messages.append(app_data)
-
-        for app_data in messages:
-            text = (f"Заявка #{app_data['id']}\n"
-                    f"Тип: {app_data['deal_type']}\n"
-                    f"Адрес: {app_data['address']}\n"
-                    f"Сотрудник: {app_data['agent_name']}")
-            await message.answer(text=text, reply_markup=app_data["kb"])
+async def list_for_rop(message: Message, user: UserIdentity):
+    # Очередь CREATED одной страницей в одном сообщении
+    await show_queue(message, user, ApplicationStatus.created, "Заявки на проверку РОПа", ROP_QUEUE, ROP_ACTIONS)
+
+@router.callback_query(F.data.startswith(f"{ROP_QUEUE}:"))
+async def rop_queue_page(cb: CallbackQuery, user: UserIdentity):
+    """Листание и фильтры очереди — правкой того же сообщения"""
+    await show_queue(cb, user, ApplicationStatus.created, "Заявки на проверку РОПа", ROP_QUEUE, ROP_ACTIONS,
+                     QueueView.unpack(cb.data))
 
 @router.callback_query(F.data.startswith("rop_approve_"))
-async def rop_approve(cb: CallbackQuery, notifier: Notifier):
+async def rop_approve(cb: CallbackQuery, notifier: Notifier, routing: DepartmentRouting, user: UserIdentity):
     app_id = int(cb.data.split("_")[-1])
     agent_id = None
     
-    with session_scope() as s:
+    async with async_session_scope() as s:
         # Use joinedload to ensure agent relationship is loaded
-        app = s.query(Application).options(joinedload(Application.agent)).get(app_id)
+        app = await s.get(Application, app_id, options=[joinedload(Application.agent)])
         if app:
             app.status = ApplicationStatus.to_lawyer
-            # Get the user who approved the application (current user)
-            rop_user = s.query(User).filter(User.telegram_id == str(cb.from_user.id)).first()
-            rop_name = rop_user.full_name if rop_user else "РОП"
-            app.rop_id = rop_user.id if rop_user else None
+            # The user who approved the application (resolved by RoleMiddleware)
+            routing.reassign(app.rop_id, user.id)
+            app.rop_id = user.id
             # Get agent_id safely
-            agent = s.query(User).filter(User.id == app.agent_id).first()
+            agent = app.agent
             if agent and agent.telegram_id:
                 agent_id = agent.telegram_id
     
@@ -91,24 +60,23 @@ async def rop_approve(cb: CallbackQuery, notifier: Notifier):
 
 @router.callback_query(F.data.startswith("rop_return_"))
 async def rop_return(cb: CallbackQuery, state: FSMContext):
-    print(f"[DEBUG] rop_return: Starting, data={cb.data}")
+    logger.debug(f"rop_return: data={cb.data}")
     app_id = int(cb.data.split("_")[-1])
     await state.update_data(return_app_id=app_id)
     await state.set_state(ROPStates.waiting_for_return_comment)
-    print(f"[DEBUG] rop_return: State set to 'waiting_for_return_comment', app_id={app_id}")
+    logger.debug(f"rop_return: waiting for return comment, app_id={app_id}")
     await cb.message.answer("Введите комментарий для возврата:")
     await cb.answer()
 
 @router.message(ROPStates.waiting_for_return_comment)
-async def rop_return_comment(message: Message, state: FSMContext, notifier: Notifier):
-    print("[DEBUG] rop_return_comment: Handler triggered")
+async def rop_return_comment(message: Message, state: FSMContext, notifier: Notifier, routing: DepartmentRouting, user: UserIdentity):
     data = await state.get_data()
     app_id = data.get("return_app_id")
     comment = message.text
-    print(f"[DEBUG] rop_return_comment: Processing app_id={app_id}, comment={comment}")
+    logger.debug(f"rop_return_comment: app_id={app_id}, comment={comment}")
     
     if not app_id:
-        print("[ERROR] rop_return_comment: No app_id in state data")
+        logger.error("rop_return_comment: no return_app_id in state data")
         await message.answer("Ошибка: не удалось определить заявку. Пожалуйста, попробуйте снова.")
         await state.clear()
         return
@@ -116,37 +84,33 @@ async def rop_return_comment(message: Message, state: FSMContext, notifier: Noti
     agent_id = None
     
     try:
-        with session_scope() as s:
-            app = s.query(Application).options(joinedload(Application.agent)).get(app_id)
+        async with async_session_scope() as s:
+            app = await s.get(Application, app_id, options=[joinedload(Application.agent)])
             if app:
-                print(f"[DEBUG] rop_return_comment: Found application {app_id}, current status: {app.status}")
                 app.status = ApplicationStatus.returned_rop
-                rop_user = s.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
-                rop_name = rop_user.full_name if rop_user else "РОП"
-                app.rop_id = rop_user.id if rop_user else None
-                agent = s.query(User).filter(User.telegram_id == app.agent.telegram_id).first()
+                routing.reassign(app.rop_id, user.id)
+                app.rop_id = user.id
+                agent = app.agent
                 if agent and agent.telegram_id:
                     agent_id = agent.telegram_id
-                print(f"[DEBUG] rop_return_comment: Updated application status to {app.status}, agent_id={agent_id}")
+                logger.debug(f"rop_return_comment: application {app_id} returned to agent {agent_id}")
             else:
-                print(f"[ERROR] rop_return_comment: Application {app_id} not found")
+                logger.error(f"rop_return_comment: application {app_id} not found")
                 await message.answer("Ошибка: заявка не найдена.")
                 await state.clear()
                 return
         
         if agent_id:
-            print(f"[DEBUG] rop_return_comment: Sending notification to agent {agent_id}")
             await notifier.notify_agent_application_returned(agent_id, app_id, comment)
         
         await message.answer(f"✅ Заявка успешно возвращена агенту с комментарием: {comment}")
-        print(f"[DEBUG] rop_return_comment: Successfully processed return for app {app_id}")
+        logger.info(f"Application {app_id} returned by ROP {user.id}")
         
     except Exception as e:
-        print(f"[ERROR] rop_return_comment: Unexpected error: {str(e)}")
+        logger.error(f"Error in rop_return_comment: {e}", exc_info=True)
         await message.answer("Произошла непредвиденная ошибка при обработке запроса.")
     finally:
         await state.clear()
-        print("[DEBUG] rop_return_comment: State cleared")
 
 
 async def notify_rop_about_registration(bot, rop_id: int, user: User):
@@ -177,15 +141,18 @@ async def notify_rop_about_registration(bot, rop_id: int, user: User):
 # --- обработчики кнопок ---
 
 @router.callback_query(F.data.startswith("approve_user_"))
-async def approve_user(cb: CallbackQuery):
+async def approve_user(cb: CallbackQuery, user_cache: UserCache, routing: DepartmentRouting):
     user_id = int(cb.data.split("_")[-1])
-    with session_scope() as s:
-        user = s.get(User, user_id)
+    async with async_session_scope() as s:
+        user = await s.get(User, user_id)
         if not user:
             return await cb.answer("Пользователь не найден", show_alert=True)
         user.is_active = True
         user.is_approved = True
-        s.flush()
+        await s.commit()
+        # Middleware увидит новый статус без ожидания TTL
+        user_cache.invalidate(user.telegram_id)
+        routing.update_user(UserIdentity.from_user(user))
         await cb.message.edit_text(
             f"✅ Регистрация сотрудника {user.full_name} подтверждена"
         )
@@ -200,15 +167,18 @@ async def approve_user(cb: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("reject_user_"))
-async def reject_user(cb: CallbackQuery):
+async def reject_user(cb: CallbackQuery, user_cache: UserCache, routing: DepartmentRouting):
     user_id = int(cb.data.split("_")[-1])
-    with session_scope() as s:
-        user = s.get(User, user_id)
+    async with async_session_scope() as s:
+        user = await s.get(User, user_id)
         if not user:
             return await cb.answer("Пользователь не найден", show_alert=True)
         user.is_active = False
         user.is_approved = False
-        s.flush()
+        await s.commit()
+        # Middleware увидит новый статус без ожидания TTL
+        user_cache.invalidate(user.telegram_id)
+        routing.update_user(UserIdentity.from_user(user))
         await cb.message.edit_text(
             f"❌ Регистрация сотрудника {user.full_name} отклонена"
         )
@@ -0,0 +1,153 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, List, Optional
+
+from sqlalchemy import select, func, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Application, ApplicationStatus, Task, User
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Направления листания: к более старым или более новым заявкам
+OLDER = "older"
+NEWER = "newer"
+
+
+@dataclass(frozen=True)
+class ApplicationItem:
+    id: int
+    deal_type: Optional[str]
+    address: Optional[str]
+    status: ApplicationStatus
+    rop_id: Optional[int]
+    created_at: datetime
+    task_text: Optional[str]
+
+
+@dataclass(frozen=True)
+class QueueItem:
+    id: int
+    deal_type: Optional[str]
+    address: Optional[str]
+    agent_name: Optional[str]
+    created_at: datetime
+    yandex_public_url: Optional[str]
+
+
+@dataclass(frozen=True)
+class Page:
+    items: List[Any]
+    has_older: bool
+    has_newer: bool
+
+
+def _after_cursor(query, cursor: int, newer: bool):
+    """Ограничивает запрос заявками строго новее/старше заявки cursor по (created_at, id)"""
+    anchor = select(Application.created_at).where(Application.id == cursor).scalar_subquery()
+    if newer:
+        return query.where(or_(
+            Application.created_at > anchor,
+            and_(Application.created_at == anchor, Application.id > cursor),
+        ))
+    return query.where(or_(
+        Application.created_at < anchor,
+        and_(Application.created_at == anchor, Application.id < cursor),
+    ))
+
+
+async def agent_applications_page(
+    session: AsyncSession,
+    agent_id: int,
+    cursor: Optional[int] = None,
+    direction: str = OLDER,
+    limit: int = 10,
+) -> Page:
+    """Страница заявок агента (новые сначала) с последней открытой задачей — один запрос.
+
+    Пагинация по ключу (created_at, id): cursor — id крайней заявки текущей
+    страницы, direction — в какую сторону от неё листать.
+    """
+    newest_first = (Application.created_at.desc(), Application.id.desc())
+    oldest_first = (Application.created_at.asc(), Application.id.asc())
+    page = select(
+        Application.id, Application.deal_type, Application.address, Application.status,
+        Application.rop_id, Application.created_at,
+    ).where(Application.agent_id == agent_id)
+    if cursor is not None:
+        page = _after_cursor(page, cursor, newer=direction == NEWER)
+    # Лишняя строка показывает, есть ли что-то дальше в направлении листания
+    page = page.order_by(*(newest_first if direction == OLDER else oldest_first)).limit(limit + 1).cte("page")
+
+    # Последняя открытая задача — только для заявок этой страницы
+    latest_task = select(
+        Task.application_id,
+        Task.text,
+        func.row_number().over(
+            partition_by=Task.application_id,
+            order_by=(Task.created_at.desc(), Task.id.desc()),
+        ).label("rn"),
+    ).where(Task.status == "open", Task.application_id.in_(select(page.c.id))).subquery()
+
+    query = (
+        select(page, latest_task.c.text)
+        .outerjoin(latest_task, and_(latest_task.c.application_id == page.c.id, latest_task.c.rn == 1))
+        .order_by(page.c.created_at.desc(), page.c.id.desc())
+    )
+    rows = (await session.execute(query)).all()
+    items = [
+        ApplicationItem(r.id, r.deal_type, r.address, r.status, r.rop_id, r.created_at, r.text)
+        for r in rows
+    ]
+
+    more = len(items) > limit
+    if direction == OLDER:
+        items = items[:limit]
+        return Page(items, has_older=more, has_newer=cursor is not None)
+    items = items[-limit:] if more else items
+    return Page(items, has_older=True, has_newer=more)
+
+
+async def review_queue_page(
+    session: AsyncSession,
+    status: ApplicationStatus,
+    department_no: Optional[str] = None,
+    deal_type: Optional[str] = None,
+    cursor: Optional[int] = None,
+    direction: str = NEWER,
+    limit: int = 10,
+) -> Page:
+    """Страница очереди проверки (старые сначала) — один запрос по индексу (status, created_at).
+
+    department_no фильтрует по отделу агента, deal_type — по типу сделки.
+    """
+    query = (
+        select(
+            Application.id, Application.deal_type, Application.address,
+            func.coalesce(User.full_name, Application.agent_name).label("agent_name"),
+            Application.created_at, Application.yandex_public_url,
+        )
+        .outerjoin(User, User.id == Application.agent_id)
+        .where(Application.status == status)
+    )
+    if department_no:
+        query = query.where(User.department_no == department_no)
+    if deal_type:
+        query = query.where(Application.deal_type == deal_type)
+    if cursor is not None:
+        query = _after_cursor(query, cursor, newer=direction == NEWER)
+    if direction == NEWER:
+        query = query.order_by(Application.created_at.asc(), Application.id.asc())
+    else:
+        query = query.order_by(Application.created_at.desc(), Application.id.desc())
+    rows = (await session.execute(query.limit(limit + 1))).all()
+    items = [QueueItem(r.id, r.deal_type, r.address, r.agent_name, r.created_at, r.yandex_public_url) for r in rows]
+
+    more = len(items) > limit
+    items = items[:limit]
+    if direction == NEWER:
+        return Page(items, has_older=cursor is not None, has_newer=more)
+    # Листали назад — возвращаем страницу в порядке очереди
+    return Page(list(reversed(items)), has_older=more, has_newer=True)
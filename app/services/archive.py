@@ -0,0 +1,207 @@
+"""Перенос закрытых заявок в архивные таблицы.
+
+Заявка, закрытая больше after_days дней назад, переезжает вместе с ответами,
+документами и задачами в таблицы archive_* (app/db/models.py) — пачками по
+batch_size заявок, каждая пачка в своей транзакции. Рабочие таблицы, по
+которым ходят очереди и списки, остаются небольшими. /find и /export читают
+и архив.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, insert, delete, func, literal, or_, DateTime
+from sqlalchemy.orm import Session
+
+from app.db.models import (
+    Application, ApplicationStatus, ApplicationAnswers, QuestionnaireAnswer, Document, Task, UploadJob, ProtocolBuild,
+    ArchivedApplication, ArchivedApplicationAnswers, ArchivedQuestionnaireAnswer, ArchivedDocument, ArchivedTask,
+)
+from app.db.repository import session_scope
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Дочерние таблицы заявки и их архивные пары
+CHILD_TABLES = [
+    (QuestionnaireAnswer, ArchivedQuestionnaireAnswer),
+    (ApplicationAnswers, ArchivedApplicationAnswers),
+    (Document, ArchivedDocument),
+    (Task, ArchivedTask),
+]
+
+
+@dataclass
+class ArchiveResult:
+    applications: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    rows: Dict[str, int] = field(default_factory=dict)
+
+
+def _owner_of_last_row(model):
+    """Заявка, которой принадлежит строка с наибольшим id.
+
+    SQLite без AUTOINCREMENT отдаёт новой строке max(id) + 1, так что после
+    удаления последней строки её id достался бы следующей — и при её архивации
+    совпал бы с уже лежащим в архиве. Такие заявки ждут следующего запуска.
+    """
+    return select(model.application_id).where(model.id == select(func.max(model.id)).scalar_subquery())
+
+
+def archive_candidates(session: Session, cutoff: datetime, limit: int) -> List[int]:
+    """id закрытых до cutoff заявок без незавершённых операций с Я.Диском"""
+    unfinished_jobs = select(UploadJob.application_id).where(
+        UploadJob.application_id.is_not(None), UploadJob.status != "done"
+    )
+    query = (
+        select(Application.id)
+        .where(
+            Application.status == ApplicationStatus.closed,
+            Application.updated_at < cutoff,
+            Application.id != select(func.max(Application.id)).scalar_subquery(),
+            Application.id.not_in(unfinished_jobs),
+            Application.id.not_in(_owner_of_last_row(QuestionnaireAnswer)),
+            Application.id.not_in(_owner_of_last_row(Document)),
+            Application.id.not_in(_owner_of_last_row(Task)),
+        )
+        .order_by(Application.id)
+        .limit(limit)
+    )
+    return list(session.execute(query).scalars())
+
+
+def _copy(session: Session, source, target, condition, **extra) -> None:
+    names = [c.name for c in source.__table__.columns]
+    columns = [source.__table__.c[n] for n in names] + [literal(v, DateTime).label(k) for k, v in extra.items()]
+    session.execute(insert(target).from_select(names + list(extra), select(*columns).where(condition)))
+
+
+def _delete(session: Session, model, condition) -> int:
+    result = session.execute(delete(model).where(condition).execution_options(synchronize_session=False))
+    return result.rowcount
+
+
+def archive_batch(session: Session, ids: List[int]) -> Dict[str, int]:
+    """Переносит заявки ids с дочерними строками в архив; возвращает число строк по таблицам"""
+    now = datetime.utcnow()
+    _copy(session, Application, ArchivedApplication, Application.id.in_(ids), archived_at=now)
+    for source, target in CHILD_TABLES:
+        _copy(session, source, target, source.application_id.in_(ids))
+
+    # Выполненные операции с Я.Диском и отпечатки протоколов в архиве не нужны
+    documents = select(Document.id).where(Document.application_id.in_(ids))
+    _delete(session, UploadJob, or_(UploadJob.application_id.in_(ids), UploadJob.document_id.in_(documents)))
+    _delete(session, ProtocolBuild, ProtocolBuild.application_id.in_(ids))
+    moved = {}
+    for source, _ in CHILD_TABLES:
+        moved[source.__tablename__] = _delete(session, source, source.application_id.in_(ids))
+    moved[Application.__tablename__] = _delete(session, Application, Application.id.in_(ids))
+    return moved
+
+
+def archive_closed(
+    after_days: int = 180,
+    batch_size: int = 500,
+    pause: float = 0.05,
+    max_batches: Optional[int] = None,
+    should_stop=lambda: False,
+) -> ArchiveResult:
+    """Переносит в архив все заявки, закрытые больше after_days дней назад.
+
+    Между пачками — пауза pause, чтобы обработчики бота успевали писать.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=after_days)
+    result = ArchiveResult()
+    started = time.perf_counter()
+    while max_batches is None or result.batches < max_batches:
+        if should_stop():
+            break
+        with session_scope() as s:
+            ids = archive_candidates(s, cutoff, batch_size)
+            if not ids:
+                break
+            moved = archive_batch(s, ids)
+        result.batches += 1
+        result.applications += len(ids)
+        for name, count in moved.items():
+            result.rows[name] = result.rows.get(name, 0) + count
+        logger.debug(f"Archived batch {result.batches}: applications {ids[0]}..{ids[-1]}")
+        time.sleep(pause)
+    result.seconds = round(time.perf_counter() - started, 3)
+    if result.applications:
+        logger.info(
+            f"Archived {result.applications} applications closed before {cutoff:%Y-%m-%d} "
+            f"in {result.batches} batches, {result.seconds}s: {result.rows}"
+        )
+    return result
+
+
+def archive_stats(session: Session, after_days: int = 180) -> Dict[str, int]:
+    """Сколько заявок в рабочей таблице, в архиве и ждут переноса"""
+    cutoff = datetime.utcnow() - timedelta(days=after_days)
+    return {
+        "hot": session.execute(select(func.count(Application.id))).scalar(),
+        "archived": session.execute(select(func.count(ArchivedApplication.id))).scalar(),
+        "due": session.execute(
+            select(func.count(Application.id))
+            .where(Application.status == ApplicationStatus.closed, Application.updated_at < cutoff)
+        ).scalar(),
+    }
+
+
+class ArchiveService:
+    """Ежедневный перенос закрытых заявок в архив"""
+
+    def __init__(self, after_days: int = 180, batch_size: int = 500, at: str = "04:00", pause: float = 0.05):
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.at = datetime.strptime(at, "%H:%M").time()
+        self.pause = pause
+        self.last: Optional[ArchiveResult] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        self._stop.clear()
+        self._task = asyncio.create_task(self._scheduler(), name="archive")
+        logger.info(f"Archive scheduler started: daily at {self.at:%H:%M}, applications closed {self.after_days}+ days ago")
+
+    async def stop(self) -> None:
+        """Останавливает планировщик; идущий перенос завершается после текущей пачки"""
+        self._stop.set()
+        if self._task:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            logger.info("Archive scheduler stopped")
+
+    def seconds_until_next(self, now: Optional[datetime] = None) -> float:
+        now = now or datetime.now()
+        target = datetime.combine(now.date(), self.at)
+        if target <= now:
+            target += timedelta(days=1)
+        return (target - now).total_seconds()
+
+    async def _scheduler(self) -> None:
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.seconds_until_next())
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.run()
+            except Exception as e:
+                logger.error(f"Scheduled archiving failed: {e}")
+
+    async def run(self) -> ArchiveResult:
+        """Переносит заявки сейчас (в потоке, не блокируя event loop)"""
+        async with self._lock:
+            self.last = await asyncio.to_thread(
+                archive_closed, self.after_days, self.batch_size, self.pause, should_stop=self._stop.is_set,
+            )
+            return self.last
@@ -0,0 +1,277 @@
+"""Резервные копии SQLite без остановки бота.
+
+Копия снимается онлайн-API SQLite (sqlite3.Connection.backup) небольшими
+порциями страниц с паузой между ними, в отдельном потоке: между порциями
+блокировка базы отпускается и обработчики продолжают писать. Готовая копия
+проверяется (integrity_check), сжимается gzip и проверяется ещё раз
+восстановлением из архива. Хранятся последние keep копий.
+"""
+import asyncio
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.engine import make_url
+
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+BACKUP_PREFIX = "database-"
+BACKUP_SUFFIX = ".db.gz"
+# Таблицы, число строк в которых сверяется после восстановления
+VERIFY_TABLES = ["applications", "users", "documents", "tasks", "application_answers", "archive_applications"]
+
+
+class BackupError(Exception):
+    pass
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Restarted(Exception):
+    pass
+
+
+def sqlite_path(database_url: str) -> Optional[str]:
+    """Путь к файлу SQLite из DATABASE_URL; None для других СУБД и :memory:"""
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    return url.database
+
+
+def table_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return {t: conn.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in VERIFY_TABLES if t in existing}
+
+
+def verify_backup(path: str, expected: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Восстанавливает архив во временный файл и проверяет целостность и число строк"""
+    started = time.perf_counter()
+    fd, restored = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        with gzip.open(path, "rb") as src, open(restored, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        conn = sqlite3.connect(restored)
+        try:
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            counts = table_counts(conn)
+        finally:
+            conn.close()
+    finally:
+        os.remove(restored)
+    ok = integrity == "ok" and (expected is None or counts == expected)
+    return {
+        "ok": ok,
+        "integrity": integrity,
+        "counts": counts,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+class BackupService:
+    """Ежедневная онлайн-копия SQLite с ротацией и проверкой восстановления"""
+
+    def __init__(
+        self,
+        database_path: str,
+        directory: str = "./backups",
+        at: str = "03:00",
+        keep: int = 7,
+        pages_per_step: int = 256,
+        step_sleep: float = 0.005,
+        max_restarts: int = 10,
+    ):
+        self.database_path = database_path
+        self.directory = directory
+        self.at = datetime.strptime(at, "%H:%M").time()
+        self.keep = keep
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self.max_restarts = max_restarts
+        self.last: Optional[Dict[str, Any]] = None
+        self.backups = 0
+        self.failures = 0
+        self._task: Optional[asyncio.Task] = None
+        self._stop = asyncio.Event()
+        self._cancelled = False
+        self._lock = asyncio.Lock()
+
+    # --- жизненный цикл ---
+
+    async def start(self) -> None:
+        self._stop.clear()
+        self._cancelled = False
+        self._task = asyncio.create_task(self._scheduler(), name="sqlite-backup")
+        logger.info(f"Backup scheduler started: daily at {self.at:%H:%M}, keeping {self.keep} copies in {self.directory}")
+
+    async def stop(self) -> None:
+        """Останавливает планировщик; идущая копия прерывается на ближайшей порции"""
+        self._stop.set()
+        self._cancelled = True
+        if self._task:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            logger.info("Backup scheduler stopped")
+
+    def seconds_until_next(self, now: Optional[datetime] = None) -> float:
+        now = now or datetime.now()
+        target = datetime.combine(now.date(), self.at)
+        if target <= now:
+            target += timedelta(days=1)
+        return (target - now).total_seconds()
+
+    async def _scheduler(self) -> None:
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.seconds_until_next())
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.run()
+            except Exception as e:
+                logger.error(f"Scheduled backup failed: {e}")
+
+    # --- копия ---
+
+    async def run(self) -> Dict[str, Any]:
+        """Снимает копию сейчас (в потоке, не блокируя event loop)"""
+        async with self._lock:
+            try:
+                result = await asyncio.to_thread(self.backup_now)
+            except Exception:
+                self.failures += 1
+                raise
+            self.backups += 1
+            self.last = result
+            return result
+
+    def backup_now(self) -> Dict[str, Any]:
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        target = os.path.join(self.directory, f"{BACKUP_PREFIX}{stamp}{BACKUP_SUFFIX}")
+        snapshot = os.path.join(self.directory, f".{BACKUP_PREFIX}{stamp}.db.tmp")
+        started = time.perf_counter()
+        try:
+            copy = self._copy(snapshot)
+            conn = sqlite3.connect(snapshot)
+            try:
+                integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+                counts = table_counts(conn)
+            finally:
+                conn.close()
+            if integrity != "ok":
+                raise BackupError(f"Backup snapshot failed integrity check: {integrity}")
+
+            compress_started = time.perf_counter()
+            with open(snapshot, "rb") as src, gzip.open(target + ".part", "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(target + ".part", target)
+            compress_seconds = time.perf_counter() - compress_started
+        finally:
+            for leftover in (snapshot, target + ".part"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        verify = verify_backup(target, counts)
+        if not verify["ok"]:
+            raise BackupError(f"Backup {target} failed verify-restore: {verify}")
+        removed = self.prune()
+        result = {
+            "path": target,
+            "size": os.path.getsize(target),
+            "seconds": round(time.perf_counter() - started, 3),
+            "compress_seconds": round(compress_seconds, 3),
+            "counts": counts,
+            "verify_seconds": verify["seconds"],
+            "pruned": removed,
+            **copy,
+        }
+        logger.info(
+            f"Backup {target} done in {result['seconds']}s: {copy['pages']} pages in {copy['steps']} steps, "
+            f"max stall {copy['max_stall_ms']} ms, {copy['restarts']} restarts"
+        )
+        return result
+
+    def _copy(self, snapshot: str) -> Dict[str, Any]:
+        """Онлайн-копия порциями; время каждой порции — верхняя оценка задержки писателей.
+
+        Если базу в это время пишут другие соединения, SQLite начинает копию
+        заново. Тогда порция увеличивается вчетверо, вплоть до копии за один
+        шаг: в WAL читатель писателей не блокирует, так что копия всегда
+        завершается за ограниченное время.
+        """
+        src = sqlite3.connect(self.database_path, timeout=30)
+        dst = sqlite3.connect(snapshot)
+        stats = {"steps": 0, "pages": 0, "restarts": 0, "max_stall_ms": 0.0, "stall_ms": 0.0}
+        last: Dict[str, Any] = {}
+
+        def progress(status: int, remaining: int, total: int) -> None:
+            now = time.perf_counter()
+            # Между вызовами — одна порция и пауза step_sleep, в которую база свободна
+            stall = max(0.0, (now - last["at"] - (self.step_sleep if last["remaining"] is not None else 0)) * 1000)
+            stats["steps"] += 1
+            stats["pages"] = total
+            stats["stall_ms"] += stall
+            stats["max_stall_ms"] = max(stats["max_stall_ms"], stall)
+            if self._cancelled:
+                raise _Cancelled()
+            # Источник изменили другим соединением — SQLite начал копию заново
+            if last["remaining"] is not None and remaining > last["remaining"]:
+                raise _Restarted()
+            last["at"], last["remaining"] = now, remaining
+
+        pages = self.pages_per_step
+        try:
+            while True:
+                last.update(at=time.perf_counter(), remaining=None)
+                try:
+                    src.backup(dst, pages=pages, progress=progress, sleep=self.step_sleep)
+                    break
+                except _Restarted:
+                    stats["restarts"] += 1
+                    if stats["restarts"] > self.max_restarts:
+                        raise BackupError(f"Backup restarted more than {self.max_restarts} times")
+                    pages = -1 if pages * 4 >= stats["pages"] else pages * 4
+                    logger.debug(f"Backup restarted by concurrent writes, next step {pages} pages")
+        except _Cancelled:
+            raise BackupError("Backup cancelled")
+        finally:
+            dst.close()
+            src.close()
+        stats["pages_per_step"] = pages
+        stats["stall_ms"] = round(stats["stall_ms"], 1)
+        stats["max_stall_ms"] = round(stats["max_stall_ms"], 1)
+        return stats
+
+    def list_backups(self) -> List[str]:
+        """Готовые копии, новые сначала (имена содержат дату и сортируются как строки)"""
+        pattern = os.path.join(self.directory, f"{BACKUP_PREFIX}*{BACKUP_SUFFIX}")
+        return sorted(glob.glob(pattern), reverse=True)
+
+    def prune(self) -> List[str]:
+        removed = self.list_backups()[self.keep:]
+        for path in removed:
+            os.remove(path)
+            logger.info(f"Removed old backup {path}")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backups": self.backups,
+            "failures": self.failures,
+            "stored": len(self.list_backups()),
+            "last": self.last,
+        }
@@ -0,0 +1,311 @@
+"""Локальные копии документов (data/blobs) как кэш с бюджетом в байтах.
+
+Файл, все документы которого уже лежат на Я.Диске (Document.yandex_path),
+можно удалить с диска: когда он снова понадобится, path() скачает его обратно
+и сверит sha256. Вытесняются давно не использованные файлы; время последнего
+обращения хранится в mtime, поэтому порядок LRU переживает перезапуск.
+"""
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import select, func, union_all
+
+from app.db.models import Document, ArchivedDocument
+from app.db.repository import async_session_scope
+from app.services import yandex_disk as ya
+from app.services.storage import BLOB_ROOT, blob_path
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Вытеснение освобождает место с запасом, до этой доли бюджета
+EVICT_TO = 0.9
+# Сколько файлов проверять в БД одним запросом
+EVICT_BATCH = 500
+# Если выгруженных файлов не хватило, следующая попытка — не раньше чем через (сек)
+EVICT_RETRY = 60.0
+
+
+class BlobNotAvailable(Exception):
+    """Файла нет локально и нет подтверждённой копии на Я.Диске"""
+
+
+class BlobCache:
+    """LRU-кэш файлов data/blobs с бюджетом budget_bytes.
+
+    Вытесняются только файлы, у которых каждый ссылающийся документ (в том
+    числе архивный) уже выгружен на Я.Диск. Одновременные промахи по одному
+    файлу скачивают его один раз.
+    """
+
+    def __init__(self, budget_bytes: int, root: Path = BLOB_ROOT, chunk_size: int = 256 * 1024):
+        self.budget_bytes = budget_bytes
+        self.root = root
+        self.chunk_size = chunk_size
+        # sha256 -> размер, от давно не использованных к свежим
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._fetching: Dict[str, asyncio.Future] = {}
+        self._evicting: Optional[asyncio.Task] = None
+        # Файлы, к которым обращались, пока вытеснение ждало ответа БД
+        self._recent: Set[str] = set()
+        # Когда можно снова пытаться вытеснять, если прошлый раз не хватило выгруженных файлов
+        self._retry_at = 0.0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.fetched_bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    # --- жизненный цикл ---
+
+    async def start(self) -> None:
+        await self.load()
+        self._schedule_eviction()
+
+    async def load(self) -> None:
+        """Собирает кэш по файлам на диске"""
+        entries = await asyncio.to_thread(self._scan)
+        self._entries = OrderedDict(entries)
+        self.bytes = sum(self._entries.values())
+        logger.info(
+            f"Blob cache: {len(self._entries)} files, {self.bytes / (1024 * 1024):.1f} MB "
+            f"of {self.budget_bytes / (1024 * 1024):.0f} MB budget"
+        )
+
+    async def stop(self) -> None:
+        if self._evicting is not None:
+            await asyncio.gather(self._evicting, return_exceptions=True)
+            self._evicting = None
+
+    def _scan(self) -> List[tuple]:
+        """(sha256, размер) всех файлов кэша в порядке mtime"""
+        found = []
+        if self.root.exists():
+            for shard in os.scandir(self.root):
+                if not shard.is_dir() or len(shard.name) != 2:
+                    continue  # tmp/ и прочее
+                for entry in os.scandir(shard.path):
+                    if entry.is_file():
+                        st = entry.stat()
+                        found.append((st.st_mtime, entry.name, st.st_size))
+        found.sort()
+        return [(sha256, size) for _, sha256, size in found]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # --- обращения ---
+
+    def add(self, sha256: str, size: int) -> None:
+        """Учитывает только что сохранённый файл; при превышении бюджета запускает вытеснение"""
+        self.bytes += size - self._entries.get(sha256, 0)
+        self._entries[sha256] = size
+        self._entries.move_to_end(sha256)
+        self._recent.add(sha256)
+        self._schedule_eviction()
+
+    def touch(self, sha256: str) -> None:
+        if sha256 in self._entries:
+            self._entries.move_to_end(sha256)
+        self._recent.add(sha256)
+        try:
+            os.utime(blob_path(sha256))
+        except FileNotFoundError:
+            pass
+
+    async def path(self, sha256: str, remote_path: Optional[str] = None) -> Path:
+        """Локальный путь к файлу; вытесненный файл скачивается с Я.Диска.
+
+        remote_path — где взять файл на Диске; если не задан, ищется по
+        документам с тем же sha256.
+        """
+        local = blob_path(sha256)
+        if sha256 in self._entries and local.exists():
+            self.hits += 1
+            self.touch(sha256)
+            return local
+        if local.exists():
+            # Файл положили в обход кэша (например, до его включения)
+            self.hits += 1
+            self.add(sha256, local.stat().st_size)
+            return local
+
+        pending = self._fetching.get(sha256)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._fetching[sha256] = future
+        try:
+            local = await self._fetch(sha256, remote_path)
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; отмечаем его полученным
+            future.exception()
+            raise
+        else:
+            future.set_result(local)
+            return local
+        finally:
+            if not future.done():
+                future.cancel()  # загрузку отменили — ожидающие не должны зависнуть
+            del self._fetching[sha256]
+
+    async def _fetch(self, sha256: str, remote_path: Optional[str]) -> Path:
+        if remote_path is None:
+            remote_path = await remote_copy(sha256)
+        if remote_path is None:
+            raise BlobNotAvailable(f"Blob {sha256} is not cached and has no Yandex.Disk copy")
+        started = time.perf_counter()
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        tmp = tmp_dir / f"{uuid.uuid4().hex}.part"
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp, "wb") as f:
+                async for chunk in ya.get_client().download_stream(remote_path, self.chunk_size):
+                    hasher.update(chunk)
+                    await asyncio.to_thread(f.write, chunk)
+                    size += len(chunk)
+            if hasher.hexdigest() != sha256:
+                raise BlobNotAvailable(f"Yandex.Disk copy {remote_path} does not match {sha256}")
+            dest = blob_path(sha256)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, dest)
+        finally:
+            tmp.unlink(missing_ok=True)
+        self.fetched_bytes += size
+        logger.info(f"Re-fetched blob {sha256} from {remote_path} ({size} bytes, {time.perf_counter() - started:.2f}s)")
+        self.add(sha256, size)
+        return dest
+
+    # --- вытеснение ---
+
+    def _schedule_eviction(self) -> None:
+        if self.bytes <= self.budget_bytes or time.monotonic() < self._retry_at:
+            return
+        if self._evicting is None or self._evicting.done():
+            self._evicting = asyncio.create_task(self.evict(), name="blob-cache-evict")
+
+    async def evict(self) -> Dict[str, int]:
+        """Удаляет давно не использованные выгруженные файлы, пока кэш не уложится в бюджет"""
+        target = int(self.budget_bytes * EVICT_TO)
+        removed = freed = skipped = 0
+        candidates = list(self._entries)
+        for start in range(0, len(candidates), EVICT_BATCH):
+            if self.bytes <= target:
+                break
+            batch = candidates[start:start + EVICT_BATCH]
+            self._recent.clear()
+            evictable = await confirmed_blobs(batch)
+            for sha256 in batch:
+                if self.bytes <= target:
+                    break
+                if sha256 in self._recent:
+                    continue  # только что понадобился — уже не «давно не использованный»
+                if sha256 not in evictable:
+                    skipped += 1
+                    continue
+                size = self._entries.pop(sha256, None)
+                if size is None:
+                    continue  # убрали, пока шёл запрос
+                blob_path(sha256).unlink(missing_ok=True)
+                self.bytes -= size
+                removed += 1
+                freed += size
+        self.evictions += removed
+        self.evicted_bytes += freed
+        if removed or skipped:
+            logger.info(
+                f"Blob cache evicted {removed} files ({freed / (1024 * 1024):.1f} MB), "
+                f"{skipped} not yet on Yandex.Disk; now {self.bytes / (1024 * 1024):.1f} MB"
+            )
+        if self.bytes > self.budget_bytes:
+            self._retry_at = time.monotonic() + EVICT_RETRY
+            logger.warning(
+                f"Blob cache is over budget ({self.bytes} > {self.budget_bytes} bytes): "
+                f"remaining files are not uploaded to Yandex.Disk yet"
+            )
+        return {"removed": removed, "freed": freed, "skipped": skipped}
+
+    async def evictable(self) -> Dict[str, int]:
+        """Сколько файлов уже на Я.Диске и могут быть вытеснены"""
+        hashes = list(self._entries)
+        files = size = 0
+        for start in range(0, len(hashes), EVICT_BATCH):
+            for sha256 in await confirmed_blobs(hashes[start:start + EVICT_BATCH]):
+                files += 1
+                size += self._entries.get(sha256, 0)
+        return {"files": files, "bytes": size}
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "files": len(self._entries),
+            "bytes": self.bytes,
+            "budget_bytes": self.budget_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "fetched_bytes": self.fetched_bytes,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+        }
+
+
+def _document_refs():
+    """(sha256, yandex_path) документов в работе и в архиве"""
+    return union_all(
+        select(Document.sha256, Document.yandex_path),
+        select(ArchivedDocument.sha256, ArchivedDocument.yandex_path),
+    ).subquery()
+
+
+async def confirmed_blobs(hashes: List[str]) -> Set[str]:
+    """Из hashes — те, у которых все ссылающиеся документы уже на Я.Диске"""
+    refs = _document_refs()
+    query = (
+        select(refs.c.sha256)
+        .where(refs.c.sha256.in_(hashes))
+        .group_by(refs.c.sha256)
+        .having(func.count() == func.count(refs.c.yandex_path))
+    )
+    async with async_session_scope() as s:
+        return set((await s.execute(query)).scalars())
+
+
+async def remote_copy(sha256: str) -> Optional[str]:
+    """Путь на Я.Диске любого выгруженного документа с этим содержимым"""
+    refs = _document_refs()
+    query = select(refs.c.yandex_path).where(refs.c.sha256 == sha256, refs.c.yandex_path.is_not(None)).limit(1)
+    async with async_session_scope() as s:
+        return (await s.execute(query)).scalar()
+
+
+async def application_files(cache: BlobCache, app_id: int) -> List[tuple]:
+    """(имя файла, локальный путь) всех документов заявки; вытесненные скачиваются заново"""
+    async with async_session_scope() as s:
+        rows = (await s.execute(union_all(
+            select(Document.id, Document.file_name, Document.sha256, Document.yandex_path, Document.local_path)
+            .where(Document.application_id == app_id),
+            select(
+                ArchivedDocument.id, ArchivedDocument.file_name, ArchivedDocument.sha256,
+                ArchivedDocument.yandex_path, ArchivedDocument.local_path,
+            ).where(ArchivedDocument.application_id == app_id),
+        ))).all()
+    files = []
+    for _, file_name, sha256, yandex_path, local_path in sorted(rows):
+        if sha256:
+            files.append((file_name, await cache.path(sha256, yandex_path)))
+        else:
+            files.append((file_name, Path(local_path)))
+    return files
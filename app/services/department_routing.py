@@ -0,0 +1,113 @@
+from typing import Dict, Optional, List, Tuple
+
+from sqlalchemy import select, func
+
+from app.db.models import User, UserRole, Application, ApplicationStatus
+from app.db.repository import async_session_scope
+from app.services.user_cache import UserIdentity
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+REVIEWER_ROLES = (UserRole.rop, UserRole.lawyer)
+
+
+class DepartmentRouting:
+    """Таблица «отдел → РОПы и юристы» в памяти.
+
+    Строится одним запросом при старте и дальше обновляется точечно
+    (подтверждение, отклонение, смена отдела). Для каждого проверяющего
+    хранится число открытых заявок; новая заявка достаётся наименее
+    загруженному РОПу и юристу отдела.
+    """
+
+    def __init__(self):
+        self._reviewers: Dict[Tuple[UserRole, Optional[str]], Dict[int, UserIdentity]] = {}
+        self._open: Dict[int, int] = {}
+
+    async def load(self) -> None:
+        async with async_session_scope() as s:
+            users = (await s.execute(select(User).where(
+                User.role.in_(REVIEWER_ROLES),
+                User.is_active == True,
+                User.is_approved == True
+            ))).scalars().all()
+            counts: Dict[int, int] = {}
+            for column in (Application.rop_id, Application.lawyer_id):
+                rows = await s.execute(
+                    select(column, func.count())
+                    .where(column.isnot(None), Application.status != ApplicationStatus.closed)
+                    .group_by(column)
+                )
+                for user_id, count in rows:
+                    counts[user_id] = counts.get(user_id, 0) + count
+        self._reviewers.clear()
+        for user in users:
+            self._add(UserIdentity.from_user(user))
+        self._open = counts
+        logger.info(f"Department routing loaded: {len(users)} reviewers in {len({d for _, d in self._reviewers})} departments")
+
+    # --- обновление таблицы ---
+
+    def _add(self, identity: UserIdentity) -> None:
+        self._reviewers.setdefault((identity.role, identity.department_no), {})[identity.id] = identity
+
+    def remove_user(self, user_id: int) -> None:
+        for key in list(self._reviewers):
+            bucket = self._reviewers[key]
+            bucket.pop(user_id, None)
+            if not bucket:
+                del self._reviewers[key]
+
+    def update_user(self, identity: UserIdentity) -> None:
+        """Вызывается после изменения роли, отдела или статуса пользователя"""
+        self.remove_user(identity.id)
+        if identity.role in REVIEWER_ROLES and identity.is_active and identity.is_approved:
+            self._add(identity)
+        logger.debug(f"Department routing updated for user {identity.id}")
+
+    # --- назначение ---
+
+    def reviewers(self, role: UserRole, department_no: Optional[str]) -> List[UserIdentity]:
+        """Проверяющие отдела, от наименее к наиболее загруженному"""
+        bucket = self._reviewers.get((role, department_no), {})
+        return sorted(bucket.values(), key=lambda u: (self._open.get(u.id, 0), u.id))
+
+    def pick(self, role: UserRole, department_no: Optional[str]) -> Optional[UserIdentity]:
+        """Наименее загруженный проверяющий отдела; если в отделе никого нет — любого отдела"""
+        candidates = self.reviewers(role, department_no)
+        if not candidates:
+            candidates = sorted(
+                (u for (r, _), bucket in self._reviewers.items() if r == role for u in bucket.values()),
+                key=lambda u: (self._open.get(u.id, 0), u.id),
+            )
+            if candidates:
+                logger.warning(f"No {role.value} in department {department_no}, falling back to {candidates[0].id}")
+        return candidates[0] if candidates else None
+
+    def assign(self, department_no: Optional[str]) -> Tuple[Optional[UserIdentity], Optional[UserIdentity]]:
+        """Выбирает РОПа и юриста для новой заявки и учитывает её в их загрузке"""
+        rop = self.pick(UserRole.rop, department_no)
+        lawyer = self.pick(UserRole.lawyer, department_no)
+        for reviewer in (rop, lawyer):
+            if reviewer:
+                self._open[reviewer.id] = self._open.get(reviewer.id, 0) + 1
+        return rop, lawyer
+
+    def reassign(self, old_user_id: Optional[int], new_user_id: Optional[int]) -> None:
+        """Переносит открытую заявку с одного проверяющего на другого (любой может быть None)"""
+        if old_user_id == new_user_id:
+            return
+        self.release(old_user_id)
+        if new_user_id:
+            self._open[new_user_id] = self._open.get(new_user_id, 0) + 1
+
+    def release(self, *user_ids: Optional[int]) -> None:
+        """Заявка закрыта или снята с проверяющих"""
+        for user_id in user_ids:
+            if user_id and self._open.get(user_id):
+                self._open[user_id] -= 1
+
+    def open_count(self, user_id: int) -> int:
+        return self._open.get(user_id, 0)
@@ -0,0 +1,185 @@
+"""Выгрузка реестра заявок в CSV.gz или XLSX.
+
+Строки читаются курсором порциями (yield_per) и сразу пишутся в файл,
+поэтому память не растёт с числом заявок. Функции синхронные: из бота их
+вызывают через asyncio.to_thread.
+"""
+import csv
+import gzip
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Iterable, Iterator, List, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from app.db.models import (
+    Application, ApplicationStatus, ApplicationAnswers, Document, Task, User,
+    ArchivedApplication, ArchivedApplicationAnswers, ArchivedDocument, ArchivedTask,
+)
+from app.db.repository import session_scope
+from app.services.questionnaire import QUESTIONS
+from app.services.search import visibility_filter
+from app.services.user_cache import UserIdentity
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+FORMATS = ("csv", "xlsx")
+
+# Ответ на q11 хранится двумя числами
+ANSWER_KEYS: List[str] = [
+    k for key, _, _ in QUESTIONS for k in (("q11_1", "q11_2") if key == "q11" else (key,))
+]
+
+HEADER = [
+    "id", "created_at", "status", "deal_type", "contract_no", "protocol_date", "address",
+    "object_type", "agent_name", "head_name", "department_no", "documents", "open_task",
+] + ANSWER_KEYS
+
+
+@dataclass
+class ExportResult:
+    path: str
+    rows: int
+    size: int
+    seconds: float
+
+
+# (заявка, ответы, документы, задачи) — рабочие таблицы и архив
+HOT_TABLES = (Application, ApplicationAnswers, Document, Task)
+ARCHIVE_TABLES = (ArchivedApplication, ArchivedApplicationAnswers, ArchivedDocument, ArchivedTask)
+
+
+def _export_select(tables, statuses, created_from, created_to, user):
+    app, answers, document, task = tables
+    documents = (
+        select(func.count(document.id))
+        .where(document.application_id == app.id)
+        .correlate(app)
+        .scalar_subquery()
+    )
+    open_task = (
+        select(task.text)
+        .where(task.application_id == app.id, task.status == "open")
+        .order_by(task.created_at.desc(), task.id.desc())
+        .limit(1)
+        .correlate(app)
+        .scalar_subquery()
+    )
+    query = (
+        select(
+            app.id, app.created_at, app.status, app.deal_type,
+            app.contract_no, app.protocol_date, app.address,
+            app.object_type, app.agent_name, app.head_name,
+            User.department_no, documents.label("documents"), open_task.label("open_task"),
+            answers.answers,
+        )
+        .outerjoin(User, User.id == app.agent_id)
+        .outerjoin(answers, answers.application_id == app.id)
+    )
+    if statuses:
+        query = query.where(app.status.in_(list(statuses)))
+    if created_from:
+        query = query.where(app.created_at >= created_from)
+    if created_to:
+        query = query.where(app.created_at < created_to)
+    if user is not None:
+        visibility = visibility_filter(user, app)
+        if visibility is not None:
+            query = query.where(visibility)
+    return query
+
+
+def export_query(
+    statuses: Optional[Iterable[ApplicationStatus]] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    user: Optional[UserIdentity] = None,
+    archive: bool = False,
+):
+    """Заявки с ответами, числом документов и последней открытой задачей.
+
+    archive=True — та же выборка из архивных таблиц.
+    """
+    tables = ARCHIVE_TABLES if archive else HOT_TABLES
+    statuses = list(statuses) if statuses else None
+    return _export_select(tables, statuses, created_from, created_to, user).order_by(tables[0].id)
+
+
+def export_queries(statuses: Optional[Iterable[ApplicationStatus]] = None, **filters) -> List[Any]:
+    """Запросы реестра: сначала архив (там старые заявки), потом рабочие таблицы.
+
+    Каждый читается своим курсором, без сортировки объединения. В архиве только
+    закрытые заявки, поэтому он нужен, если выборка включает CLOSED.
+    """
+    statuses = list(statuses) if statuses else None
+    queries = [export_query(statuses, archive=False, **filters)]
+    if not statuses or ApplicationStatus.closed in statuses:
+        queries.insert(0, export_query(statuses, archive=True, **filters))
+    return queries
+
+
+def iter_export_rows(session: Session, queries, batch_size: int = 1000) -> Iterator[List[Any]]:
+    """Строки реестра в порядке HEADER, по batch_size строк из курсора за раз"""
+    for query in queries:
+        result = session.execute(query.execution_options(yield_per=batch_size, stream_results=True))
+        for row in result:
+            answers = row.answers or {}
+            yield [
+                row.id,
+                row.created_at.isoformat(sep=" ", timespec="seconds") if row.created_at else "",
+                row.status.value if row.status else "",
+                row.deal_type, row.contract_no, row.protocol_date, row.address, row.object_type,
+                row.agent_name, row.head_name, row.department_no, row.documents, row.open_task,
+            ] + [answers.get(key) for key in ANSWER_KEYS]
+
+
+def write_csv_gz(rows: Iterable[List[Any]], path: str) -> int:
+    # utf-8-sig — чтобы Excel сразу открыл кириллицу
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8-sig", newline="", compresslevel=6) as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(HEADER)
+        for row in rows:
+            writer.writerow(["" if v is None else v for v in row])
+            count += 1
+    return count
+
+
+def write_xlsx(rows: Iterable[List[Any]], path: str) -> int:
+    try:
+        from openpyxl import Workbook
+    except ImportError as e:
+        raise RuntimeError("XLSX export requires openpyxl (pip install openpyxl)") from e
+    # write_only: строки сразу уходят во временный XML, а не держатся в памяти
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Заявки")
+    ws.append(HEADER)
+    count = 0
+    for row in rows:
+        ws.append(row)
+        count += 1
+    wb.save(path)
+    return count
+
+
+def export_filename(fmt: str, now: Optional[datetime] = None) -> str:
+    now = now or datetime.now()
+    return f"applications-{now:%Y%m%d-%H%M%S}." + ("csv.gz" if fmt == "csv" else "xlsx")
+
+
+def export_applications(path: str, fmt: str = "csv", batch_size: int = 1000, **filters) -> ExportResult:
+    """Выгружает реестр в path; filters — аргументы export_queries"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    writer = write_csv_gz if fmt == "csv" else write_xlsx
+    started = time.perf_counter()
+    with session_scope() as s:
+        rows = writer(iter_export_rows(s, export_queries(**filters), batch_size), path)
+    result = ExportResult(path, rows, os.path.getsize(path), time.perf_counter() - started)
+    logger.info(f"Exported {rows} applications to {path} ({result.size} bytes, {result.seconds:.1f}s)")
+    return result
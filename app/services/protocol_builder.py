@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Dict, Any, Optional, Iterator, Iterable, Tuple
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.db.models import Application, ApplicationStatus, ApplicationAnswers, ProtocolBuild, UploadJob
+from app.db.repository import async_session_scope
+from app.services.protocol_filler import load_template
+from app.services.protocol_renderer import ProtocolRenderer, RenderError, RenderQueueFull
+from app.services.upload_queue import UploadQueue, JOB_RENDER, JOB_UPLOAD
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+def protocol_path(app_id: int) -> str:
+    return f"./data/{app_id}/protocol.docx"
+
+
+def application_fields(app: Application) -> Dict[str, Any]:
+    """Поля заявки, которые подставляются в шаблон протокола"""
+    return {
+        "deal_type": app.deal_type or "",
+        "contract_no": app.contract_no or "",
+        "protocol_date": app.protocol_date or "",
+        "address": app.address or "",
+        "object_type": app.object_type or "",
+        "head_name": app.head_name or "",
+        "agent_name": app.agent_name or ""
+    }
+
+
+def protocol_data(app: Application, answers: Optional[Dict[str, str]]) -> Dict[str, Any]:
+    """data_dict для шаблона протокола: поля заявки и ответы анкеты"""
+    data_dict = application_fields(app)
+    data_dict.update(answers or {})
+    return data_dict
+
+
+def _protocol_query():
+    return (
+        select(Application, ApplicationAnswers.answers)
+        .outerjoin(ApplicationAnswers, ApplicationAnswers.application_id == Application.id)
+    )
+
+
+async def collect_protocol_data(session: AsyncSession, app_id: int) -> Optional[Dict[str, Any]]:
+    """Собирает data_dict для шаблона протокола одним запросом по первичному ключу"""
+    row = (await session.execute(_protocol_query().where(Application.id == app_id))).first()
+    if row is None:
+        return None
+    return protocol_data(*row)
+
+
+def iter_protocol_data(
+    session: Session,
+    statuses: Optional[Iterable[ApplicationStatus]] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    app_ids: Optional[Iterable[int]] = None,
+    batch_size: int = 500,
+) -> Iterator[Tuple[int, Optional[str], Dict[str, Any]]]:
+    """Отдаёт (id, yandex_folder, data_dict) для выбранных заявок.
+
+    Ответы хранятся одним документом на заявку, поэтому каждая строка
+    LEFT JOIN — это уже готовый data_dict.
+    """
+    query = _protocol_query().order_by(Application.id)
+    if statuses:
+        query = query.where(Application.status.in_(list(statuses)))
+    if created_from:
+        query = query.where(Application.created_at >= created_from)
+    if created_to:
+        query = query.where(Application.created_at < created_to)
+    if app_ids:
+        query = query.where(Application.id.in_(list(app_ids)))
+
+    for app, answers in session.execute(query.execution_options(yield_per=batch_size)):
+        yield app.id, app.yandex_folder, protocol_data(app, answers)
+
+
+def protocol_fingerprint(data: Dict[str, Any], template_version: str) -> str:
+    """Хэш входных данных рендера вместе с версией шаблона"""
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{template_version}\n{payload}".encode("utf-8")).hexdigest()
+
+
+async def protocol_upload_status(session: AsyncSession, app_id: int) -> Optional[str]:
+    """Статус последнего задания выгрузки протокола заявки.
+
+    Выгрузки протокола — задания upload без document_id (у документов он есть).
+    """
+    return (await session.execute(
+        select(UploadJob.status).where(
+            UploadJob.kind == JOB_UPLOAD,
+            UploadJob.application_id == app_id,
+            UploadJob.document_id.is_(None)
+        ).order_by(UploadJob.id.desc()).limit(1)
+    )).scalar()
+
+
+def protocol_upload_statuses(session: Session) -> Dict[int, str]:
+    """Статус последнего задания выгрузки протокола по всем заявкам"""
+    latest = (
+        select(func.max(UploadJob.id))
+        .where(UploadJob.kind == JOB_UPLOAD, UploadJob.document_id.is_(None))
+        .group_by(UploadJob.application_id)
+    )
+    return dict(session.execute(select(UploadJob.application_id, UploadJob.status).where(UploadJob.id.in_(latest))).all())
+
+
+async def build_protocol(
+    app_id: int,
+    renderer: ProtocolRenderer,
+    upload_queue: UploadQueue,
+    force: bool = False,
+) -> bool:
+    """Пересобирает и выгружает протокол, только если изменились данные или шаблон.
+
+    Возвращает True, если протокол был сформирован заново.
+    """
+    template_version = load_template(renderer.template_path).version
+    async with async_session_scope() as s:
+        data = await collect_protocol_data(s, app_id)
+        if data is None:
+            raise ValueError(f"Application {app_id} not found")
+        yandex_folder = (await s.get(Application, app_id)).yandex_folder
+        fingerprint = protocol_fingerprint(data, template_version)
+        build = await s.get(ProtocolBuild, app_id)
+        if build and build.fingerprint == fingerprint and not force:
+            # Отпечаток пишется до выгрузки: протокол актуален, только если файл
+            # на месте и его выгрузка не провалилась
+            if not os.path.exists(build.output_path):
+                logger.warning(f"Protocol for app {app_id} is missing at {build.output_path}, rendering again")
+            elif yandex_folder and await protocol_upload_status(s, app_id) in (None, "failed"):
+                upload_queue.enqueue_upload(s, app_id, build.output_path, yandex_folder, "protocol.docx")
+                logger.info(f"Protocol for app {app_id} is up to date but not on Yandex.Disk, upload queued again")
+                return False
+            else:
+                logger.info(f"Protocol for app {app_id} is up to date, skipping render")
+                return False
+
+    output_path = protocol_path(app_id)
+    await renderer.render(data, output_path)
+
+    async with async_session_scope() as s:
+        await s.run_sync(record_build, upload_queue, app_id, fingerprint, template_version, output_path, yandex_folder)
+    logger.info(f"Protocol for app {app_id} rebuilt")
+    return True
+
+
+async def build_protocol_or_defer(
+    app_id: int,
+    renderer: ProtocolRenderer,
+    upload_queue: UploadQueue,
+    force: bool = False,
+) -> Optional[bool]:
+    """build_protocol, а если рендер сейчас невозможен — задание в очереди с повторами.
+
+    Возвращает None, если протокол отложен.
+    """
+    try:
+        return await build_protocol(app_id, renderer, upload_queue, force=force)
+    except (RenderError, RenderQueueFull) as e:
+        logger.warning(f"Protocol for app {app_id} deferred to the queue: {e}")
+    async with async_session_scope() as s:
+        queued = (await s.execute(
+            select(UploadJob.id).where(
+                UploadJob.kind == JOB_RENDER,
+                UploadJob.application_id == app_id,
+                UploadJob.status == "pending"
+            ).limit(1)
+        )).scalar()
+        if queued is None:
+            upload_queue.enqueue_render(s, app_id)
+    return None
+
+
+def record_build(
+    session: Session,
+    upload_queue: UploadQueue,
+    app_id: int,
+    fingerprint: str,
+    template_version: str,
+    output_path: str,
+    yandex_folder: Optional[str],
+) -> None:
+    """Запоминает отпечаток сформированного протокола и ставит его на выгрузку"""
+    build = session.get(ProtocolBuild, app_id)
+    if build is None:
+        build = ProtocolBuild(application_id=app_id)
+        session.add(build)
+    build.fingerprint = fingerprint
+    build.template_version = template_version
+    build.output_path = output_path
+    if yandex_folder:
+        upload_queue.enqueue_upload(session, app_id, output_path, yandex_folder, "protocol.docx")
@@ -1,76 +1,405 @@
+import codecs
+import copy
+import hashlib
+import html
 import os
-import shutil
+import struct
+import zipfile
+import zlib
+from bisect import bisect_right
 from pathlib import Path
-from typing import Dict, Any
-from docx import Document
+from typing import Dict, Any, List, Optional, Tuple, Iterator, BinaryIO
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
+from lxml import etree
+from app.config.config import settings
 from app.config.logging_config import get_logger
 import re
 
 # Initialize logger
 logger = get_logger(__name__)
 
+# Бэкенды заполнения: дерево python-docx или потоковая замена в XML
+BACKEND_DOCX = "docx"
+BACKEND_XML = "xml"
+
+DEFAULT_TEMPLATE_PATH = str(Path(__file__).resolve().parent.parent / "templates" / "protocol_template.docx")
+
+PLACEHOLDER_PATTERN = re.compile(r"\{\{(\w+)\}\}")
+
+DOCUMENT_XML = "word/document.xml"
+_W_P = qn("w:p")
+_W_R = qn("w:r")
+_W_TBL = qn("w:tbl")
+
+# Сегмент абзаца: (текст, ключ или None, индекс run, с которого начинается сегмент)
+Segment = Tuple[str, Optional[str], int]
+
+
+def _run_texts(p) -> List[str]:
+    return [Run(r, None).text for r in p.iter(_W_R)]
+
+
+def _segments(p) -> List[Segment]:
+    """Разбивает текст абзаца на литералы и маркеры {{key}} (маркер может быть разбит по run)"""
+    texts = _run_texts(p)
+    text = "".join(texts)
+    if "{{" not in text:
+        return []
+    matches = list(PLACEHOLDER_PATTERN.finditer(text))
+    if not matches:
+        return []
+    # Смещения начала каждого run в общем тексте абзаца
+    offsets = []
+    pos = 0
+    for t in texts:
+        offsets.append(pos)
+        pos += len(t)
+
+    def run_at(offset: int) -> int:
+        return max(bisect_right(offsets, offset) - 1, 0)
+
+    segments: List[Segment] = []
+    last_index = 0
+    for match in matches:
+        start, end = match.span()
+        if start > last_index:
+            segments.append((text[last_index:start], None, run_at(last_index)))
+        segments.append((match.group(0), match.group(1), run_at(start)))
+        last_index = end
+    if last_index < len(text):
+        segments.append((text[last_index:], None, run_at(last_index)))
+    return segments
+
+
+def _fill_paragraph(p, segments: List[Segment], data: Dict[str, Any], emphasize: bool) -> int:
+    """Пересобирает run абзаца по сегментам, сохраняя форматирование исходных run"""
+    run_props = [r.rPr for r in p.iter(_W_R)]
+    paragraph = Paragraph(p, None)
+    paragraph.clear()
+    replacements = 0
+    for text, key, run_index in segments:
+        if key is not None and key in data:
+            text = str(data[key])
+            replacements += 1
+        else:
+            key = None
+        run = paragraph.add_run(text)
+        rpr = run_props[run_index] if run_index < len(run_props) else None
+        if rpr is not None:
+            run._r.insert(0, copy.deepcopy(rpr))
+        # Ответы в тексте выделяем жирным курсивом, в таблицах — нет
+        if key is not None and emphasize:
+            run.bold = True
+            run.italic = True
+    return replacements
+
 
 def replace_placeholders(paragraphs, data: Dict[str, Any]) -> int:
     replacements = 0
-    pattern = re.compile(r"\{\{(\w+)\}\}")
     for p in paragraphs:
-        text = p.text
-        matches = list(pattern.finditer(text))
-        if not matches:
-            continue
-        p.clear()
-        last_index = 0
-        for match in matches:
-            start, end = match.span()
-            key = match.group(1)
-            # Add text before marker
-            if start > last_index:
-                p.add_run(text[last_index:start])
-            # Add replacement with bold and italic if key in data
-            if key in data:
-                ans = p.add_run(str(data[key]))
-                ans.bold = True
-                ans.italic = True
-                replacements += 1
-            else:
-                # If key not in data, add original marker text
-                p.add_run(match.group(0))
-            last_index = end
-        # Add remaining text after last marker
-        if last_index < len(text):
-            p.add_run(text[last_index:])
+        segments = _segments(p._p)
+        if segments:
+            replacements += _fill_paragraph(p._p, segments, data, emphasize=True)
     return replacements
 
 def replace_placeholders_in_tables(paragraphs, data: Dict[str, Any]) -> int:
     replacements = 0
-    pattern = re.compile(r"\{\{(\w+)\}\}")
     for p in paragraphs:
-        text = p.text
-        matches = list(pattern.finditer(text))
-        if not matches:
+        segments = _segments(p._p)
+        if segments:
+            replacements += _fill_paragraph(p._p, segments, data, emphasize=False)
+    return replacements
+
+
+class ProtocolTemplate:
+    """Шаблон протокола, разобранный один раз.
+
+    При загрузке строится индекс слотов: номер абзаца (w:p) в документе,
+    признак «внутри таблицы» и заранее нарезанные сегменты с маркерами.
+    Рендер только клонирует дерево document.xml, патчит слоты и пишет zip.
+    """
+
+    def __init__(self, template_path: str):
+        self.path = template_path
+        self.mtime = os.path.getmtime(template_path)
+        with open(template_path, "rb") as f:
+            raw = f.read()
+        # Версия шаблона — хэш его содержимого
+        self.version = hashlib.sha256(raw).hexdigest()
+        with zipfile.ZipFile(template_path) as zf:
+            self._members = [(info, zf.read(info)) for info in zf.infolist()]
+        document_xml = next(data for info, data in self._members if info.filename == DOCUMENT_XML)
+        self._root = parse_xml(document_xml)
+        self.slots = self._compile()
+        logger.info(f"Compiled protocol template {template_path}: {len(self.slots)} slots")
+
+    def _compile(self) -> List[Tuple[int, bool, List[Segment]]]:
+        slots = []
+        for index, p in enumerate(self._root.iter(_W_P)):
+            segments = _segments(p)
+            if not segments:
+                continue
+            in_table = any(ancestor.tag == _W_TBL for ancestor in p.iterancestors())
+            slots.append((index, in_table, segments))
+        return slots
+
+    @property
+    def placeholders(self) -> List[str]:
+        return sorted({key for _, _, segments in self.slots for _, key, _ in segments if key})
+
+    def render(self, output_path: str, data: Dict[str, Any]) -> int:
+        """Заполняет шаблон и пишет результат в output_path; возвращает число замен"""
+        root = copy.deepcopy(self._root)
+        paragraphs = list(root.iter(_W_P))
+        replacements = 0
+        for index, in_table, segments in self.slots:
+            replacements += _fill_paragraph(paragraphs[index], segments, data, emphasize=not in_table)
+        document_xml = etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            for info, member in self._members:
+                zf.writestr(info, document_xml if info.filename == DOCUMENT_XML else member)
+        return replacements
+
+
+# --- Потоковый XML-бэкенд ---
+
+_XML_OUTER = re.compile(r"<w:p(?=[\s>/])|<w:tbl(?=[\s>])|</w:tbl>")
+_XML_P_OPEN = re.compile(r"<w:p(?=[\s>/])")
+_XML_P_CLOSE = "</w:p>"
+_XML_T = re.compile(r"<w:t(?:\s[^>]*)?>([^<]*)</w:t>")
+_XML_NSDECL = re.compile(r'\sxmlns(?::\w+)?="[^"]*"')
+_XML_CHUNK = 64 * 1024
+
+
+def _paragraph_end(buf: str) -> Optional[int]:
+    """Возвращает конец абзаца, начинающегося в buf[0], или None, если он ещё не дочитан"""
+    gt = buf.find(">")
+    if gt == -1:
+        return None
+    if buf[gt - 1] == "/":
+        return gt + 1
+    depth = 1
+    pos = gt + 1
+    while True:
+        close = buf.find(_XML_P_CLOSE, pos)
+        if close == -1:
+            return None
+        nested = _XML_P_OPEN.search(buf, pos, close)
+        if nested:
+            nested_gt = buf.find(">", nested.end())
+            if nested_gt == -1:
+                return None
+            if buf[nested_gt - 1] != "/":
+                depth += 1
+            pos = nested_gt + 1
             continue
-        p.clear()
-        last_index = 0
-        for match in matches:
-            start, end = match.span()
-            key = match.group(1)
-            # Add text before marker
-            if start > last_index:
-                p.add_run(text[last_index:start])
-            # Add replacement without bold and italic if key in data
-            if key in data:
-                p.add_run(str(data[key]))
-                replacements += 1
+        depth -= 1
+        pos = close + len(_XML_P_CLOSE)
+        if depth == 0:
+            return pos
+
+
+class _XmlSubstitution:
+    """Потоковая замена маркеров в word/document.xml.
+
+    В памяти держится только текущий абзац. Абзацы без маркеров копируются
+    как есть; абзацы с маркерами разбираются по отдельности и патчатся тем же
+    кодом, что и в python-docx-бэкенде, поэтому форматирование совпадает.
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self.replacements = 0
+        self._nsdecls = ""
+
+    def run(self, chunks: Iterator[str]) -> Iterator[str]:
+        buf = ""
+        eof = False
+        table_depth = 0
+        header_done = False
+        while True:
+            if not header_done:
+                body = buf.find("<w:body")
+                if body == -1 and not eof:
+                    try:
+                        buf += next(chunks)
+                    except StopIteration:
+                        eof = True
+                    continue
+                # Объявления пространств имён корня нужны для разбора отдельных абзацев
+                self._nsdecls = " ".join(m.group(0).strip() for m in _XML_NSDECL.finditer(buf[:max(body, 0)]))
+                header_done = True
+            match = _XML_OUTER.search(buf)
+            if match is None:
+                if eof:
+                    yield buf
+                    return
+                # Хвост может содержать начало тега — оставляем его в буфере
+                keep = min(len(buf), 8)
+                yield buf[:len(buf) - keep]
+                buf = buf[len(buf) - keep:]
+                try:
+                    buf += next(chunks)
+                except StopIteration:
+                    eof = True
+                continue
+            if match.group(0) == "</w:tbl>":
+                table_depth -= 1
+            elif match.group(0).startswith("<w:tbl"):
+                table_depth += 1
             else:
-                # If key not in data, add original marker text
-                p.add_run(match.group(0))
-            last_index = end
-        # Add remaining text after last marker
-        if last_index < len(text):
-            p.add_run(text[last_index:])
-    return replacements
+                yield buf[:match.start()]
+                buf = buf[match.start():]
+                end = _paragraph_end(buf)
+                while end is None:
+                    if eof:
+                        raise ValueError("Unexpected end of document.xml inside a paragraph")
+                    try:
+                        buf += next(chunks)
+                    except StopIteration:
+                        eof = True
+                    end = _paragraph_end(buf)
+                yield self._paragraph(buf[:end], in_table=table_depth > 0)
+                buf = buf[end:]
+                continue
+            yield buf[:match.end()]
+            buf = buf[match.end():]
+
+    def _paragraph(self, p_xml: str, in_table: bool) -> str:
+        if "{" not in p_xml:
+            return p_xml
+        text = html.unescape("".join(_XML_T.findall(p_xml)))
+        if not PLACEHOLDER_PATTERN.search(text):
+            return p_xml
+        wrapper = parse_xml(f"<w:body {self._nsdecls}>{p_xml}</w:body>")
+        p = wrapper[0]
+        self.replacements += _fill_paragraph(p, _segments(p), self.data, emphasize=not in_table)
+        patched = etree.tostring(p, encoding="unicode")
+        # Повторные объявления пространств имён уже есть у корня документа
+        start_tag_end = patched.find(">")
+        return _XML_NSDECL.sub("", patched[:start_tag_end]) + patched[start_tag_end:]
+
+
+def _dos_datetime(date_time: Tuple[int, ...]) -> Tuple[int, int]:
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+class _RawZipWriter:
+    """Минимальный писатель zip: копирует сжатые данные членов без перепаковки"""
+
+    def __init__(self, fp: BinaryIO):
+        self.fp = fp
+        self._entries: List[Tuple[bytes, int, int, int, int, int, int, int, int]] = []
+
+    def _local_header(self, name: bytes, flags: int, method: int, dostime: int, dosdate: int,
+                      crc: int, compress_size: int, file_size: int) -> int:
+        offset = self.fp.tell()
+        self.fp.write(struct.pack(zipfile.structFileHeader, zipfile.stringFileHeader, 20, 0, flags, method,
+                                  dostime, dosdate, crc, compress_size, file_size, len(name), 0))
+        self.fp.write(name)
+        return offset
+
+    def copy_raw(self, source: BinaryIO, info: zipfile.ZipInfo) -> None:
+        """Переносит член архива байт-в-байт (без распаковки и повторного сжатия)"""
+        source.seek(info.header_offset)
+        header = struct.unpack(zipfile.structFileHeader, source.read(zipfile.sizeFileHeader))
+        source.seek(header[10] + header[11], os.SEEK_CUR)  # имя и extra-поле
+        name = info.filename.encode("utf-8")
+        flags = info.flag_bits & ~0x08 | (0x800 if not info.filename.isascii() else 0)
+        dostime, dosdate = _dos_datetime(info.date_time)
+        offset = self._local_header(name, flags, info.compress_type, dostime, dosdate,
+                                    info.CRC, info.compress_size, info.file_size)
+        remaining = info.compress_size
+        while remaining:
+            chunk = source.read(min(remaining, _XML_CHUNK))
+            if not chunk:
+                raise ValueError(f"Truncated zip member {info.filename}")
+            self.fp.write(chunk)
+            remaining -= len(chunk)
+        self._entries.append((name, flags, info.compress_type, dostime, dosdate, info.CRC,
+                              info.compress_size, info.file_size, offset))
 
-def fill_protocol(template_path: str, output_path: str, data: Dict[str, Any]) -> bool:
+    def write_stream(self, info: zipfile.ZipInfo, chunks: Iterator[bytes]) -> None:
+        """Сжимает и пишет член архива по кускам, размеры — в дескрипторе данных"""
+        name = info.filename.encode("utf-8")
+        flags = 0x08
+        dostime, dosdate = _dos_datetime(info.date_time)
+        offset = self._local_header(name, flags, zipfile.ZIP_DEFLATED, dostime, dosdate, 0, 0, 0)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            out = compressor.compress(chunk)
+            compress_size += len(out)
+            self.fp.write(out)
+        out = compressor.flush()
+        compress_size += len(out)
+        self.fp.write(out)
+        self.fp.write(struct.pack("<4s3L", b"PK\x07\x08", crc, compress_size, file_size))
+        self._entries.append((name, flags, zipfile.ZIP_DEFLATED, dostime, dosdate, crc,
+                              compress_size, file_size, offset))
+
+    def close(self) -> None:
+        central_offset = self.fp.tell()
+        for name, flags, method, dostime, dosdate, crc, compress_size, file_size, offset in self._entries:
+            self.fp.write(struct.pack(zipfile.structCentralDir, zipfile.stringCentralDir, 20, 0, 20, 0,
+                                      flags, method, dostime, dosdate, crc, compress_size, file_size,
+                                      len(name), 0, 0, 0, 0, 0, offset))
+            self.fp.write(name)
+        central_size = self.fp.tell() - central_offset
+        self.fp.write(struct.pack(zipfile.structEndArchive, zipfile.stringEndArchive, 0, 0,
+                                  len(self._entries), len(self._entries), central_size, central_offset, 0))
+
+
+def render_xml(template_path: str, output_path: str, data: Dict[str, Any]) -> int:
+    """Заполняет шаблон потоковой заменой в XML; возвращает число замен"""
+    substitution = _XmlSubstitution(data)
+    with open(template_path, "rb") as source, zipfile.ZipFile(source) as zin, open(output_path, "wb") as out:
+        writer = _RawZipWriter(out)
+        for info in zin.infolist():
+            if info.filename != DOCUMENT_XML:
+                writer.copy_raw(source, info)
+                continue
+            with zin.open(info) as member:
+                decoder = codecs.getincrementaldecoder("utf-8")()
+
+                def text_chunks() -> Iterator[str]:
+                    while True:
+                        raw = member.read(_XML_CHUNK)
+                        if not raw:
+                            tail = decoder.decode(b"", final=True)
+                            if tail:
+                                yield tail
+                            return
+                        yield decoder.decode(raw)
+
+                encoded = (part.encode("utf-8") for part in substitution.run(text_chunks()) if part)
+                writer.write_stream(info, encoded)
+        writer.close()
+    return substitution.replacements
+
+
+_templates: Dict[str, ProtocolTemplate] = {}
+
+
+def load_template(template_path: str = DEFAULT_TEMPLATE_PATH) -> ProtocolTemplate:
+    """Возвращает скомпилированный шаблон; перечитывает его, если файл изменился"""
+    key = os.path.abspath(template_path)
+    template = _templates.get(key)
+    if template is None or template.mtime != os.path.getmtime(template_path):
+        template = ProtocolTemplate(template_path)
+        _templates[key] = template
+    return template
+
+
+def fill_protocol(template_path: str, output_path: str, data: Dict[str, Any], backend: Optional[str] = None) -> bool:
     """
     Fill a Word template with provided data and save to output path.
 
@@ -78,6 +407,8 @@ def fill_protocol(template_path: str, output_path: str, data: Dict[str, Any]) ->
         template_path: Path to the Word template file
         output_path: Path where to save the filled document
         data: Dictionary with key-value pairs to replace in the template
+        backend: "docx" (precompiled python-docx tree) or "xml" (streaming
+            substitution in document.xml); defaults to settings.protocol_backend
 
     Returns:
         bool: True if successful, False otherwise
@@ -98,40 +429,20 @@ def fill_protocol(template_path: str, output_path: str, data: Dict[str, Any]) ->
             os.makedirs(output_dir, exist_ok=True)
             logger.debug(f"Created output directory: {output_dir}")
 
-        # Create a copy of the template
-        logger.debug("Creating template copy")
-        shutil.copy(template_path, output_path)
-
-        # Load the document
-        doc = Document(output_path)
-
-        # Process document content
-        logger.debug("Processing document content")
-        total_replacements = 0
-
-        # Replace in paragraphs
-        para_replacements = replace_placeholders(doc.paragraphs, data)
-        total_replacements += para_replacements
-        logger.debug(f"Made {para_replacements} replacements in paragraphs")
-
-        table_replacements = 0
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    table_replacements += replace_placeholders_in_tables(cell.paragraphs, data)
-        total_replacements += table_replacements
-        logger.debug(f"Made {table_replacements} replacements in tables")
-        
+        backend = backend or settings.protocol_backend
+        if backend == BACKEND_XML:
+            total_replacements = render_xml(template_path, output_path, data)
+        else:
+            template = load_template(template_path)
+            total_replacements = template.render(output_path, data)
+
         if total_replacements == 0:
             logger.warning("No template markers were replaced in the document")
         else:
             logger.info(f"Successfully made {total_replacements} replacements in the document")
-        
-        # Save the document
-        doc.save(output_path)
         logger.info(f"Successfully saved filled document to: {output_path}")
         return True
-        
+
     except PermissionError as e:
         logger.error(f"Permission error when accessing files: {e}")
         return False
@@ -144,4 +455,4 @@ def fill_protocol(template_path: str, output_path: str, data: Dict[str, Any]) ->
                 logger.debug(f"Removed partially created file: {output_path}")
             except Exception as cleanup_error:
                 logger.error(f"Failed to clean up partially created file: {cleanup_error}")
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,115 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Optional, Tuple
+
+from app.services.protocol_filler import fill_protocol, load_template, DEFAULT_TEMPLATE_PATH
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+class RenderQueueFull(Exception):
+    """Очередь рендера переполнена — заявку стоит повторить позже"""
+
+
+class RenderError(Exception):
+    """Не удалось сформировать протокол"""
+
+
+def _init_worker(template_path: str) -> None:
+    # Каждый процесс компилирует шаблон один раз при старте
+    load_template(template_path)
+
+
+def _render_in_worker(template_path: str, output_path: str, data: Dict[str, Any]) -> Tuple[bool, float]:
+    started = time.perf_counter()
+    ok = fill_protocol(template_path, output_path, data)
+    return ok, time.perf_counter() - started
+
+
+class ProtocolRenderer:
+    """Рендер протоколов в пуле процессов, вне asyncio-цикла бота.
+
+    Одновременно выполняется не больше workers рендеров, ещё до max_queue
+    ждут своей очереди; сверх этого render() сразу бросает RenderQueueFull.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue: int = 32, template_path: str = DEFAULT_TEMPLATE_PATH):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.template_path = template_path
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(self.workers)
+        self._waiting = 0
+        self._running = 0
+        self.rendered = 0
+        self.failed = 0
+        self.total_render_time = 0.0
+        self.last_render_time = 0.0
+
+    async def start(self) -> None:
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.template_path,),
+        )
+        logger.info(f"Protocol renderer started with {self.workers} worker processes")
+
+    async def stop(self) -> None:
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+            logger.info("Protocol renderer stopped")
+
+    @property
+    def queue_depth(self) -> int:
+        """Сколько рендеров ждут свободного процесса"""
+        return self._waiting
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_depth": self._waiting,
+            "running": self._running,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "last_render_ms": round(self.last_render_time * 1000, 1),
+            "avg_render_ms": round(self.total_render_time / self.rendered * 1000, 1) if self.rendered else 0.0,
+        }
+
+    async def render(self, data: Dict[str, Any], output_path: str) -> str:
+        """Заполняет шаблон данными data и возвращает путь к готовому протоколу"""
+        if self._executor is None:
+            raise RenderError("Protocol renderer is not started")
+        if self._waiting >= self.max_queue:
+            raise RenderQueueFull(f"Render queue is full ({self._waiting} waiting)")
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            ok, elapsed = await loop.run_in_executor(
+                self._executor, _render_in_worker, self.template_path, output_path, dict(data)
+            )
+        except Exception as e:
+            self.failed += 1
+            raise RenderError(f"Protocol render crashed: {e}") from e
+        finally:
+            self._running -= 1
+            self._slots.release()
+        if not ok:
+            self.failed += 1
+            raise RenderError(f"Protocol render failed for {output_path}")
+        self.rendered += 1
+        self.last_render_time = elapsed
+        self.total_render_time += elapsed
+        logger.debug(f"Rendered {output_path} in {elapsed * 1000:.1f} ms, renderer stats: {self.stats()}")
+        return output_path
@@ -0,0 +1,87 @@
+from typing import Dict, List, Tuple
+
+from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import ApplicationAnswers
+from app.db.repository import async_session_scope
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Версия схемы анкеты: увеличивать при изменении ключей или смысла вопросов.
+# Записывается вместе с ответами заявки в application_answers.
+QUESTIONS_VERSION = 1
+
+QUESTIONS = [
+    ("q01", "Адрес объекта соответствует расположению по карте, соседним домам и квартирам?", ["да", "нет"]),
+    ("q02", "Новорожденные дети без регистрации?", ["проживают", "не проживают"]),
+    ("q03", "На Объекте незарегистрированная перепланировка?", ["имеется", "отсутствует"]),
+    ("q04", "Данные о незарегистрированной  перепланировке в документах БТИ?", ["есть", "нет"]),
+    ("q05", "Претензии третьих лиц в отношении прав на Объект?", ["имеются", "отсутствуют"]),
+    ("q06", "У собств./польз. есть признаки неадекватного поведения/ псих.заболевания", ["да", "нет"]),
+    ("q07", "Задолженность за электроэнергию/коммунальные платежи/капремонт", ["отсутствует", "имеется", "нет данных"]),
+    ("q08", "Дом, планируется", ["под снос", "реконструкцию", "не планируется", "не установлено"]),
+    ("q09", "Объект перед сделкой занимают", ["собственники", "арендаторы", "физически свободен"]),
+    ("q10", "Объект продается", ["по доверенности", "лично собственником"]),
+    ("q11", "К моменту сделки на объекте зарегистрировано ___ человек, из них несовершеннолетних ___ (ручной ввод)", []),
+    ("q12", "Срок владения Объектом (ручной ввод)", []),
+    ("q13", "Является единственным жильем на момент продажи", ["да", "нет"]),
+    ("q14", "Заявление о личном участии в сделке", ["было", "не было"]),
+    ("q15", "Средства материнского капитала на приобретение Объекта", ["использовались", " не использовались"]),
+    ("q16", "Относится ли Объект к объектам культурного наследия", ["да", "нет"])
+
+]
+
+# Ответы, ещё не записанные в БД, копятся в данных FSM под этим ключом
+PENDING_ANSWERS = "pending_answers"
+
+
+async def buffer_answers(state: FSMContext, answers: List[Tuple[str, str]], **data) -> int:
+    """Добавляет ответы в буфер FSM (вместе с прочими данными) и возвращает размер буфера"""
+    pending = list((await state.get_data()).get(PENDING_ANSWERS) or [])
+    pending.extend([key, value] for key, value in answers)
+    await state.update_data(**{PENDING_ANSWERS: pending}, **data)
+    return len(pending)
+
+
+async def load_answers(session: AsyncSession, app_id: int) -> Dict[str, str]:
+    """Ответы анкеты заявки {question_key: answer} — один запрос по первичному ключу"""
+    row = await session.get(ApplicationAnswers, app_id)
+    return dict(row.answers) if row else {}
+
+
+async def save_answers(session: AsyncSession, app_id: int, answers: Dict[str, str]) -> None:
+    """Дописывает ответы в документ заявки (повторный ответ заменяет прежний)"""
+    row = await session.get(ApplicationAnswers, app_id)
+    if row is None:
+        session.add(ApplicationAnswers(application_id=app_id, questions_version=QUESTIONS_VERSION, answers=dict(answers)))
+    else:
+        # JSON-колонка не отслеживает изменения на месте — присваиваем новый словарь
+        row.answers = {**row.answers, **answers}
+        row.questions_version = QUESTIONS_VERSION
+
+
+async def flush_answers(state: FSMContext) -> int:
+    """Записывает накопленные ответы анкеты одной транзакцией и очищает буфер"""
+    data = await state.get_data()
+    pending = data.get(PENDING_ANSWERS)
+    app_id = data.get("application_id")
+    if not pending or not app_id:
+        return 0
+    async with async_session_scope() as s:
+        await save_answers(s, app_id, dict(pending))
+    # Буфер очищаем только после коммита: при ошибке ответы останутся в FSM
+    await state.update_data(**{PENDING_ANSWERS: []})
+    logger.debug(f"Flushed {len(pending)} answers for application {app_id}")
+    return len(pending)
+
+
+async def clear_state(state: FSMContext) -> None:
+    """state.clear(), который не теряет недописанные ответы брошенной анкеты"""
+    try:
+        await flush_answers(state)
+    except Exception as e:
+        logger.error(f"Failed to flush pending answers: {e}")
+    await state.clear()
@@ -0,0 +1,130 @@
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+from sqlalchemy import select, text, or_, and_, func, literal, literal_column, table, column
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Application, ApplicationStatus, ArchivedApplication, User, UserRole
+from app.db.migrations import SEARCH_COLUMNS
+from app.services.user_cache import UserIdentity
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Не больше стольких слов из запроса — длинные запросы только замедляют MATCH
+MAX_TERMS = 8
+
+# Вес полей в ранжировании bm25 (порядок как в SEARCH_COLUMNS)
+FTS_WEIGHTS = {"address": 5.0, "contract_no": 8.0, "agent_name": 2.0, "head_name": 2.0, "deal_type": 1.0}
+
+# Способ поиска определяется один раз: схема меняется только миграциями при старте
+_backend_name: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    id: int
+    deal_type: Optional[str]
+    contract_no: Optional[str]
+    address: Optional[str]
+    agent_name: Optional[str]
+    status: ApplicationStatus
+    archived: bool = False
+
+
+def search_terms(query: str) -> List[str]:
+    """Слова запроса: «Ленина 12/3» → ["ленина", "12", "3"]"""
+    return re.findall(r"\w+", query.lower())[:MAX_TERMS]
+
+
+def visibility_filter(user: UserIdentity, model=Application):
+    """Условие видимости заявок: агент — свои, РОП и юрист — своего отдела и назначенные им.
+
+    Запрос должен быть соединён с User (агентом заявки). None — видно всё.
+    model — Application или ArchivedApplication.
+    """
+    if user.role == UserRole.admin:
+        return None
+    if user.role == UserRole.agent:
+        return model.agent_id == user.id
+    assigned = model.rop_id == user.id if user.role == UserRole.rop else model.lawyer_id == user.id
+    if user.department_no:
+        return or_(assigned, User.department_no == user.department_no)
+    return assigned
+
+
+async def _backend(session: AsyncSession) -> str:
+    global _backend_name
+    if _backend_name is None:
+        dialect = session.bind.dialect.name
+        _backend_name = "like"
+        if dialect == "postgresql":
+            _backend_name = "tsvector"
+        elif dialect == "sqlite":
+            exists = (await session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'applications_fts'"
+            ))).scalar()
+            # Без FTS5 — LIKE по unicode_lower (app/db/base.py): lower() SQLite только для ASCII
+            _backend_name = "fts5" if exists else "sqlite_like"
+    return _backend_name
+
+
+def _search_stmt(model, backend: str, terms: List[str], user: UserIdentity):
+    """Запрос поиска по таблице model (рабочей или архивной) с её индексом.
+
+    Последняя колонка — ранг: чем меньше, тем лучше совпадение.
+    """
+    columns = [model.id, model.deal_type, model.contract_no, model.address, model.agent_name, model.status]
+    name = model.__tablename__
+    if backend == "fts5":
+        fts = table(f"{name}_fts", column("rowid"))
+        rank = literal_column(f"bm25({name}_fts, {', '.join(str(FTS_WEIGHTS[c]) for c in SEARCH_COLUMNS)})")
+        match = " ".join(f'"{t}"*' for t in terms)
+        stmt = (
+            select(*columns, rank.label("rank"))
+            .select_from(fts.join(model, model.id == fts.c.rowid))
+            .where(text(f"{name}_fts MATCH :match").bindparams(match=match))
+            .order_by(rank)
+        )
+    elif backend == "tsvector":
+        tsquery = func.to_tsquery("simple", " & ".join(f"{t}:*" for t in terms))
+        tsv = literal_column(f"{name}.search_tsv")
+        rank = -func.ts_rank(tsv, tsquery)
+        stmt = select(*columns, rank.label("rank")).where(tsv.op("@@")(tsquery)).order_by(rank)
+    else:
+        lower = func.unicode_lower if backend == "sqlite_like" else func.lower
+        stmt = select(*columns, literal(0).label("rank")).where(and_(*[
+            or_(*[lower(getattr(model, c)).contains(t, autoescape=True) for c in SEARCH_COLUMNS])
+            for t in terms
+        ])).order_by(model.created_at.desc())
+
+    visibility = visibility_filter(user, model)
+    if visibility is not None:
+        stmt = stmt.outerjoin(User, User.id == model.agent_id).where(visibility)
+    return stmt
+
+
+async def search_applications(session: AsyncSession, query: str, user: UserIdentity, limit: int = 10) -> List[SearchHit]:
+    """Полнотекстовый поиск по заявкам с учётом видимости, лучшие совпадения первыми.
+
+    Каждое слово запроса ищется как префикс, все слова должны найтись.
+    Рабочие заявки и архив ищутся каждый своим индексом, лучшие limit из
+    обоих списков сливаются по рангу; при равном ранге рабочие идут первыми.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    backend = await _backend(session)
+    ranked = []
+    for model, archived in ((Application, False), (ArchivedApplication, True)):
+        rows = (await session.execute(_search_stmt(model, backend, terms, user).limit(limit))).all()
+        ranked += [(row.rank, SearchHit(*row[:-1], archived=archived)) for row in rows]
+    ranked.sort(key=lambda item: item[0])
+    hits = [hit for _, hit in ranked[:limit]]
+    logger.debug(
+        f"Search {terms!r} by user {user.id} via {backend}: {len(hits)} hits, {sum(h.archived for h in hits)} archived"
+    )
+    return hits
@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import Optional, AsyncIterator, Tuple, TYPE_CHECKING
+
+from aiogram import Bot
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.config import settings
+from app.config.logging_config import get_logger
+from app.db.models import Document
+from app.db.repository import async_session_scope
+from app.services import yandex_disk as ya
+from app.services.upload_queue import UploadQueue
+
+if TYPE_CHECKING:
+    from app.services.blob_cache import BlobCache
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Локальные файлы документов хранятся по адресу содержимого: blobs/ab/abcdef...
+BLOB_ROOT = Path("./data") / "blobs"
+
+
+def blob_path(sha256: str) -> Path:
+    return BLOB_ROOT / sha256[:2] / sha256
+
+
+class SavedFile:
+    """Результат сохранения входящего файла"""
+
+    def __init__(
+        self,
+        path: Path,
+        sha256: str,
+        size: int,
+        remote_path: Optional[str] = None,
+        deduplicated: bool = False,
+    ):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        # Путь на Я.Диске, если файл удалось загрузить в том же проходе
+        self.remote_path = remote_path
+        # True, если такой же файл уже был сохранён и переиспользован
+        self.deduplicated = deduplicated
+
+
+async def find_uploaded_copy(session: AsyncSession, sha256: str) -> Optional[Document]:
+    """Ищет уже выгруженный на Я.Диск документ с тем же содержимым (по индексу sha256)"""
+    result = await session.execute(
+        select(Document).where(
+            Document.sha256 == sha256,
+            Document.yandex_path.isnot(None)
+        ).order_by(Document.id.desc()).limit(1)
+    )
+    return result.scalars().first()
+
+
+async def find_known_file(session: AsyncSession, file_unique_id: str) -> Optional[Tuple[str, bool]]:
+    """(sha256, есть ли копия на Я.Диске) уже сохранённого файла с этим file_unique_id"""
+    sha256 = (await session.execute(
+        select(Document.sha256).where(
+            Document.file_unique_id == file_unique_id,
+            Document.sha256.isnot(None)
+        ).order_by(Document.id.desc()).limit(1)
+    )).scalar()
+    if sha256 is None:
+        return None
+    return sha256, await find_uploaded_copy(session, sha256) is not None
+
+
+async def schedule_remote_upload(
+    session: AsyncSession,
+    upload_queue: UploadQueue,
+    app_id: int,
+    saved: SavedFile,
+    remote_dir: str,
+    filename: str,
+    document_id: int,
+) -> None:
+    """Ставит файл в очередь на Я.Диск: копией на сервере, если такой уже выгружен"""
+    source = await find_uploaded_copy(session, saved.sha256)
+    if source is not None:
+        upload_queue.enqueue_copy(session, app_id, source.yandex_path, remote_dir, filename, document_id=document_id)
+    else:
+        upload_queue.enqueue_upload(session, app_id, str(saved.path), remote_dir, filename, document_id=document_id)
+
+
+async def telegram_chunks(bot: Bot, file_id: str, chunk_size: int) -> AsyncIterator[bytes]:
+    """Отдаёт содержимое файла из Bot API кусками, не буферизуя его целиком"""
+    tg_file = await bot.get_file(file_id)
+    if bot.session.api.is_local:
+        local_path = bot.session.api.wrap_local_file.to_local(tg_file.file_path)
+        with open(local_path, "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        return
+    url = bot.session.api.file_url(bot.token, tg_file.file_path)
+    async for chunk in bot.session.stream_content(url=url, timeout=int(settings.yandex_upload_timeout), chunk_size=chunk_size):
+        yield chunk
+
+
+async def save_telegram_file(
+    bot: Bot,
+    file_id: str,
+    filename: str,
+    remote_dir: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+    cache: Optional["BlobCache"] = None,
+    file_unique_id: Optional[str] = None,
+) -> SavedFile:
+    """Сохраняет файл из Telegram в хранилище blobs за один проход.
+
+    Каждый кусок одновременно хэшируется, пишется во временный файл и, если
+    задан remote_dir, отправляется на Я.Диск. Пиковое потребление памяти
+    ограничено размером куска и небольшой очередью на отправку. Ошибка Диска
+    не прерывает сохранение: remote_path останется пустым, и файл можно
+    догрузить через очередь. Если blob с таким хэшем уже есть, новая копия
+    удаляется и переиспользуется существующая. cache учитывает файл в
+    бюджете локального хранилища.
+
+    Файл, уже сохранённый под тем же file_unique_id, не скачивается и не
+    отправляется заново: переиспользуется его blob, а на Диск его кладёт
+    копия на сервере (schedule_remote_upload).
+    """
+    if file_unique_id:
+        known = await _reuse_known_file(file_unique_id, cache)
+        if known is not None:
+            logger.debug(f"Reused {filename} as {known.path} by file_unique_id {file_unique_id}, nothing transferred")
+            return known
+
+    chunk_size = chunk_size or settings.stream_chunk_size
+    tmp_dir = BLOB_ROOT / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    tmp = tmp_dir / f"{uuid.uuid4().hex}.part"
+
+    remote_path = f"{remote_dir}/{filename}" if remote_dir else None
+    upload_task: Optional[asyncio.Task] = None
+    queue: asyncio.Queue = asyncio.Queue(maxsize=4)
+    if remote_path and settings.yandex_stream_uploads:
+        try:
+            href = await ya.get_client().get_upload_href(remote_path)
+            upload_task = asyncio.create_task(ya.get_client().upload_stream(href, _drain(queue)))
+        except Exception as e:
+            logger.warning(f"Streaming upload to {remote_path} unavailable, will queue: {e}")
+
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp, "wb") as f:
+            async for chunk in telegram_chunks(bot, file_id, chunk_size):
+                hasher.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+                size += len(chunk)
+                if upload_task is not None and not upload_task.done():
+                    await _feed(queue, chunk, upload_task)
+        sha256 = hasher.hexdigest()
+        dest = blob_path(sha256)
+        deduplicated = dest.exists()
+        if deduplicated:
+            tmp.unlink()
+        else:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, dest)
+    except BaseException:
+        if upload_task is not None:
+            upload_task.cancel()
+            # Дожидаемся отмены: закрывается HTTP-запрос и не теряется исключение задачи
+            await asyncio.gather(upload_task, return_exceptions=True)
+        tmp.unlink(missing_ok=True)
+        raise
+
+    uploaded = False
+    if upload_task is not None:
+        if not upload_task.done():
+            await _feed(queue, None, upload_task)
+        try:
+            await upload_task
+            uploaded = True
+        except Exception as e:
+            logger.warning(f"Streaming upload to {remote_path} failed, will queue: {e}")
+
+    if cache is not None:
+        cache.add(sha256, size)
+    logger.debug(f"Saved {filename} as {dest} ({size} bytes, reused: {deduplicated}), streamed to Yandex.Disk: {uploaded}")
+    return SavedFile(dest, sha256, size, remote_path if uploaded else None, deduplicated)
+
+
+async def _reuse_known_file(file_unique_id: str, cache: Optional["BlobCache"]) -> Optional[SavedFile]:
+    """Уже сохранённый файл с этим file_unique_id, если его не нужно скачивать"""
+    async with async_session_scope() as s:
+        known = await find_known_file(s, file_unique_id)
+    if known is None:
+        return None
+    sha256, on_disk = known
+    path = blob_path(sha256)
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        if not on_disk:
+            return None  # ни локальной копии, ни копии на Диске — качаем заново
+        size = 0  # вытеснен из кэша; вернётся с Диска при обращении
+    else:
+        if cache is not None:
+            cache.touch(sha256)
+    return SavedFile(path, sha256, size, deduplicated=True)
+
+
+async def _drain(queue: asyncio.Queue) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await queue.get()
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def _feed(queue: asyncio.Queue, chunk: Optional[bytes], upload_task: asyncio.Task) -> None:
+    """Кладёт кусок в очередь отправки, не зависая, если загрузка уже упала"""
+    put = asyncio.ensure_future(queue.put(chunk))
+    await asyncio.wait({put, upload_task}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
@@ -0,0 +1,293 @@
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Union, TYPE_CHECKING
+
+from sqlalchemy import event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.db.models import UploadJob, Document, Application
+from app.db.repository import async_session_scope
+from app.services import yandex_disk as ya
+from app.services.yandex_disk import YandexDiskError
+from app.config.logging_config import get_logger
+
+if TYPE_CHECKING:
+    from app.services.protocol_renderer import ProtocolRenderer
+
+# Initialize logger
+logger = get_logger(__name__)
+
+JOB_CREATE_FOLDER = "create_folder"
+JOB_UPLOAD = "upload"
+JOB_COPY = "copy"
+JOB_PUBLISH = "publish"
+# Протокол, который не удалось сформировать сразу (рендер занят или упал)
+JOB_RENDER = "render"
+
+
+class UploadQueue:
+    """Персистентная очередь операций с Яндекс.Диском с пулом asyncio-воркеров.
+
+    Задания хранятся в таблице upload_jobs, поэтому переживают перезапуск бота.
+    Неудачные попытки повторяются с экспоненциальной задержкой и джиттером.
+    Задания ставятся в той же сессии (sync или async), что и остальные
+    изменения, и становятся видны воркерам после её коммита.
+    """
+
+    def __init__(
+        self,
+        workers: int = 3,
+        max_attempts: int = 8,
+        retry_base: float = 5.0,
+        retry_cap: float = 600.0,
+        poll_interval: float = 10.0,
+        renderer: Optional["ProtocolRenderer"] = None,
+    ):
+        self.workers = workers
+        self.renderer = renderer
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    # --- постановка заданий ---
+
+    def enqueue_create_folder(self, session: Union[Session, AsyncSession], app_id: int, folder: str) -> UploadJob:
+        return self._enqueue(session, JOB_CREATE_FOLDER, app_id, {"folder": folder})
+
+    def enqueue_upload(
+        self,
+        session: Union[Session, AsyncSession],
+        app_id: int,
+        local_path: str,
+        remote_dir: str,
+        filename: str,
+        document_id: Optional[int] = None,
+    ) -> UploadJob:
+        payload = {"local_path": local_path, "remote_dir": remote_dir, "filename": filename}
+        return self._enqueue(session, JOB_UPLOAD, app_id, payload, document_id=document_id)
+
+    def enqueue_copy(
+        self,
+        session: Union[Session, AsyncSession],
+        app_id: int,
+        from_path: str,
+        remote_dir: str,
+        filename: str,
+        document_id: Optional[int] = None,
+    ) -> UploadJob:
+        payload = {"from_path": from_path, "remote_dir": remote_dir, "filename": filename}
+        return self._enqueue(session, JOB_COPY, app_id, payload, document_id=document_id)
+
+    def enqueue_publish(self, session: Union[Session, AsyncSession], app_id: int, folder: str) -> UploadJob:
+        return self._enqueue(session, JOB_PUBLISH, app_id, {"folder": folder})
+
+    def enqueue_render(self, session: Union[Session, AsyncSession], app_id: int) -> UploadJob:
+        return self._enqueue(session, JOB_RENDER, app_id, {})
+
+    def _enqueue(
+        self,
+        session: Union[Session, AsyncSession],
+        kind: str,
+        app_id: Optional[int],
+        payload: Dict[str, Any],
+        document_id: Optional[int] = None,
+    ) -> UploadJob:
+        job = UploadJob(
+            kind=kind,
+            application_id=app_id,
+            document_id=document_id,
+            payload=json.dumps(payload, ensure_ascii=False),
+            status="pending",
+            next_run_at=datetime.utcnow(),
+        )
+        session.add(job)
+        # Будим воркеров только после коммита, иначе задание ещё не видно
+        target = session.sync_session if isinstance(session, AsyncSession) else session
+        if not event.contains(target, "after_commit", self._after_commit):
+            event.listen(target, "after_commit", self._after_commit, once=True)
+        logger.debug(f"Enqueued {kind} job for app {app_id}")
+        return job
+
+    def _after_commit(self, session: Session) -> None:
+        self.wake()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    # --- жизненный цикл ---
+
+    async def start(self) -> None:
+        """Возвращает прерванные задания в очередь и запускает воркеров"""
+        if self.workers <= 0:
+            # Очередь работает на другом экземпляре; здесь задания только ставятся
+            logger.info("Upload queue workers are disabled on this instance")
+            return
+        async with async_session_scope() as s:
+            reset = (await s.execute(
+                update(UploadJob)
+                .where(UploadJob.status == "running")
+                .values(status="pending", next_run_at=datetime.utcnow())
+            )).rowcount
+        if reset:
+            logger.info(f"Requeued {reset} interrupted upload jobs")
+        self._stopping = False
+        self._tasks = [
+            asyncio.create_task(self._worker(n), name=f"upload-worker-{n}")
+            for n in range(self.workers)
+        ]
+        logger.info(f"Upload queue started with {self.workers} workers")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Останавливает воркеров; незавершённые задания будут повторены после рестарта"""
+        self._stopping = True
+        self.wake()
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        logger.info("Upload queue stopped")
+
+    async def _worker(self, n: int) -> None:
+        while not self._stopping:
+            try:
+                job = await self._claim_next()
+            except Exception as e:
+                logger.error(f"Upload worker {n} failed to claim a job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _claim_next(self) -> Optional[Dict[str, Any]]:
+        """Атомарно забирает ближайшее готовое к выполнению задание"""
+        async with async_session_scope() as s:
+            candidates = (await s.execute(
+                select(UploadJob).where(
+                    UploadJob.status == "pending",
+                    UploadJob.next_run_at <= datetime.utcnow()
+                ).order_by(UploadJob.next_run_at, UploadJob.id).limit(self.workers)
+            )).scalars().all()
+            for job in candidates:
+                snapshot = {
+                    "id": job.id,
+                    "kind": job.kind,
+                    "application_id": job.application_id,
+                    "document_id": job.document_id,
+                    "payload": json.loads(job.payload or "{}"),
+                    "attempts": job.attempts + 1,
+                }
+                claimed = (await s.execute(
+                    update(UploadJob)
+                    .where(UploadJob.id == job.id, UploadJob.status == "pending")
+                    .values(status="running", attempts=snapshot["attempts"])
+                )).rowcount
+                if claimed:
+                    return snapshot
+        return None
+
+    # --- выполнение ---
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        try:
+            result = await self._execute(job)
+        except Exception as e:
+            await self._mark_failed(job, e)
+            return
+        await self._mark_done(job, result)
+
+    async def _execute(self, job: Dict[str, Any]) -> Optional[str]:
+        payload = job["payload"]
+        if job["kind"] == JOB_CREATE_FOLDER:
+            await ya.ensure_folder(payload["folder"])
+            return None
+        if job["kind"] == JOB_UPLOAD:
+            try:
+                await ya.upload_file(payload["remote_dir"], payload["local_path"], payload["filename"])
+            except YandexDiskError as e:
+                # 409 — папки ещё нет: создаём её и пробуем ещё раз
+                if e.status_code != 409:
+                    raise
+                await ya.ensure_folder(payload["remote_dir"])
+                await ya.upload_file(payload["remote_dir"], payload["local_path"], payload["filename"])
+            return f"{payload['remote_dir']}/{payload['filename']}"
+        if job["kind"] == JOB_COPY:
+            remote_path = f"{payload['remote_dir']}/{payload['filename']}"
+            try:
+                await ya.copy(payload["from_path"], remote_path)
+            except YandexDiskError as e:
+                if e.status_code != 409:
+                    raise
+                await ya.ensure_folder(payload["remote_dir"])
+                await ya.copy(payload["from_path"], remote_path)
+            return remote_path
+        if job["kind"] == JOB_PUBLISH:
+            return await ya.get_public_link(payload["folder"])
+        if job["kind"] == JOB_RENDER:
+            from app.services.protocol_builder import build_protocol
+
+            if self.renderer is None:
+                raise RuntimeError("Upload queue has no protocol renderer")
+            # Сам протокол build_protocol поставит на выгрузку отдельным заданием
+            await build_protocol(job["application_id"], self.renderer, self)
+            return None
+        raise ValueError(f"Unknown upload job kind: {job['kind']}")
+
+    async def _mark_done(self, job: Dict[str, Any], result: Optional[str]) -> None:
+        async with async_session_scope() as s:
+            await s.execute(
+                update(UploadJob)
+                .where(UploadJob.id == job["id"])
+                .values(status="done", last_error=None)
+            )
+            if job["kind"] in (JOB_UPLOAD, JOB_COPY) and job["document_id"]:
+                doc = await s.get(Document, job["document_id"])
+                if doc:
+                    doc.yandex_path = result
+            elif job["kind"] == JOB_PUBLISH and job["application_id"]:
+                app = await s.get(Application, job["application_id"])
+                if app and result:
+                    app.yandex_public_url = result
+        logger.info(f"Upload job {job['id']} ({job['kind']}) done for app {job['application_id']}")
+
+    async def _mark_failed(self, job: Dict[str, Any], error: Exception) -> None:
+        attempts = job["attempts"]
+        async with async_session_scope() as s:
+            if attempts >= self.max_attempts:
+                await s.execute(
+                    update(UploadJob)
+                    .where(UploadJob.id == job["id"])
+                    .values(status="failed", last_error=str(error))
+                )
+                logger.error(f"Upload job {job['id']} ({job['kind']}) failed permanently after {attempts} attempts: {error}")
+                return
+            delay = self.retry_delay(attempts)
+            await s.execute(
+                update(UploadJob)
+                .where(UploadJob.id == job["id"])
+                .values(
+                    status="pending",
+                    last_error=str(error),
+                    next_run_at=datetime.utcnow() + timedelta(seconds=delay),
+                )
+            )
+        logger.warning(f"Upload job {job['id']} ({job['kind']}) attempt {attempts} failed, retry in {delay:.0f}s: {error}")
+
+    def retry_delay(self, attempts: int) -> float:
+        """Экспоненциальная задержка с джиттером: половина фиксирована, половина случайна"""
+        delay = min(self.retry_cap, self.retry_base * (2 ** (attempts - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
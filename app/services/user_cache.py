@@ -0,0 +1,118 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Tuple, Union
+
+from sqlalchemy import select
+
+from app.db.models import User, UserRole
+from app.db.repository import async_session_scope
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class UserIdentity:
+    """Снимок пользователя, которого достаточно для проверки доступа"""
+    id: int
+    telegram_id: str
+    full_name: str
+    department_no: Optional[str]
+    role: UserRole
+    is_active: bool
+    is_approved: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserIdentity":
+        return cls(
+            id=user.id,
+            telegram_id=user.telegram_id,
+            full_name=user.full_name,
+            department_no=user.department_no,
+            role=user.role,
+            is_active=bool(user.is_active),
+            is_approved=bool(user.is_approved),
+        )
+
+
+class UserCache:
+    """TTL/LRU-кэш пользователей по telegram_id для middleware доступа.
+
+    Незарегистрированные пользователи тоже кэшируются (как None), поэтому
+    после регистрации, подтверждения или правки профиля запись нужно
+    сбросить через invalidate(). Одновременные промахи по одному ключу
+    ходят в БД один раз.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, Optional[UserIdentity]]]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, telegram_id: Union[int, str]) -> Optional[UserIdentity]:
+        key = str(telegram_id)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            identity = await self._load(key)
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; отмечаем его полученным
+            future.exception()
+            raise
+        else:
+            # Если во время загрузки запись сбросили, результат может быть устаревшим
+            if self._loading.get(key) is future:
+                self._put(key, identity)
+            future.set_result(identity)
+            return identity
+        finally:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+
+    async def _load(self, telegram_id: str) -> Optional[UserIdentity]:
+        async with async_session_scope() as s:
+            user = (await s.execute(select(User).where(User.telegram_id == telegram_id))).scalars().first()
+            return UserIdentity.from_user(user) if user else None
+
+    def _put(self, key: str, identity: Optional[UserIdentity]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, identity)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, telegram_id: Union[int, str]) -> None:
+        """Сбрасывает запись пользователя после изменения его данных"""
+        key = str(telegram_id)
+        self._entries.pop(key, None)
+        self._loading.pop(key, None)
+        logger.debug(f"User cache entry for {key} invalidated")
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._loading.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
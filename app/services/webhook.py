@@ -0,0 +1,245 @@
+"""Получение обновлений через webhook (aiohttp-сервер поверх Dispatcher aiogram).
+
+Telegram присылает каждое обновление POST-запросом на WEBHOOK_PATH с
+заголовком X-Telegram-Bot-Api-Secret-Token. Ответ уходит сразу, а обновление
+обрабатывается в фоне; одновременно — не больше max_concurrent. Когда все
+слоты заняты, следующий запрос ждёт свободного слота, и Telegram (он держит
+не больше max_connections соединений) сам притормаживает доставку.
+
+По умолчанию бот работает одним экземпляром. Несколько экземпляров за
+балансировщиком (webhook на всех один, GET /healthz отдаёт состояние
+экземпляра) возможны только при общем окружении:
+- состояния FSM (анкета, правка и возврат заявки) — в общем хранилище,
+  FSM_STORAGE_URL=redis://…; по умолчанию они в памяти процесса;
+- база — PostgreSQL, а каталог data/ — общий том: задания выгрузки ставит
+  любой экземпляр, а выполняет тот, где работает очередь;
+- кэш пользователей и таблица отделов (DepartmentRouting) живут в памяти
+  процесса и общего владельца не имеют: смена роли на другом экземпляре
+  видна только через USER_CACHE_TTL, новые и переведённые проверяющие
+  попадают в таблицу остальных экземпляров лишь после их перезапуска, а
+  нагрузку проверяющих каждый экземпляр считает сам;
+- очередь выгрузки, резервное копирование и архивация должны работать на
+  одном экземпляре — на остальных UPLOAD_WORKERS=0, BACKUP_ENABLED=0 и
+  ARCHIVE_ENABLED=0. При старте очередь возвращает в работу все задания в
+  статусе running: владельца у них нет, и вторая очередь повторила бы
+  задания, которые ещё выполняет первая.
+"""
+import asyncio
+import secrets
+import signal
+import time
+from typing import Any, Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiohttp import web
+
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+class UpdateHandler:
+    """Обработчик POST-запросов webhook с ограничением числа обновлений в обработке.
+
+    Написан на публичном API aiogram (feed_raw_update, silent_call_request)
+    вместо наследования от SimpleRequestHandler и его приватных методов.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str, max_concurrent: int = 32, **data: Any):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self.data = data
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+        self._closing = False
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_in_flight = 0
+
+    @property
+    def closing(self) -> bool:
+        return self._closing
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def register(self, app: web.Application, path: str) -> None:
+        """Маршрут webhook; сессия бота закрывается последним шагом остановки"""
+        app.router.add_post(path, self.handle)
+        app.on_shutdown.append(self._close)
+
+    async def _close(self, app: web.Application) -> None:
+        await self.bot.session.close()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._closing:
+            # Экземпляр останавливается: Telegram повторит доставку, балансировщик — на другой
+            return web.Response(status=503, text="Shutting down")
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secrets.compare_digest(token, self.secret_token):
+            self.rejected += 1
+            logger.warning(f"Rejected webhook request from {request.remote}: bad secret token")
+            return web.Response(status=401, text="Unauthorized")
+        update = await request.json(loads=self.bot.session.json_loads)
+        # Ждём слота до ответа Telegram — так очередь не растёт в памяти
+        await self._slots.acquire()
+        if self._closing:
+            self._slots.release()
+            return web.Response(status=503, text="Shutting down")
+        self.received += 1
+        task = asyncio.create_task(self._feed_update(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._update_done)
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return web.json_response({}, dumps=self.bot.session.json_dumps)
+
+    async def _feed_update(self, update: Dict[str, Any]) -> None:
+        result = await self.dispatcher.feed_raw_update(bot=self.bot, update=update, **self.data)
+        # Ответ Telegram уже ушёл, поэтому метод, который вернул обработчик, вызываем сами
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+
+    def _update_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._slots.release()
+        if task.cancelled() or task.exception() is not None:
+            self.failed += 1
+            if not task.cancelled():
+                logger.error(f"Webhook update failed: {task.exception()}")
+        else:
+            self.processed += 1
+
+    async def drain(self, timeout: float) -> int:
+        """Перестаёт принимать обновления и ждёт уже принятые; возвращает число брошенных"""
+        self._closing = True
+        pending = set(self._tasks)
+        if not pending:
+            return 0
+        logger.info(f"Waiting for {len(pending)} updates in progress (up to {timeout:.0f}s)")
+        _, not_done = await asyncio.wait(pending, timeout=timeout)
+        for task in not_done:
+            task.cancel()
+        if not_done:
+            logger.warning(f"Cancelled {len(not_done)} updates still running after {timeout:.0f}s")
+        return len(not_done)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_concurrent": self.max_concurrent,
+        }
+
+
+class WebhookServer:
+    """aiohttp-сервер с webhook-обработчиком и порядком остановки для бота.
+
+    При остановке: перестаём принимать обновления, дожидаемся начатых (не
+    дольше shutdown_timeout), затем останавливаем сервисы диспетчера и
+    закрываем сессию бота.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        secret_token: str,
+        path: str = "/webhook",
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        url: Optional[str] = None,
+        max_concurrent: int = 32,
+        max_connections: int = 40,
+        shutdown_timeout: float = 30.0,
+    ):
+        if not secret_token:
+            raise ValueError("Webhook mode requires WEBHOOK_SECRET")
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.host = host
+        self.port = port
+        self.url = url
+        self.max_connections = max_connections
+        self.shutdown_timeout = shutdown_timeout
+        self.handler = UpdateHandler(dispatcher, bot, secret_token, max_concurrent=max_concurrent)
+        self._runner: Optional[web.AppRunner] = None
+        self._started_at = 0.0
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/healthz", self._health)
+        # on_shutdown выполняются по порядку: обновления → сервисы → сессия бота
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._drain)
+        app.on_shutdown.append(self._on_shutdown)
+        self.handler.register(app, path=self.path)
+        return app
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.build_app(), handle_signals=False)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self._started_at = time.monotonic()
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            logger.info(f"Webhook server stopped, updates: {self.handler.stats()}")
+
+    async def run(self) -> None:
+        """Работает до SIGINT/SIGTERM, затем останавливается"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await self.start()
+        try:
+            await stop.wait()
+            logger.info("Shutdown signal received")
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+            await self.stop()
+
+    async def _on_startup(self, app: web.Application) -> None:
+        await self.dispatcher.emit_startup(**self._workflow_data())
+        if self.url:
+            await self.bot.set_webhook(
+                self.url.rstrip("/") + self.path,
+                secret_token=self.secret_token,
+                max_connections=self.max_connections,
+                allowed_updates=self.dispatcher.resolve_used_update_types(),
+            )
+            logger.info(f"Webhook set to {self.url.rstrip('/')}{self.path}")
+
+    async def _drain(self, app: web.Application) -> None:
+        await self.handler.drain(self.shutdown_timeout)
+
+    async def _on_shutdown(self, app: web.Application) -> None:
+        await self.dispatcher.emit_shutdown(**self._workflow_data())
+
+    def _workflow_data(self) -> Dict[str, Any]:
+        # Те же аргументы, что start_polling передаёт обработчикам startup/shutdown
+        return {"bot": self.bot, "bots": [self.bot], "dispatcher": self.dispatcher, **self.dispatcher.workflow_data}
+
+    async def _health(self, request: web.Request) -> web.Response:
+        status = 503 if self.handler.closing else 200
+        return web.json_response(
+            {"uptime": round(time.monotonic() - self._started_at, 1), **self.handler.stats()}, status=status
+        )
@@ -1,43 +1,208 @@
-import os
-import requests
+import asyncio
+from typing import Optional, AsyncIterable, AsyncIterator
+import httpx
+
+from app.config.config import settings
+from app.config.logging_config import get_logger
+
+logger = get_logger(__name__)
 
 YADISK_API_URL = "https://cloud-api.yandex.net/v1/disk"
-YADISK_TOKEN = os.getenv("YANDEX_DISK_TOKEN")  # храним токен в .env
-
-HEADERS = {
-    "Authorization": f"OAuth {YADISK_TOKEN}"
-}
-
-def create_folder(folder_name: str) -> str:
-    """Создаёт папку на Яндекс.Диске и возвращает путь"""
-    url = f"{YADISK_API_URL}/resources"
-    params = {"path": f"app:/{folder_name}"}
-    resp = requests.put(url, headers=HEADERS, params=params)
-    if resp.status_code not in (201, 409):  # 201 — создано, 409 — уже существует
-        raise Exception(f"Ошибка создания папки: {resp.status_code} {resp.text}")
-    return folder_name
-
-def upload_file(folder_path: str, local_path: str, filename: str) -> None:
-    """Загружает файл в указанную папку на Яндекс.Диске"""
-    upload_url = f"{YADISK_API_URL}/resources/upload"
-    params = {"path": f"app:/{folder_path}/{filename}", "overwrite": "true"}
-    resp = requests.get(upload_url, headers=HEADERS, params=params)
-    resp.raise_for_status()
-    href = resp.json()["href"]
 
+
+async def read_file_chunks(local_path: str, chunk_size: int = 256 * 1024) -> AsyncIterator[bytes]:
+    """Читает локальный файл кусками для потоковой отправки"""
     with open(local_path, "rb") as f:
-        upload_resp = requests.put(href, files={"file": f})
-        upload_resp.raise_for_status()
-
-def get_public_link(folder_path: str) -> str:
-    """Делает папку публичной и возвращает ссылку"""
-    url = f"{YADISK_API_URL}/resources/publish"
-    params = {"path": f"app:/{folder_path}"}
-    resp = requests.put(url, headers=HEADERS, params=params)
-    resp.raise_for_status()
-
-    # Получаем публичную ссылку
-    meta_url = f"{YADISK_API_URL}/resources"
-    resp_meta = requests.get(meta_url, headers=HEADERS, params={"path": f"app:/{folder_path}"})
-    resp_meta.raise_for_status()
-    return resp_meta.json().get("public_url")
\ No newline at end of file
+        while True:
+            chunk = await asyncio.to_thread(f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class YandexDiskError(Exception):
+    """Ошибка ответа REST API Яндекс.Диска"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class YandexDiskClient:
+    """Асинхронный клиент Яндекс.Диска поверх одного пула keep-alive соединений"""
+
+    def __init__(
+        self,
+        token: str,
+        timeout: float = 30.0,
+        upload_timeout: float = 300.0,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+    ):
+        self.upload_timeout = upload_timeout
+        self._client = httpx.AsyncClient(
+            base_url=YADISK_API_URL,
+            headers={"Authorization": f"OAuth {token}"},
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+            ),
+        )
+        # Ссылки upload/download ведут на другие хосты — OAuth-токен туда не отправляем
+        self._transfer = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+            ),
+        )
+
+    async def close(self) -> None:
+        await self._client.aclose()
+        await self._transfer.aclose()
+
+    async def create_folder(self, folder_name: str) -> str:
+        """Создаёт папку на Яндекс.Диске и возвращает путь"""
+        resp = await self._client.put("/resources", params={"path": f"app:/{folder_name}"})
+        if resp.status_code not in (201, 409):  # 201 — создано, 409 — уже существует
+            raise YandexDiskError(f"Ошибка создания папки: {resp.status_code} {resp.text}", resp.status_code)
+        return folder_name
+
+    async def ensure_folder(self, folder_path: str) -> str:
+        """Создаёт папку вместе со всеми недостающими родительскими папками"""
+        parts = [p for p in folder_path.split("/") if p]
+        for i in range(1, len(parts) + 1):
+            await self.create_folder("/".join(parts[:i]))
+        return folder_path
+
+    async def get_upload_href(self, remote_path: str, overwrite: bool = True) -> str:
+        """Запрашивает у API ссылку для загрузки файла по пути remote_path"""
+        resp = await self._client.get(
+            "/resources/upload",
+            params={"path": f"app:/{remote_path}", "overwrite": "true" if overwrite else "false"},
+        )
+        if resp.status_code != 200:
+            raise YandexDiskError(f"Ошибка получения ссылки загрузки: {resp.status_code} {resp.text}", resp.status_code)
+        return resp.json()["href"]
+
+    async def upload_stream(self, href: str, chunks: AsyncIterable[bytes]) -> None:
+        """Загружает тело файла по ссылке href, не собирая его целиком в памяти"""
+        upload_resp = await self._transfer.put(href, content=chunks, timeout=self.upload_timeout)
+        if upload_resp.status_code not in (201, 202):
+            raise YandexDiskError(f"Ошибка загрузки файла: {upload_resp.status_code}", upload_resp.status_code)
+
+    async def upload_file(self, folder_path: str, local_path: str, filename: str) -> None:
+        """Загружает файл в указанную папку на Яндекс.Диске"""
+        href = await self.get_upload_href(f"{folder_path}/{filename}")
+        await self.upload_stream(href, read_file_chunks(local_path))
+        logger.debug(f"Uploaded {filename} to {folder_path}")
+
+    async def download_stream(self, remote_path: str, chunk_size: int = 256 * 1024) -> AsyncIterator[bytes]:
+        """Отдаёт содержимое файла с Диска кусками, не собирая его целиком в памяти"""
+        resp = await self._client.get("/resources/download", params={"path": f"app:/{remote_path}"})
+        if resp.status_code != 200:
+            raise YandexDiskError(f"Ошибка получения ссылки скачивания: {resp.status_code} {resp.text}", resp.status_code)
+        href = resp.json()["href"]
+        async with self._transfer.stream("GET", href, timeout=self.upload_timeout, follow_redirects=True) as download:
+            if download.status_code != 200:
+                raise YandexDiskError(f"Ошибка скачивания файла: {download.status_code}", download.status_code)
+            async for chunk in download.aiter_bytes(chunk_size):
+                yield chunk
+
+    async def copy(self, from_path: str, to_path: str, overwrite: bool = True) -> None:
+        """Копирует файл внутри Диска на стороне сервера, без повторной передачи байтов"""
+        resp = await self._client.post(
+            "/resources/copy",
+            params={
+                "from": f"app:/{from_path}",
+                "path": f"app:/{to_path}",
+                "overwrite": "true" if overwrite else "false",
+            },
+        )
+        if resp.status_code == 202:
+            # Крупные файлы копируются асинхронно — ждём завершения операции
+            await self._wait_operation(resp.json()["href"])
+        elif resp.status_code != 201:
+            raise YandexDiskError(f"Ошибка копирования: {resp.status_code} {resp.text}", resp.status_code)
+        logger.debug(f"Copied {from_path} to {to_path}")
+
+    async def _wait_operation(self, href: str, interval: float = 1.0, timeout: Optional[float] = None) -> None:
+        """Ждёт асинхронную операцию Диска не дольше timeout (по умолчанию upload_timeout).
+
+        Зависшая операция не должна навсегда занимать воркер очереди: по
+        таймауту поднимается YandexDiskError, и задание повторяется как обычно.
+        """
+        timeout = self.upload_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            resp = await self._client.get(href)
+            if resp.status_code != 200:
+                raise YandexDiskError(f"Ошибка статуса операции: {resp.status_code} {resp.text}", resp.status_code)
+            status = resp.json().get("status")
+            if status == "success":
+                return
+            if status == "failed":
+                raise YandexDiskError("Операция на Яндекс.Диске завершилась ошибкой")
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise YandexDiskError(f"Операция на Яндекс.Диске не завершилась за {timeout:.0f} с (статус {status})")
+            await asyncio.sleep(min(interval, remaining))
+
+    async def get_public_link(self, folder_path: str) -> Optional[str]:
+        """Делает папку публичной и возвращает ссылку"""
+        params = {"path": f"app:/{folder_path}"}
+        resp = await self._client.put("/resources/publish", params=params)
+        if resp.status_code != 200:
+            raise YandexDiskError(f"Ошибка публикации: {resp.status_code} {resp.text}", resp.status_code)
+
+        # Получаем публичную ссылку
+        resp_meta = await self._client.get("/resources", params=params)
+        if resp_meta.status_code != 200:
+            raise YandexDiskError(f"Ошибка получения метаданных: {resp_meta.status_code} {resp_meta.text}", resp_meta.status_code)
+        return resp_meta.json().get("public_url")
+
+
+_client: Optional[YandexDiskClient] = None
+
+
+def get_client() -> YandexDiskClient:
+    """Возвращает общий для процесса клиент (создаётся при первом обращении)"""
+    global _client
+    if _client is None:
+        _client = YandexDiskClient(
+            settings.yandex_disk_token,
+            timeout=settings.yandex_timeout,
+            upload_timeout=settings.yandex_upload_timeout,
+            max_connections=settings.yandex_max_connections,
+            max_keepalive=settings.yandex_max_keepalive,
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+async def create_folder(folder_name: str) -> str:
+    return await get_client().create_folder(folder_name)
+
+
+async def upload_file(folder_path: str, local_path: str, filename: str) -> None:
+    await get_client().upload_file(folder_path, local_path, filename)
+
+
+async def ensure_folder(folder_path: str) -> str:
+    return await get_client().ensure_folder(folder_path)
+
+
+async def copy(from_path: str, to_path: str) -> None:
+    await get_client().copy(from_path, to_path)
+
+
+async def get_public_link(folder_path: str) -> Optional[str]:
+    return await get_client().get_public_link(folder_path)
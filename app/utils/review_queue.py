@@ -0,0 +1,117 @@
+import html
+from dataclasses import dataclass, replace
+from typing import List, Optional, Tuple, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from app.config.config import settings
+from app.db.models import ApplicationStatus
+from app.db.repository import async_session_scope
+from app.keyboards.common import DEAL_TYPES
+from app.services.application_list import Page, review_queue_page, OLDER, NEWER
+from app.services.user_cache import UserIdentity
+from app.config.logging_config import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Кнопки действий карточки: (подпись с {id}, префикс callback_data)
+Actions = List[Tuple[str, str]]
+
+
+@dataclass(frozen=True)
+class QueueView:
+    """Состояние экрана очереди, которое целиком помещается в callback_data"""
+    direction: str = NEWER
+    cursor: int = 0  # 0 — первая страница
+    mine: bool = False  # только отдел проверяющего
+    deal: int = -1  # индекс в DEAL_TYPES, -1 — все типы
+
+    def pack(self, prefix: str) -> str:
+        return f"{prefix}:{self.direction}:{self.cursor}:{int(self.mine)}:{self.deal}"
+
+    @classmethod
+    def unpack(cls, data: str) -> "QueueView":
+        _, direction, cursor, mine, deal = data.split(":")
+        return cls(direction, int(cursor), mine == "1", int(deal))
+
+    def first_page(self, **changes) -> "QueueView":
+        return replace(self, direction=NEWER, cursor=0, **changes)
+
+
+def render_queue_page(title: str, prefix: str, page: Page, view: QueueView, actions: Actions) -> Tuple[str, InlineKeyboardMarkup]:
+    """Одно сообщение: карточки страницы, кнопки действий, фильтры и навигация"""
+    deal = DEAL_TYPES[view.deal] if 0 <= view.deal < len(DEAL_TYPES) else None
+    text = f"<b>{title}</b>\nОтдел: {'мой' if view.mine else 'все'} · Тип: {html.escape(deal or 'все')}\n"
+    kb = InlineKeyboardBuilder()
+    if not page.items:
+        filtered = view.mine or deal
+        text += "\nНет заявок по выбранным фильтрам." if filtered else "\nНет заявок на проверку."
+    for item in page.items:
+        text += (
+            f"\n<b>#{item.id}</b> {html.escape(item.deal_type or '')}"
+            f"\n🏠 {html.escape(item.address or 'адрес не указан')}"
+            f"\n👤 {html.escape(item.agent_name or 'Не указан')} · {item.created_at:%d.%m %H:%M}"
+        )
+        if item.yandex_public_url:
+            text += f' · <a href="{html.escape(item.yandex_public_url)}">Я.Диск</a>'
+        text += "\n"
+        kb.row(*[
+            InlineKeyboardButton(text=label.format(id=item.id), callback_data=f"{callback}{item.id}")
+            for label, callback in actions
+        ])
+
+    kb.row(
+        InlineKeyboardButton(
+            text="🏢 Отдел: мой" if view.mine else "🏢 Отдел: все",
+            callback_data=view.first_page(mine=not view.mine).pack(prefix),
+        ),
+        InlineKeyboardButton(
+            text=f"🏷 {deal or 'Все типы'}",
+            callback_data=view.first_page(deal=view.deal + 1 if view.deal + 1 < len(DEAL_TYPES) else -1).pack(prefix),
+        ),
+    )
+    nav = []
+    if page.items and page.has_older:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=replace(view, direction=OLDER, cursor=page.items[0].id).pack(prefix)))
+    if page.items and page.has_newer:
+        nav.append(InlineKeyboardButton(text="Дальше ▶️", callback_data=replace(view, direction=NEWER, cursor=page.items[-1].id).pack(prefix)))
+    if nav:
+        kb.row(*nav)
+    return text, kb.as_markup()
+
+
+async def show_queue(
+    target: Union[Message, CallbackQuery],
+    user: UserIdentity,
+    status: ApplicationStatus,
+    title: str,
+    prefix: str,
+    actions: Actions,
+    view: Optional[QueueView] = None,
+) -> None:
+    """Показывает страницу очереди: новым сообщением на команду, правкой — на кнопку"""
+    view = view or QueueView()
+    deal = DEAL_TYPES[view.deal] if 0 <= view.deal < len(DEAL_TYPES) else None
+    async with async_session_scope() as s:
+        page = await review_queue_page(
+            s, status,
+            department_no=user.department_no if view.mine else None,
+            deal_type=deal,
+            cursor=view.cursor or None,
+            direction=view.direction,
+            limit=settings.list_page_size,
+        )
+    text, kb = render_queue_page(title, prefix, page, view, actions)
+    if isinstance(target, CallbackQuery):
+        try:
+            await target.message.edit_text(text, reply_markup=kb, disable_web_page_preview=True)
+        except TelegramBadRequest as e:
+            # Страница не изменилась (повторное нажатие) — это не ошибка
+            if "message is not modified" not in str(e):
+                raise
+        await target.answer()
+    else:
+        await target.answer(text, reply_markup=kb, disable_web_page_preview=True)
@@ -1,35 +1,41 @@
 from aiogram import BaseMiddleware
 from typing import Callable, Dict, Any, Awaitable
-from app.db.repository import session_scope
-from app.db.models import User, UserRole
+from app.db.models import UserRole
+from app.services.user_cache import UserCache
 from app.config.logging_config import get_logger
 
 logger = get_logger(__name__)
 
 
 class AccessGuard(BaseMiddleware):
+    def __init__(self, user_cache: UserCache):
+        super().__init__()
+        self.user_cache = user_cache
+
     async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event, data: Dict[str, Any]):
         tg_id = str(getattr(event.from_user, "id", None))
         if not tg_id:
             return  # нет пользователя — пропускаем или игнорируем
-        with session_scope() as s:
-            user = s.query(User).filter(User.telegram_id == tg_id).first()
-            # Регистрацию пропускаем
-            txt = getattr(event, "text", "") or ""
-            if txt.startswith("/start"):
-                return await handler(event, data)
-            # Блокируем всё остальное, если нет прав
-            if user and (not user.is_active or not user.is_approved):
-                await event.answer("Доступ ограничен. Обратитесь к РОПу для подтверждения регистрации.")
-                logger.warning(f"Access denied for user {tg_id}. Need ROP")
-                return
+        user = await self.user_cache.get(tg_id)
+        # передаем user в data (None — не зарегистрирован)
+        data["user"] = user
+        # Регистрацию пропускаем
+        txt = getattr(event, "text", "") or ""
+        if txt.startswith("/start"):
+            return await handler(event, data)
+        # Блокируем всё остальное, если нет прав
+        if user and (not user.is_active or not user.is_approved):
+            await event.answer("Доступ ограничен. Обратитесь к РОПу для подтверждения регистрации.")
+            logger.warning(f"Access denied for user {tg_id}. Need ROP")
+            return
         return await handler(event, data)
 
 
 class RoleMiddleware(BaseMiddleware):
-    def __init__(self, allowed_roles: list[UserRole]):
+    def __init__(self, allowed_roles: list[UserRole], user_cache: UserCache):
         super().__init__()
         self.allowed_roles = allowed_roles
+        self.user_cache = user_cache
 
     async def __call__(
         self,
@@ -41,20 +47,20 @@ class RoleMiddleware(BaseMiddleware):
         if not tg_id:
             return
 
-        with session_scope() as s:
-            user = s.query(User).filter(User.telegram_id == tg_id).first()
+        # AccessGuard уже положил пользователя в data; иначе берём из кэша
+        user = data["user"] if "user" in data else await self.user_cache.get(tg_id)
 
-            if not user:
-                if hasattr(event, "answer"):
-                    await event.answer("⛔ Вы не зарегистрированы.")
-                return
+        if not user:
+            if hasattr(event, "answer"):
+                await event.answer("⛔ Вы не зарегистрированы.")
+            return
 
-            if user.role not in self.allowed_roles:
-                if hasattr(event, "answer"):
-                    await event.answer("⛔ У вас нет доступа к этой команде.")
-                    logger.warning(f"Higher access denied for user {tg_id}")
-                return
+        if user.role not in self.allowed_roles:
+            if hasattr(event, "answer"):
+                await event.answer("⛔ У вас нет доступа к этой команде.")
+                logger.warning(f"Higher access denied for user {tg_id}")
+            return
 
         # передаем user в data, чтобы хендлер мог его использовать
         data["user"] = user
-        return await handler(event, data)
\ No newline at end of file
+        return await handler(event, data)
@@ -0,0 +1,101 @@
+"""Бенчмарк заполнения протокола.
+
+    python -m benchmarks.bench_protocol --out benchmarks/results/protocol.json
+    python -m benchmarks.bench_protocol --quick
+
+Шаблоны строятся из настоящего protocol_template.docx: от исходных 16 вопросов
+до таблиц на сотни ячеек и тысяч маркеров. Каждый случай выполняется в
+отдельном процессе, чтобы пиковый RSS относился именно к нему.
+"""
+import argparse
+import os
+import tempfile
+from typing import Dict, Any, List, Tuple
+
+from benchmarks.common import measure, quiet_logs, run_isolated, write_results
+from benchmarks.synthetic import make_template
+
+# (имя, строк таблицы, столбцов, абзацев с маркерами)
+SIZES: List[Tuple[str, int, int, int]] = [
+    ("real", 0, 0, 0),
+    ("table_200", 20, 10, 0),
+    ("table_1000_para_1000", 50, 20, 1000),
+]
+QUICK_SIZES = SIZES[:2]
+
+BACKENDS = ["docx", "xml"]
+
+
+def bench_fill(template_path: str, data: Dict[str, Any], backend: str, iterations: int) -> Dict[str, Any]:
+    quiet_logs()
+    from app.services.protocol_filler import fill_protocol, load_template
+
+    load_template(template_path)
+    output = os.path.join(os.path.dirname(template_path), f"out_{backend}.docx")
+
+    def run():
+        if not fill_protocol(template_path, output, data, backend=backend):
+            raise RuntimeError("fill_protocol failed")
+
+    return measure(run, iterations)
+
+
+def bench_compile(template_path: str, iterations: int) -> Dict[str, Any]:
+    quiet_logs()
+    from app.services.protocol_filler import ProtocolTemplate
+
+    return measure(lambda: ProtocolTemplate(template_path), iterations)
+
+
+def bench_replace(template_path: str, data: Dict[str, Any], iterations: int) -> Dict[str, Any]:
+    """replace_placeholders / replace_placeholders_in_tables на уже открытом документе"""
+    quiet_logs()
+    from docx import Document
+    from app.services.protocol_filler import replace_placeholders, replace_placeholders_in_tables
+
+    state = {}
+
+    def setup():
+        doc = Document(template_path)
+        cells = [p for table in doc.tables for row in table.rows for cell in row.cells for p in cell.paragraphs]
+        state["paragraphs"], state["cells"] = doc.paragraphs, cells
+
+    def run():
+        replace_placeholders(state["paragraphs"], data)
+        replace_placeholders_in_tables(state["cells"], data)
+
+    return measure(run, iterations, setup=setup)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк заполнения протокола")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--quick", action="store_true", help="только небольшие шаблоны и меньше итераций")
+    parser.add_argument("--out", help="куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    quiet_logs()
+    sizes = QUICK_SIZES if args.quick else SIZES
+    iterations = min(args.iterations, 10) if args.quick else args.iterations
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-protocol-") as tmp:
+        for name, rows, cols, paragraphs in sizes:
+            template_path, data = make_template(os.path.join(tmp, f"{name}.docx"), rows, cols, paragraphs)
+            meta = {"template": name, "placeholders": len(data), "template_bytes": os.path.getsize(template_path)}
+            # Большие шаблоны гоняем меньше раз, чтобы прогон укладывался в минуты
+            n = max(3, iterations // 5) if paragraphs >= 1000 else iterations
+
+            for backend in BACKENDS:
+                result = run_isolated(bench_fill, template_path, data, backend, n)
+                results.append({"case": f"fill_protocol[{backend}]/{name}", **meta, **result})
+            result = run_isolated(bench_replace, template_path, data, n)
+            results.append({"case": f"replace_placeholders/{name}", **meta, **result})
+            result = run_isolated(bench_compile, template_path, n)
+            results.append({"case": f"compile_template/{name}", **meta, **result})
+
+    write_results(args.out, "protocol", results)
+
+
+if __name__ == "__main__":
+    main()
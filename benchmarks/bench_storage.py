@@ -0,0 +1,116 @@
+"""Бенчмарк сохранения входящих файлов (хэш + запись в хранилище blobs).
+
+    python -m benchmarks.bench_storage --out benchmarks/results/storage.json
+    python -m benchmarks.bench_storage --quick
+
+Файлы от 10 КБ до 100 МБ отдаются через локальный режим Bot API, поэтому
+меряется сам путь save_telegram_file без сети. Загрузка на Я.Диск отключена.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Any, List, Tuple
+
+from benchmarks.common import measure, quiet_logs, run_isolated, write_results
+from benchmarks.synthetic import make_file
+
+KB = 1024
+MB = 1024 * KB
+
+SIZES: List[Tuple[str, int]] = [
+    ("10KB", 10 * KB),
+    ("1MB", MB),
+    ("10MB", 10 * MB),
+    ("100MB", 100 * MB),
+]
+QUICK_SIZES = SIZES[:3]
+
+
+def local_bot(file_path: str):
+    """Минимальный бот в локальном режиме Bot API: get_file отдаёт путь на диске"""
+    from aiogram.client.telegram import TelegramAPIServer
+
+    async def get_file(file_id: str):
+        return SimpleNamespace(file_id=file_id, file_path=file_path)
+
+    api = TelegramAPIServer.from_base("http://localhost:8081", is_local=True)
+    return SimpleNamespace(session=SimpleNamespace(api=api), get_file=get_file, token="bench")
+
+
+def bench_save(source: str, blob_root: str, dedup: bool, iterations: int) -> Dict[str, Any]:
+    quiet_logs()
+    from app.services import storage
+
+    storage.BLOB_ROOT = Path(blob_root)
+    bot = local_bot(source)
+    loop = asyncio.new_event_loop()
+
+    def save():
+        return loop.run_until_complete(storage.save_telegram_file(bot, "bench", os.path.basename(source)))
+
+    def setup():
+        # Без дедупликации каждый прогон пишет blob заново
+        if not dedup:
+            shutil.rmtree(blob_root, ignore_errors=True)
+
+    if dedup:
+        save()
+    try:
+        return measure(save, iterations, setup=setup)
+    finally:
+        loop.close()
+
+
+def bench_hash(source: str, chunk_size: int, iterations: int) -> Dict[str, Any]:
+    """Нижняя граница: только чтение и SHA-256 тем же размером куска"""
+    def run():
+        hasher = hashlib.sha256()
+        with open(source, "rb") as f:
+            while chunk := f.read(chunk_size):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    return measure(run, iterations)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк сохранения файлов")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--quick", action="store_true", help="без 100 МБ и меньше итераций")
+    parser.add_argument("--out", help="куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    quiet_logs()
+    from app.config.config import settings
+
+    settings.yandex_stream_uploads = False
+    chunk_size = settings.stream_chunk_size
+    sizes = QUICK_SIZES if args.quick else SIZES
+    iterations = min(args.iterations, 5) if args.quick else args.iterations
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-storage-") as tmp:
+        for name, size in sizes:
+            source = make_file(os.path.join(tmp, f"{name}.bin"), size)
+            meta = {"size_bytes": size, "chunk_size": chunk_size}
+            n = max(3, iterations // 4) if size >= 100 * MB else iterations
+
+            result = run_isolated(bench_hash, source, chunk_size, n)
+            results.append({"case": f"sha256/{name}", **meta, **result})
+            for dedup in (False, True):
+                blob_root = os.path.join(tmp, f"blobs_{name}_{int(dedup)}")
+                result = run_isolated(bench_save, source, blob_root, dedup, n)
+                label = "save_dedup" if dedup else "save"
+                results.append({"case": f"{label}/{name}", **meta, **result})
+            os.remove(source)
+
+    write_results(args.out, "storage", results)
+
+
+if __name__ == "__main__":
+    main()
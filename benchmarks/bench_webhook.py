@@ -0,0 +1,323 @@
+"""Сквозная задержка обработки обновлений: webhook против polling.
+
+    python -m benchmarks.bench_webhook --out benchmarks/results/webhook.json
+    python -m benchmarks.bench_webhook --updates recorded.jsonl --rate 100 --rtt-ms 60
+    python -m benchmarks.bench_webhook --quick
+
+На localhost поднимается поддельный Bot API, бот (setup_dispatcher из
+app.main) работает против него на временной SQLite. Обновления — записанные
+(JSON Lines или ответ getUpdates целиком) либо синтетические /start и /me
+от разных пользователей — идут с заданной частотой: в режиме webhook
+POST-запросами на WebhookServer бота, в режиме polling через getUpdates.
+Задержка — от появления обновления «в Telegram» до первого ответа бота в
+этот чат. --rtt-ms добавляет сетевую задержку до Telegram: половина — на
+каждый запрос к Bot API и на доставку webhook.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from benchmarks.common import percentile, quiet_logs, run_isolated, write_results
+
+SECRET = "bench-secret"
+TOKEN = "42:bench"
+# Методы Bot API, которые считаются ответом пользователю
+REPLY_METHODS = {"sendmessage", "senddocument", "sendphoto", "editmessagetext", "answercallbackquery"}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def synthetic_updates(count: int, registered_every: int = 2) -> List[Dict[str, Any]]:
+    """/me от зарегистрированных пользователей и /start от новых, по одному обновлению на чат"""
+    now = int(time.time())
+    updates = []
+    for i in range(count):
+        uid = 100000 + i
+        text = "/me" if i % registered_every == 0 else "/start"
+        updates.append({
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": f"User{i}"},
+                "text": text,
+            },
+        })
+    return updates
+
+
+def load_updates(path: str) -> List[Dict[str, Any]]:
+    """Обновления из JSON Lines или из ответа getUpdates ({"ok": true, "result": [...]})"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("{") and '"result"' in text.split("\n", 1)[0]:
+        return json.loads(text)["result"]
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def update_chat(update: Dict[str, Any]) -> Optional[int]:
+    for key in ("message", "edited_message", "callback_query"):
+        event = update.get(key)
+        if event:
+            message = event.get("message", event) if key == "callback_query" else event
+            chat = message.get("chat") or event.get("from")
+            return chat["id"] if chat else None
+    return None
+
+
+class FakeBotAPI:
+    """Минимальный Bot API: отвечает на вызовы бота, раздаёт getUpdates и записывает ответы"""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.replies: Dict[int, Deque[float]] = defaultdict(deque)
+        self.callback_chats: Dict[str, int] = {}
+        self.reply_event = asyncio.Event()
+        self.calls = 0
+        self._message_id = 0
+        self._runner = None
+
+    async def start(self, port: int) -> None:
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        await asyncio.sleep(self.rtt / 2)
+        method = request.match_info["method"].lower()
+        params = dict(await request.post())
+        self.calls += 1
+        result: Any = True
+        if method == "getme":
+            result = {"id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method == "getupdates":
+            result = await self._get_updates(float(params.get("timeout", 0)), int(params.get("limit", 100)))
+        elif method in REPLY_METHODS:
+            chat_id = params.get("chat_id")
+            chat = int(chat_id) if chat_id else self.callback_chats.get(params.get("callback_query_id", ""))
+            if chat is not None:
+                self.replies[chat].append(time.perf_counter())
+                self.reply_event.set()
+            if method != "answercallbackquery":
+                self._message_id += 1
+                result = {
+                    "message_id": self._message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat, "type": "private"},
+                    "text": params.get("text", ""),
+                }
+        await asyncio.sleep(self.rtt / 2)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, timeout: float, limit: int) -> List[Dict[str, Any]]:
+        try:
+            first = await asyncio.wait_for(self.queue.get(), timeout=timeout or 0.001)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        while len(batch) < limit and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+
+def seed_users(updates: List[Dict[str, Any]]) -> None:
+    """Регистрирует отправителей /me, чтобы их обновления проходили весь путь с БД"""
+    from app.db.models import User, UserRole
+    from app.db.repository import session_scope
+
+    with session_scope() as s:
+        for update in updates:
+            message = update.get("message") or {}
+            if message.get("text") == "/me":
+                s.add(User(
+                    telegram_id=str(message["from"]["id"]), full_name=message["from"]["first_name"],
+                    department_no="1", role=UserRole.agent, is_active=True, is_approved=True,
+                ))
+
+
+async def run_mode(mode: str, updates: List[Dict[str, Any]], rate: float, rtt: float, concurrency: int, wait: float) -> Dict[str, Any]:
+    import aiohttp
+    from aiogram import Bot
+    from aiogram.client.bot import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.enums import ParseMode
+    from app.db.repository import init_db
+    from app.main import setup_dispatcher
+    from app.services.webhook import WebhookServer
+
+    # Логгер настраивается при импорте приложения — глушим после импортов
+    quiet_logs("ERROR")
+    init_db()
+    seed_users(updates)
+    api = FakeBotAPI(rtt)
+    api_port = free_port()
+    await api.start(api_port)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{api_port}"))
+    bot = Bot(TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    dp = setup_dispatcher(bot)
+
+    server = polling = client = None
+    if mode == "webhook":
+        port = free_port()
+        server = WebhookServer(dp, bot, SECRET, host="127.0.0.1", port=port, max_concurrent=concurrency)
+        await server.start()
+        client = aiohttp.ClientSession()
+        webhook_url = f"http://127.0.0.1:{port}/webhook"
+    else:
+        polling = asyncio.create_task(dp.start_polling(
+            bot, handle_signals=False, close_bot_session=False, tasks_concurrency_limit=concurrency,
+        ))
+        # Дождаться первого getUpdates, чтобы старт поллинга не попал в замер
+        while api.calls < 2:
+            await asyncio.sleep(0.01)
+
+    sent: Dict[int, Deque[float]] = defaultdict(deque)
+    latencies: List[float] = []
+    deliveries = []
+    errors = 0
+
+    async def deliver(update: Dict[str, Any]) -> None:
+        nonlocal errors
+        if mode == "webhook":
+            await asyncio.sleep(rtt / 2)
+            async with client.post(webhook_url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as resp:
+                if resp.status != 200:
+                    errors += 1
+        else:
+            api.queue.put_nowait(update)
+
+    started = time.perf_counter()
+    for i, update in enumerate(updates):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        chat = update_chat(update)
+        if "callback_query" in update:
+            api.callback_chats[update["callback_query"]["id"]] = chat
+        if chat is not None:
+            sent[chat].append(time.perf_counter())
+        deliveries.append(asyncio.create_task(deliver(update)))
+    await asyncio.gather(*deliveries)
+
+    # Ответ сопоставляется с самым ранним неотвеченным обновлением того же чата
+    deadline = time.perf_counter() + wait
+    while time.perf_counter() < deadline:
+        for chat, replies in api.replies.items():
+            while replies and sent[chat]:
+                sent_at = sent[chat].popleft()
+                latencies.append(replies.popleft() - sent_at)
+            replies.clear()
+        if not any(sent.values()):
+            break
+        api.reply_event.clear()
+        try:
+            await asyncio.wait_for(api.reply_event.wait(), timeout=max(0.0, deadline - time.perf_counter()))
+        except asyncio.TimeoutError:
+            break
+    elapsed = time.perf_counter() - started
+
+    handler_stats = server.handler.stats() if server else None
+    if server:
+        await client.close()
+        await server.stop()
+    else:
+        await dp.stop_polling()
+        await polling
+        # Поллинг не ждёт начатых обработчиков: даём им дописать в Bot API
+        calls = -1
+        while calls != api.calls:
+            calls = api.calls
+            await asyncio.sleep(0.2 + rtt)
+        await bot.session.close()
+    await api.stop()
+
+    ms = [t * 1000 for t in latencies]
+    result = {
+        "updates": len(updates),
+        "answered": len(latencies),
+        "unanswered": sum(len(q) for q in sent.values()),
+        "delivery_errors": errors,
+        "seconds": round(elapsed, 3),
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p90_ms": round(percentile(ms, 90), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "max_ms": round(max(ms), 3) if ms else 0.0,
+        "api_calls": api.calls,
+    }
+    if handler_stats:
+        result["webhook"] = handler_stats
+    return result
+
+
+def bench_mode(mode: str, updates: List[Dict[str, Any]], rate: float, rtt_ms: float, concurrency: int, wait: float) -> Dict[str, Any]:
+    return asyncio.run(run_mode(mode, updates, rate, rtt_ms / 1000, concurrency, wait))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Задержка обработки обновлений: webhook и polling")
+    parser.add_argument("--updates", help="записанные обновления (JSON Lines или ответ getUpdates); по умолчанию синтетические")
+    parser.add_argument("--count", type=int, default=500, help="сколько синтетических обновлений")
+    parser.add_argument("--rate", type=float, action="append", help="обновлений в секунду (можно несколько раз)")
+    parser.add_argument("--rtt-ms", type=float, action="append", help="сетевая задержка до Telegram, мс (можно несколько раз)")
+    parser.add_argument("--concurrency", type=int, default=32, help="UPDATES_CONCURRENCY бота")
+    parser.add_argument("--mode", choices=["webhook", "polling"], action="append", help="по умолчанию оба")
+    parser.add_argument("--wait", type=float, default=30.0, help="сколько ждать ответов после последнего обновления, сек")
+    parser.add_argument("--quick", action="store_true", help="100 обновлений, без сетевой задержки")
+    parser.add_argument("--out", help="куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(100 if args.quick else args.count)
+    rates = args.rate or ([50.0] if args.quick else [50.0, 200.0])
+    rtts = args.rtt_ms or ([0.0] if args.quick else [0.0, 60.0])
+    modes = args.mode or ["polling", "webhook"]
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-webhook-") as tmp:
+        # Окружение бота для дочерних процессов: своя база, без фоновых заданий
+        os.environ.update({
+            "BOT_TOKEN": TOKEN,
+            "RENDER_WORKERS": "1",
+            "BACKUP_ENABLED": "0",
+            "ARCHIVE_ENABLED": "0",
+            "UPLOAD_POLL_INTERVAL": "60",
+        })
+        for rtt in rtts:
+            for rate in rates:
+                for mode in modes:
+                    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, f'{mode}-{rtt:g}-{rate:g}.db')}"
+                    result = run_isolated(bench_mode, mode, updates, rate, rtt, args.concurrency, args.wait)
+                    case = f"{mode}/rtt_{rtt:g}ms/rate_{rate:g}"
+                    results.append({"case": case, **result})
+                    if "error" not in result:
+                        print(f"{case:<32} answered {result['answered']}/{result['updates']}, "
+                              f"p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms")
+
+    write_results(args.out, "webhook", results)
+
+
+if __name__ == "__main__":
+    main()
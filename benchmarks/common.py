@@ -0,0 +1,156 @@
+"""Общие утилиты бенчмарков: замер задержек, аллокаций, пикового RSS и запись JSON"""
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional
+
+
+def quiet_logs(level: str = "WARNING") -> None:
+    """Глушит информационные логи приложения, чтобы они не влияли на замеры"""
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level=level)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль с линейной интерполяцией, q в диапазоне 0..100"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def peak_rss_kb() -> int:
+    """Пиковый RSS текущего процесса в КБ"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # На macOS ru_maxrss в байтах, на Linux — в килобайтах
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def measure(
+    fn: Callable[[], Any],
+    iterations: int,
+    warmup: int = 1,
+    setup: Optional[Callable[[], Any]] = None,
+) -> Dict[str, Any]:
+    """Прогоняет fn несколько раз и возвращает перцентили задержки и аллокации.
+
+    Время меряется без tracemalloc; аллокации — отдельным прогоном под ним.
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+
+    timings = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    fn()
+    after = tracemalloc.take_snapshot()
+    _, alloc_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    allocated_blocks = sum(max(s.count_diff, 0) for s in stats)
+    retained = sum(s.size_diff for s in stats)
+
+    ms = [t * 1000 for t in timings]
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p90_ms": round(percentile(ms, 90), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "min_ms": round(min(ms), 3),
+        "max_ms": round(max(ms), 3),
+        "alloc_peak_kb": round(alloc_peak / 1024, 1),
+        "retained_kb": round(retained / 1024, 1),
+        "retained_blocks": allocated_blocks,
+    }
+
+
+def _run_case(target: Callable[..., Dict[str, Any]], args: tuple, conn) -> None:
+    try:
+        result = target(*args)
+        result["peak_rss_kb"] = peak_rss_kb()
+        conn.send(result)
+    except BaseException as e:  # noqa: BLE001 - ошибку передаём в родительский процесс
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_isolated(target: Callable[..., Dict[str, Any]], *args) -> Dict[str, Any]:
+    """Выполняет случай в отдельном процессе, чтобы пиковый RSS не копился между случаями"""
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_case, args=(target, args, child))
+    proc.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {"error": f"benchmark process exited with code {proc.exitcode}"}
+    proc.join()
+    return result
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(path: Optional[str], suite: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Печатает таблицу результатов и, если задан path, сохраняет их в JSON"""
+    report = {"suite": suite, "env": environment(), "results": results}
+    for r in results:
+        if "error" in r:
+            print(f"{r['case']:<44} ERROR {r['error']}")
+            continue
+        line = f"{r['case']:<44} p50 {r['p50_ms']:>9.2f} ms  p90 {r['p90_ms']:>9.2f} ms  p99 {r['p99_ms']:>9.2f} ms"
+        if "alloc_peak_kb" in r:
+            line += f"  alloc {r['alloc_peak_kb']:>9.1f} KB"
+        print(f"{line}  rss {r['peak_rss_kb'] / 1024:>7.1f} MB")
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Results saved to {path}")
+    return report
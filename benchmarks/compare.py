@@ -0,0 +1,60 @@
+"""Сравнение двух прогонов бенчмарка.
+
+    python -m benchmarks.compare old.json new.json [--threshold 10] [--metric p50_ms]
+
+Печатает изменение метрик по каждому случаю и завершается с кодом 1, если
+хотя бы одна метрика ухудшилась больше чем на threshold процентов.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Any, List
+
+METRICS = ["p50_ms", "p90_ms", "alloc_peak_kb", "peak_rss_kb"]
+
+
+def load(path: str) -> Dict[str, Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    return {r["case"]: r for r in report["results"] if "error" not in r}
+
+
+def compare(old: Dict[str, Dict[str, Any]], new: Dict[str, Dict[str, Any]], metrics: List[str], threshold: float) -> int:
+    regressions = 0
+    print(f"{'case':<44} " + " ".join(f"{m:>22}" for m in metrics))
+    for case in sorted(old.keys() | new.keys()):
+        if case not in old or case not in new:
+            print(f"{case:<44} {'only in ' + ('new' if case in new else 'old'):>22}")
+            continue
+        cells = []
+        for metric in metrics:
+            before, after = old[case].get(metric), new[case].get(metric)
+            if not before or after is None:
+                cells.append(f"{'-':>22}")
+                continue
+            change = (after - before) / before * 100
+            mark = " !" if change > threshold else "  "
+            if change > threshold:
+                regressions += 1
+            cells.append(f"{before:>8.1f} -> {after:>8.1f}{mark}".rjust(22))
+        print(f"{case:<44} " + " ".join(cells))
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сравнить два JSON-отчёта бенчмарка")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимое ухудшение, %%")
+    parser.add_argument("--metric", action="append", choices=METRICS, help="какие метрики сравнивать")
+    args = parser.parse_args()
+
+    regressions = compare(load(args.old), load(args.new), args.metric or METRICS, args.threshold)
+    if regressions:
+        print(f"{regressions} metric(s) regressed by more than {args.threshold:.0f}%")
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
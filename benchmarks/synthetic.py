@@ -0,0 +1,59 @@
+"""Генерация синтетических входных данных: шаблоны протокола и файлы документов"""
+import os
+from typing import Dict, Any, Tuple
+
+from docx import Document
+
+from app.services.protocol_filler import DEFAULT_TEMPLATE_PATH, load_template
+
+
+def real_data(template_path: str = DEFAULT_TEMPLATE_PATH) -> Dict[str, Any]:
+    """data_dict для всех маркеров настоящего шаблона"""
+    return {key: f"Значение поля {key}" for key in load_template(template_path).placeholders}
+
+
+def make_template(
+    output_path: str,
+    table_rows: int,
+    table_cols: int,
+    paragraphs: int,
+    base_template: str = DEFAULT_TEMPLATE_PATH,
+) -> Tuple[str, Dict[str, Any]]:
+    """Дополняет настоящий шаблон таблицей и абзацами с маркерами.
+
+    Каждая ячейка таблицы содержит маркер {{cR_C}}; каждый абзац — два маркера,
+    причём второй разрезан между run-ами, как это делает Word при правке.
+    Возвращает путь к шаблону и data_dict, покрывающий все маркеры.
+    """
+    doc = Document(base_template)
+    data = real_data(base_template)
+
+    if table_rows and table_cols:
+        table = doc.add_table(rows=table_rows, cols=table_cols)
+        for r, row in enumerate(table.rows):
+            for c, cell in enumerate(row.cells):
+                key = f"c{r}_{c}"
+                cell.text = f"{{{{{key}}}}}"
+                data[key] = f"ячейка {r}:{c}"
+
+    for n in range(paragraphs):
+        first, second = f"p{n}_a", f"p{n}_b"
+        p = doc.add_paragraph(f"Пункт {n}: {{{{{first}}}}}, уточнение {{{{")
+        p.add_run(second[:2])
+        p.add_run(second[2:] + "}}.")
+        data[first] = f"ответ на пункт {n}"
+        data[second] = f"уточнение к пункту {n}"
+
+    doc.save(output_path)
+    return output_path, data
+
+
+def make_file(output_path: str, size: int, block: int = 1024 * 1024) -> str:
+    """Создаёт файл заданного размера со случайным (несжимаемым) содержимым"""
+    with open(output_path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            n = min(block, remaining)
+            f.write(os.urandom(n))
+            remaining -= n
+    return output_path
@@ -0,0 +1,20 @@
+"""Общие настройки тестов: своё окружение и своя база до импорта приложения"""
+import os
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix="doc-flow-tests-")
+os.environ["BOT_TOKEN"] = "1:test"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'app.db')}"
+os.environ["YANDEX_DISK_TOKEN"] = "test"
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    """Отдельный файл SQLite на тест"""
+    from sqlalchemy import create_engine
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    yield engine
+    engine.dispose()
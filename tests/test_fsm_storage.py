@@ -0,0 +1,18 @@
+import sys
+
+import pytest
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.main import create_fsm_storage
+
+
+def test_memory_storage_by_default():
+    assert isinstance(create_fsm_storage(""), MemoryStorage)
+
+
+def test_redis_storage_requires_redis_package(monkeypatch):
+    # Без пакета redis бот не должен молча откатываться на память процесса
+    monkeypatch.setitem(sys.modules, "redis", None)
+    monkeypatch.delitem(sys.modules, "aiogram.fsm.storage.redis", raising=False)
+    with pytest.raises(RuntimeError, match="redis"):
+        create_fsm_storage("redis://localhost:6379/0")
@@ -0,0 +1,195 @@
+"""Миграции на пустой и на старой базе и планы горячих запросов (EXPLAIN QUERY PLAN)"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import inspect, text
+
+from app.db.base import Base
+from app.db import models  # noqa: F401 - регистрирует модели в Base.metadata
+from app.db.migrations import migrate, latest_version, current_version, check_query_plans, hot_queries
+
+# Схема, которую создавал init_db до появления миграций (create_all по исходным моделям)
+LEGACY_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER NOT NULL PRIMARY KEY,
+        telegram_id VARCHAR NOT NULL UNIQUE,
+        full_name VARCHAR NOT NULL,
+        department_no VARCHAR,
+        role VARCHAR(6) NOT NULL,
+        created_at DATETIME,
+        is_active BOOLEAN,
+        is_approved BOOLEAN
+    )""",
+    """CREATE TABLE applications (
+        id INTEGER NOT NULL PRIMARY KEY,
+        agent_id INTEGER REFERENCES users (id),
+        rop_id INTEGER REFERENCES users (id),
+        lawyer_id INTEGER REFERENCES users (id),
+        deal_type VARCHAR NOT NULL,
+        contract_no VARCHAR,
+        protocol_date VARCHAR,
+        address VARCHAR,
+        object_type VARCHAR,
+        head_name VARCHAR,
+        agent_name VARCHAR,
+        yandex_folder VARCHAR,
+        yandex_public_url VARCHAR,
+        status VARCHAR(12),
+        created_at DATETIME,
+        updated_at DATETIME
+    )""",
+    """CREATE TABLE questionnaire_answers (
+        id INTEGER NOT NULL PRIMARY KEY,
+        application_id INTEGER NOT NULL REFERENCES applications (id),
+        question_key VARCHAR NOT NULL,
+        answer_value VARCHAR NOT NULL,
+        created_at DATETIME
+    )""",
+    """CREATE TABLE documents (
+        id INTEGER NOT NULL PRIMARY KEY,
+        application_id INTEGER NOT NULL REFERENCES applications (id),
+        doc_type VARCHAR NOT NULL,
+        file_name VARCHAR NOT NULL,
+        local_path VARCHAR NOT NULL,
+        yandex_path VARCHAR,
+        sha256 VARCHAR,
+        meta TEXT,
+        uploaded_at DATETIME
+    )""",
+    """CREATE TABLE tasks (
+        id INTEGER NOT NULL PRIMARY KEY,
+        application_id INTEGER NOT NULL REFERENCES applications (id),
+        author_id INTEGER NOT NULL REFERENCES users (id),
+        assignee_id INTEGER NOT NULL REFERENCES users (id),
+        text TEXT NOT NULL,
+        status VARCHAR(20),
+        created_at DATETIME,
+        closed_at DATETIME
+    )""",
+    "CREATE INDEX idx_application_status ON applications (status)",
+    "CREATE INDEX idx_document_application ON documents (application_id)",
+    "CREATE INDEX idx_task_application ON tasks (application_id)",
+    "CREATE INDEX idx_task_assignee ON tasks (assignee_id)",
+]
+
+
+def _create_legacy_database(engine, applications: int = 300) -> None:
+    now = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text(
+            "INSERT INTO users (id, telegram_id, full_name, department_no, role, is_active, is_approved) "
+            "VALUES (1, '100', 'Агент', '1', 'agent', 1, 1), (2, '200', 'РОП', '1', 'rop', 1, 1)"
+        ))
+        conn.execute(
+            text(
+                "INSERT INTO applications (id, agent_id, rop_id, deal_type, address, agent_name, status, created_at, updated_at) "
+                "VALUES (:id, 1, 2, 'Продажа', :address, 'Агент', :status, :created, :created)"
+            ),
+            [
+                {
+                    "id": i,
+                    "address": f"г Тверь, ул Тверская, д {i}",
+                    "status": "created" if i % 2 else "closed",
+                    "created": now + timedelta(minutes=i),
+                }
+                for i in range(1, applications + 1)
+            ],
+        )
+        conn.execute(
+            text(
+                "INSERT INTO questionnaire_answers (application_id, question_key, answer_value, created_at) "
+                "VALUES (:app, :key, :value, :created)"
+            ),
+            [
+                {"app": i, "key": key, "value": f"{key}-{i}", "created": now}
+                for i in range(1, applications + 1) for key in ("q1", "q2")
+            ],
+        )
+        conn.execute(
+            text(
+                "INSERT INTO tasks (application_id, author_id, assignee_id, text, status, created_at) "
+                "VALUES (:app, 2, 1, 'Донести документы', 'open', :created)"
+            ),
+            [{"app": i, "created": now} for i in range(1, applications + 1, 3)],
+        )
+
+
+def _assert_matches_models(engine) -> None:
+    """После миграций в базе есть все таблицы, колонки и индексы моделей"""
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        assert table.name in tables, f"table {table.name} is missing"
+        columns = {c["name"] for c in inspector.get_columns(table.name)}
+        missing = {c.name for c in table.columns} - columns
+        assert not missing, f"{table.name} lacks columns {missing}"
+        indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        missing = {i.name for i in table.indexes} - indexes
+        assert not missing, f"{table.name} lacks indexes {missing}"
+
+
+def _assert_plans(engine) -> None:
+    results = check_query_plans(engine)
+    assert [r["query"] for r in results] == [name for name, _, _ in hot_queries()]
+    for result in results:
+        assert result["ok"], f"{result['query']} does not use {result['index']}: {result['plan']}"
+
+
+def test_fresh_database(sqlite_engine):
+    applied = migrate(sqlite_engine)
+
+    assert applied == list(range(1, latest_version() + 1))
+    _assert_matches_models(sqlite_engine)
+    _assert_plans(sqlite_engine)
+
+
+def test_legacy_database_with_data(sqlite_engine):
+    _create_legacy_database(sqlite_engine)
+
+    migrate(sqlite_engine)
+
+    _assert_matches_models(sqlite_engine)
+    _assert_plans(sqlite_engine)
+    inspector = inspect(sqlite_engine)
+    indexes = {i["name"] for i in inspector.get_indexes("applications")}
+    assert "idx_application_status" not in indexes
+    with sqlite_engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM applications")).scalar() == 300
+        assert conn.execute(text("SELECT count(*) FROM application_answers")).scalar() == 300
+        answers = conn.execute(text("SELECT answers FROM application_answers WHERE application_id = 7")).scalar()
+        assert "q2-7" in answers
+
+
+def test_migrate_is_repeatable(sqlite_engine):
+    migrate(sqlite_engine)
+
+    assert migrate(sqlite_engine) == []
+    with sqlite_engine.begin() as conn:
+        assert current_version(conn) == latest_version()
+
+
+@pytest.mark.parametrize("target", [1, 2, 3, 5])
+def test_partial_then_full_upgrade(sqlite_engine, target):
+    """Старая база, остановленная на промежуточной версии, доходит до последней"""
+    _create_legacy_database(sqlite_engine, applications=20)
+    assert migrate(sqlite_engine, target) == list(range(1, target + 1))
+
+    migrate(sqlite_engine)
+
+    _assert_matches_models(sqlite_engine)
+    _assert_plans(sqlite_engine)
+
+
+def test_old_migrations_do_not_follow_models(sqlite_engine):
+    """Миграция 5 создаёт архив без колонок, добавленных позже (file_unique_id — миграция 6)"""
+    migrate(sqlite_engine, 5)
+
+    columns = {c["name"] for c in inspect(sqlite_engine).get_columns("archive_documents")}
+    assert "file_unique_id" not in columns
+
+    migrate(sqlite_engine)
+
+    columns = {c["name"] for c in inspect(sqlite_engine).get_columns("archive_documents")}
+    assert "file_unique_id" in columns
@@ -0,0 +1,127 @@
+"""Сборка протокола: пропуск неизменившегося и отложенный рендер через очередь"""
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import select, delete, update
+
+from app.db.base import engine
+from app.db.migrations import migrate
+from app.db.models import Application, UploadJob
+from app.db.repository import session_scope
+from app.services import protocol_builder
+from app.services.protocol_builder import build_protocol_or_defer
+from app.services.protocol_filler import DEFAULT_TEMPLATE_PATH
+from app.services.protocol_renderer import RenderQueueFull
+from app.services.upload_queue import UploadQueue, JOB_RENDER, JOB_UPLOAD
+
+
+class FakeRenderer:
+    template_path = DEFAULT_TEMPLATE_PATH
+
+    def __init__(self, busy: bool = False):
+        self.busy = busy
+        self.rendered = []
+
+    async def render(self, data, output_path):
+        if self.busy:
+            raise RenderQueueFull("Render queue is full (32 waiting)")
+        with open(output_path, "wb") as f:
+            f.write(b"docx")
+        self.rendered.append(output_path)
+        return output_path
+
+
+@pytest.fixture
+def app_id(tmp_path, monkeypatch):
+    migrate(engine)
+    monkeypatch.setattr(protocol_builder, "protocol_path", lambda app_id: str(tmp_path / f"{app_id}.docx"))
+    with session_scope() as s:
+        # Очередь общая для всей тестовой базы — начинаем с пустой
+        s.execute(delete(UploadJob))
+        app = Application(deal_type="Продажа", address="г Тверь", yandex_folder="apps/protocol")
+        s.add(app)
+        s.flush()
+        return app.id
+
+
+def _jobs(app_id):
+    with session_scope() as s:
+        return [(job.kind, job.status) for job in s.scalars(select(UploadJob).where(UploadJob.application_id == app_id).order_by(UploadJob.id))]
+
+
+def test_busy_renderer_parks_render_job(app_id):
+    queue = UploadQueue()
+
+    assert asyncio.run(build_protocol_or_defer(app_id, FakeRenderer(busy=True), queue)) is None
+    assert asyncio.run(build_protocol_or_defer(app_id, FakeRenderer(busy=True), queue)) is None
+
+    assert _jobs(app_id) == [(JOB_RENDER, "pending")]
+
+
+def test_render_job_builds_and_uploads(app_id):
+    renderer = FakeRenderer()
+    queue = UploadQueue(renderer=renderer)
+    asyncio.run(build_protocol_or_defer(app_id, FakeRenderer(busy=True), queue))
+
+    async def run_queue():
+        job = await queue._claim_next()
+        await queue._run(job)
+
+    asyncio.run(run_queue())
+
+    assert len(renderer.rendered) == 1
+    assert _jobs(app_id) == [(JOB_RENDER, "done"), (JOB_UPLOAD, "pending")]
+
+
+def _build(app_id, renderer, queue):
+    return asyncio.run(protocol_builder.build_protocol(app_id, renderer, queue))
+
+
+def _set_upload_status(app_id, status):
+    with session_scope() as s:
+        s.execute(update(UploadJob).where(UploadJob.application_id == app_id, UploadJob.kind == JOB_UPLOAD).values(status=status))
+
+
+def test_unchanged_protocol_is_skipped(app_id):
+    renderer, queue = FakeRenderer(), UploadQueue()
+    assert _build(app_id, renderer, queue) is True
+    _set_upload_status(app_id, "done")
+
+    assert _build(app_id, renderer, queue) is False
+    assert len(renderer.rendered) == 1
+    assert _jobs(app_id) == [(JOB_UPLOAD, "done")]
+
+
+def test_failed_upload_is_queued_again(app_id):
+    renderer, queue = FakeRenderer(), UploadQueue()
+    _build(app_id, renderer, queue)
+    _set_upload_status(app_id, "failed")
+
+    assert _build(app_id, renderer, queue) is False
+    assert len(renderer.rendered) == 1
+    assert _jobs(app_id) == [(JOB_UPLOAD, "failed"), (JOB_UPLOAD, "pending")]
+
+
+def test_missing_output_is_rendered_again(app_id):
+    renderer, queue = FakeRenderer(), UploadQueue()
+    _build(app_id, renderer, queue)
+    _set_upload_status(app_id, "done")
+    os.remove(renderer.rendered[0])
+
+    assert _build(app_id, renderer, queue) is True
+    assert len(renderer.rendered) == 2
+    assert _jobs(app_id) == [(JOB_UPLOAD, "done"), (JOB_UPLOAD, "pending")]
+
+
+def test_queue_without_workers_leaves_running_jobs(app_id):
+    """UPLOAD_WORKERS=0: экземпляр не трогает задания, которые выполняет очередь другого экземпляра"""
+    asyncio.run(build_protocol_or_defer(app_id, FakeRenderer(busy=True), UploadQueue()))
+    with session_scope() as s:
+        s.execute(update(UploadJob).where(UploadJob.application_id == app_id).values(status="running"))
+
+    queue = UploadQueue(workers=0)
+    asyncio.run(queue.start())
+    asyncio.run(queue.stop())
+
+    assert _jobs(app_id) == [(JOB_RENDER, "running")]
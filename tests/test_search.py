@@ -0,0 +1,45 @@
+"""/find: кириллица без учёта регистра на FTS5 и на запасном LIKE"""
+import asyncio
+
+import pytest
+
+from app.db.base import engine
+from app.db.migrations import migrate
+from app.db.models import Application, UserRole
+from app.db.repository import session_scope, async_session_scope
+from app.services import search
+from app.services.user_cache import UserIdentity
+
+ADMIN = UserIdentity(1, "1", "Админ", None, UserRole.admin, True, True)
+
+
+@pytest.fixture(scope="module")
+def app_id():
+    migrate(engine)
+    with session_scope() as s:
+        app = Application(deal_type="Продажа", contract_no="ДК-7731", address="г Тверь, ул Тверская, д 5", agent_name="Иванова")
+        s.add(app)
+        s.flush()
+        return app.id
+
+
+def _find(query):
+    async def run():
+        async with async_session_scope() as s:
+            return [hit.id for hit in await search.search_applications(s, query, ADMIN)]
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("backend", ["fts5", "sqlite_like"])
+@pytest.mark.parametrize("query", ["твер", "ТВЕРСКАЯ", "Тверская 5", "иванова", "дк 7731"])
+def test_cyrillic_query_matches(app_id, monkeypatch, backend, query):
+    monkeypatch.setattr(search, "_backend_name", backend)
+
+    assert app_id in _find(query)
+
+
+@pytest.mark.parametrize("backend", ["fts5", "sqlite_like"])
+def test_all_terms_must_match(app_id, monkeypatch, backend):
+    monkeypatch.setattr(search, "_backend_name", backend)
+
+    assert app_id not in _find("тверская москва")
@@ -0,0 +1,143 @@
+"""Повторно присланный файл: без скачивания из Telegram и без загрузки на Я.Диск"""
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from app.db.base import engine
+from app.db.migrations import migrate
+from app.db.models import Application, Document, UploadJob
+from app.db.repository import session_scope
+from app.routers import agent
+from app.services import storage
+from app.services.upload_queue import UploadQueue, JOB_COPY
+
+CONTENT = b"%PDF-1.4 passport scan" * 1000
+
+
+class FakeDisk:
+    def __init__(self):
+        self.uploads = []
+
+    async def get_upload_href(self, remote_path):
+        return f"https://uploader.example/{remote_path}"
+
+    async def upload_stream(self, href, chunks):
+        body = b"".join([chunk async for chunk in chunks])
+        self.uploads.append((href, len(body)))
+
+
+class FakeState:
+    def __init__(self, data):
+        self.data = data
+
+    async def get_data(self):
+        return self.data
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    migrate(engine)
+    downloads = []
+
+    async def telegram_chunks(bot, file_id, chunk_size):
+        downloads.append(file_id)
+        for start in range(0, len(CONTENT), chunk_size):
+            yield CONTENT[start:start + chunk_size]
+
+    disk = FakeDisk()
+    monkeypatch.setattr(storage, "BLOB_ROOT", tmp_path / "blobs")
+    monkeypatch.setattr(storage, "telegram_chunks", telegram_chunks)
+    monkeypatch.setattr(storage.ya, "get_client", lambda: disk)
+    monkeypatch.setattr(storage.settings, "yandex_stream_uploads", True)
+    return SimpleNamespace(downloads=downloads, disk=disk)
+
+
+def _application(folder: str) -> int:
+    with session_scope() as s:
+        app = Application(deal_type="Продажа", yandex_folder=folder)
+        s.add(app)
+        s.flush()
+        return app.id
+
+
+def _send(app_id: int, file_unique_id: str, file_id: str) -> None:
+    replies = []
+
+    async def answer(text, **kwargs):
+        replies.append(text)
+
+    message = SimpleNamespace(
+        bot=None,
+        document=SimpleNamespace(file_id=file_id, file_unique_id=file_unique_id, file_name="passport.pdf", file_size=len(CONTENT)),
+        photo=None,
+        answer=answer,
+    )
+    state = FakeState({"application_id": app_id, "current_doc_type": "passport"})
+    asyncio.run(agent._save_incoming_file(message, state, UploadQueue(), None, is_photo=False))
+    assert replies and replies[-1].startswith("Файл сохранён")
+
+
+def _jobs(app_id: int):
+    with session_scope() as s:
+        return [(job.kind, json.loads(job.payload)) for job in s.scalars(select(UploadJob).where(UploadJob.application_id == app_id))]
+
+
+def test_repeated_file_is_copied_on_disk(env):
+    first, second = _application("apps/first"), _application("apps/second")
+
+    _send(first, "uniq-1", "file-id-a")
+    assert env.downloads == ["file-id-a"]
+    assert len(env.disk.uploads) == 1
+
+    # Тот же файл, присланный заново (file_id у Telegram может отличаться)
+    _send(second, "uniq-1", "file-id-b")
+
+    assert env.downloads == ["file-id-a"]
+    assert len(env.disk.uploads) == 1
+    assert _jobs(second) == [(JOB_COPY, {"from_path": "apps/first/passport.pdf", "remote_dir": "apps/second", "filename": "passport.pdf"})]
+    with session_scope() as s:
+        docs = s.scalars(select(Document).where(Document.file_unique_id == "uniq-1").order_by(Document.id)).all()
+        assert [d.application_id for d in docs] == [first, second]
+        assert docs[0].sha256 == docs[1].sha256
+        assert docs[0].local_path == docs[1].local_path
+        assert docs[1].yandex_path is None
+
+
+def test_new_file_is_downloaded(env):
+    app_id = _application("apps/other")
+
+    _send(app_id, "uniq-2", "file-id-c")
+
+    assert env.downloads == ["file-id-c"]
+    assert len(env.disk.uploads) == 1
+    assert _jobs(app_id) == []
+
+
+def test_failed_download_closes_streaming_upload(env, monkeypatch):
+    """Обрыв скачивания: потоковая загрузка на Диск отменена и завершена до выхода"""
+    finished = []
+
+    async def broken_chunks(bot, file_id, chunk_size):
+        yield CONTENT[:chunk_size]
+        raise ConnectionError("telegram connection reset")
+
+    async def upload_stream(href, chunks):
+        try:
+            async for _ in chunks:
+                pass
+        finally:
+            finished.append(href)
+
+    monkeypatch.setattr(storage, "telegram_chunks", broken_chunks)
+    monkeypatch.setattr(env.disk, "upload_stream", upload_stream)
+
+    async def save():
+        with pytest.raises(ConnectionError):
+            await storage.save_telegram_file(None, "file-id-d", "passport.pdf", remote_dir="apps/broken", chunk_size=1024)
+        return list(finished)
+
+    assert asyncio.run(save()) == ["https://uploader.example/apps/broken/passport.pdf"]
+    assert list((storage.BLOB_ROOT / "tmp").iterdir()) == []
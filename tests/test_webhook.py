@@ -0,0 +1,68 @@
+"""Webhook-обработчик: проверка секрета и ограничение обновлений в обработке"""
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.services.webhook import UpdateHandler
+
+SECRET = "test-secret"
+
+
+def _update(n: int) -> dict:
+    return {
+        "update_id": n,
+        "message": {
+            "message_id": n,
+            "date": 0,
+            "chat": {"id": 100, "type": "private"},
+            "from": {"id": 100, "is_bot": False, "first_name": "Агент"},
+            "text": f"/start {n}",
+        },
+    }
+
+
+def _run(scenario, max_concurrent: int = 32):
+    async def main():
+        dp = Dispatcher()
+        seen = []
+        release = asyncio.Event()
+
+        @dp.message()
+        async def on_message(message: Message):
+            seen.append(message.text)
+            await release.wait()
+
+        handler = UpdateHandler(dp, Bot("42:test"), SECRET, max_concurrent=max_concurrent)
+        app = web.Application()
+        handler.register(app, "/webhook")
+        async with TestClient(TestServer(app)) as client:
+            return await scenario(client, handler, seen, release)
+
+    return asyncio.run(main())
+
+
+def test_bad_secret_is_rejected():
+    async def scenario(client, handler, seen, release):
+        response = await client.post("/webhook", json=_update(1), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+        return response.status, handler.rejected, handler.received
+
+    assert _run(scenario) == (401, 1, 0)
+
+
+def test_updates_wait_for_a_free_slot():
+    async def scenario(client, handler, seen, release):
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        first = await client.post("/webhook", json=_update(1), headers=headers)
+        # Второй запрос ждёт, пока первое обновление не освободит слот
+        second = asyncio.create_task(client.post("/webhook", json=_update(2), headers=headers))
+        await asyncio.sleep(0.1)
+        waiting = not second.done()
+        release.set()
+        await second
+        await handler.drain(timeout=5)
+        return first.status, waiting, seen, handler.processed, handler.max_in_flight
+
+    assert _run(scenario, max_concurrent=1) == (200, True, ["/start 1", "/start 2"], 2, 1)
@@ -0,0 +1,37 @@
+"""Клиент Яндекс.Диска: ожидание асинхронных операций"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.yandex_disk import YandexDiskClient, YandexDiskError
+
+
+def _client(statuses):
+    """Клиент, у которого /resources/copy отвечает 202, а операция — статусами по очереди"""
+    polls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/resources/copy"):
+            return httpx.Response(202, json={"href": "https://cloud-api.yandex.net/v1/disk/operations/1"})
+        polls.append(request.url.path)
+        return httpx.Response(200, json={"status": statuses[min(len(polls), len(statuses)) - 1]})
+
+    client = YandexDiskClient("token", upload_timeout=0.2)
+    client._client = httpx.AsyncClient(base_url="https://cloud-api.yandex.net/v1/disk", transport=httpx.MockTransport(handler))
+    return client, polls
+
+
+def test_copy_waits_for_operation():
+    client, polls = _client(["in-progress", "success"])
+
+    asyncio.run(client.copy("a.pdf", "b.pdf"))
+
+    assert len(polls) == 2
+
+
+def test_stuck_operation_times_out():
+    client, polls = _client(["in-progress"])
+
+    with pytest.raises(YandexDiskError, match="не завершилась"):
+        asyncio.run(client.copy("a.pdf", "b.pdf"))